@@ -1,9 +1,19 @@
-from flask import render_template, request, redirect, url_for, session, flash, jsonify
+from flask import render_template, request, redirect, url_for, session, flash, jsonify, Response
 from app import app, db
-from models import Admin, Product, Category, Order, Customer, Contact, OrderItem
+from models import Admin, Product, Category, Order, Customer, Contact, OrderItem, ArchivedOrder, ArchivedOrderItem, ApiToken
 from forms import LoginForm, ProductForm, OrderStatusForm
 from werkzeug.security import check_password_hash
-from utils import save_uploaded_file
+from utils import save_uploaded_file, save_uploaded_files
+from gallery import add_product_images
+from ratelimit import rate_limit
+from db_routing import read_only
+from sqlite_mode import write_transaction
+from customers import customer_search_filter
+from orders import ORDER_STATUSES, update_order_status, bulk_update_order_status
+from event_stream import broadcaster
+from api_tokens import SCOPES, DEFAULT_DAYS, issue_token, revoke_token
+from archive import search_orders, sales_by_wilaya, revenue_by_month, top_selling_products, include_archive_arg
+from analytics import customer_reports, COHORT_MONTHS
 import json
 from datetime import datetime, timedelta
 from sqlalchemy import func
@@ -20,6 +30,7 @@ def admin_required(f):
     return decorated_function
 
 @app.route('/admin/login', methods=['GET', 'POST'])
+@rate_limit('login')
 def admin_login():
     if 'admin_id' in session:
         return redirect(url_for('admin_dashboard'))
@@ -118,31 +129,37 @@ def admin_add_product():
         form.category_id.choices = [(c.id, c.name_ar) for c in categories]
     
     if form.validate_on_submit():
-        # Handle image upload
-        image_filename = None
-        if form.image.data:
-            image_filename = save_uploaded_file(form.image.data)
-        
-        product = Product(
-            name=form.name.data,
-            name_ar=form.name_ar.data,
-            description=form.description.data,
-            description_ar=form.description_ar.data,
-            price=form.price.data,
-            category_id=form.category_id.data,
-            image_url=image_filename,
-            in_stock=form.in_stock.data,
-            featured=form.featured.data
-        )
-        
-        db.session.add(product)
-        db.session.commit()
+        # Uploads are saved before the write transaction: it may be re-run,
+        # and the SQLite write lock should not wait on file I/O
+        image_filename = save_uploaded_file(form.image.data) if form.image.data else None
+        gallery = save_uploaded_files(form.gallery.data)
+        db.session.rollback()  # end the read transaction, the write begins IMMEDIATE
+        _create_product(form, image_filename, gallery)
         
         flash('تم إضافة المنتج بنجاح', 'success')
         return redirect(url_for('admin_products'))
     
     return render_template('admin/product_form.html', form=form, title='إضافة منتج جديد')
 
+@write_transaction
+def _create_product(form, image_filename, gallery):
+    product = Product(
+        name=form.name.data,
+        name_ar=form.name_ar.data,
+        description=form.description.data,
+        description_ar=form.description_ar.data,
+        price=form.price.data,
+        category_id=form.category_id.data,
+        image_url=image_filename,
+        in_stock=form.in_stock.data,
+        stock=form.stock.data,
+        featured=form.featured.data
+    )
+    add_product_images(product, gallery)
+    
+    db.session.add(product)
+    db.session.commit()
+
 @app.route('/admin/products/edit/<int:id>', methods=['GET', 'POST'])
 @admin_required
 def admin_edit_product(id):
@@ -154,35 +171,51 @@ def admin_edit_product(id):
     form.category_id.choices = [(c.id, c.name_ar) for c in categories]
     
     if form.validate_on_submit():
-        # Handle image upload
-        if form.image.data:
-            image_filename = save_uploaded_file(form.image.data)
-            product.image_url = image_filename
-        
-        product.name = form.name.data
-        product.name_ar = form.name_ar.data
-        product.description = form.description.data
-        product.description_ar = form.description_ar.data
-        product.price = form.price.data
-        product.category_id = form.category_id.data
-        product.in_stock = form.in_stock.data
-        product.featured = form.featured.data
-        product.updated_at = datetime.utcnow()
-        
-        db.session.commit()
+        # Uploads first, outside the retried write (see admin_add_product)
+        image_filename = save_uploaded_file(form.image.data) if form.image.data else None
+        gallery = save_uploaded_files(form.gallery.data)
+        db.session.rollback()
+        _update_product(id, form, image_filename, gallery)
         
         flash('تم تحديث المنتج بنجاح', 'success')
         return redirect(url_for('admin_products'))
     
     return render_template('admin/product_form.html', form=form, product=product, title='تعديل المنتج')
 
+@write_transaction
+def _update_product(id, form, image_filename, gallery):
+    product = Product.query.get_or_404(id)
+    if image_filename:
+        product.image_url = image_filename
+    
+    product.name = form.name.data
+    product.name_ar = form.name_ar.data
+    product.description = form.description.data
+    product.description_ar = form.description_ar.data
+    product.price = form.price.data
+    product.category_id = form.category_id.data
+    product.in_stock = form.in_stock.data
+    product.stock = form.stock.data  # overrides in_stock when set
+    product.featured = form.featured.data
+    product.updated_at = datetime.utcnow()
+    
+    # Gallery: drop the ticked images, then append the new uploads
+    remove_ids = set(request.form.getlist('remove_images', type=int))
+    for image in [image for image in product.images if image.id in remove_ids]:
+        product.images.remove(image)
+    add_product_images(product, gallery)
+    
+    db.session.commit()
+
 @app.route('/admin/products/delete/<int:id>', methods=['POST'])
 @admin_required
+@write_transaction
 def admin_delete_product(id):
     product = Product.query.get_or_404(id)
     
     # Check if product has orders
-    if OrderItem.query.filter_by(product_id=id).first():
+    if (OrderItem.query.filter_by(product_id=id).first()
+            or ArchivedOrderItem.query.filter_by(product_id=id).first()):
         flash('لا يمكن حذف المنتج لأنه مرتبط بطلبات موجودة', 'error')
         return redirect(url_for('admin_products'))
     
@@ -197,32 +230,70 @@ def admin_delete_product(id):
 def admin_orders():
     page = request.args.get('page', 1, type=int)
     status_filter = request.args.get('status', '')
+    search = request.args.get('search', '').strip()
+    archived = False
     
-    query = Order.query
+    query = search_orders(Order, search) if search else Order.query
     
     if status_filter:
-        query = query.filter_by(status=status_filter)
+        query = query.filter(Order.status == status_filter)
     
     orders = query.order_by(Order.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False)
     
-    return render_template('admin/orders.html', orders=orders, status_filter=status_filter)
+    # Old delivered orders live in the archive, search it when nothing current matches
+    if search and not orders.total and status_filter in ('', 'delivered'):
+        archived = True
+        orders = search_orders(ArchivedOrder, search).order_by(ArchivedOrder.created_at.desc()).paginate(
+            page=page, per_page=20, error_out=False)
+    
+    return render_template('admin/orders.html', orders=orders, status_filter=status_filter,
+                         search_query=search, archived=archived)
 
 @app.route('/admin/orders/<int:id>/update_status', methods=['POST','GET'])
 @admin_required
+@write_transaction
 def admin_update_order_status(id):
     order = Order.query.get_or_404(id)
     form = OrderStatusForm()
     
     if form.validate_on_submit():
-        order.status = form.status.data
-        order.updated_at = datetime.utcnow()
+        update_order_status(order, form.status.data)
         db.session.commit()
         
         flash('تم تحديث حالة الطلب بنجاح', 'success')
     
     return redirect(url_for('admin_orders'))
 
+@app.route('/admin/orders/bulk_status', methods=['POST'])
+@admin_required
+@write_transaction
+def admin_bulk_update_order_status():
+    status = request.form.get('status')
+    order_ids = request.form.getlist('order_ids', type=int)
+    
+    if status not in ORDER_STATUSES or not order_ids:
+        flash('يرجى اختيار الطلبات والحالة الجديدة', 'error')
+        return redirect(request.referrer or url_for('admin_orders'))
+    
+    results = bulk_update_order_status(order_ids, status)
+    db.session.commit()
+    
+    updated = sum(1 for result in results.values() if result == 'updated')
+    flash(f'تم تحديث حالة {updated} طلب من أصل {len(results)}', 'success')
+    return redirect(request.referrer or url_for('admin_orders'))
+
+@app.route('/admin/events')
+@admin_required
+def admin_events():
+    """Server-Sent Events stream of new orders and status changes"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    backlog = broadcaster.backlog(last_event_id) if last_event_id is not None else []
+    
+    return Response(broadcaster.stream(last_event_id, backlog),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/admin/customers')
 @admin_required
 def admin_customers():
@@ -232,8 +303,7 @@ def admin_customers():
     query = Customer.query
     
     if search:
-        query = query.filter(Customer.name.contains(search) | 
-                           Customer.phone.contains(search))
+        query = query.filter(customer_search_filter(search))
     
     customers = query.order_by(Customer.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False)
@@ -242,50 +312,38 @@ def admin_customers():
 
 @app.route('/admin/analytics')
 @admin_required
+@read_only
 def admin_analytics():
-    # Sales by province
-    sales_by_province_raw = db.session.query(
-        Order.wilaya,
-        func.count(Order.id).label('total_orders'),
-        func.sum(Order.total_amount).label('total_revenue')
-    ).group_by(Order.wilaya).order_by(func.sum(Order.total_amount).desc()).all()
+    # Archived orders are counted through their daily rollups
+    include_archive = include_archive_arg(request.args)
 
+    # Sales by province
     sales_by_province = [
         {
-            "wilaya": row[0],
-            "total_orders": int(row[1]),
-            "total_revenue": float(row[2])
+            "wilaya": wilaya,
+            "total_orders": total_orders,
+            "total_revenue": total_revenue
         }
-        for row in sales_by_province_raw
+        for wilaya, total_orders, total_revenue in sales_by_wilaya(include_archive)
     ]
 
     # Monthly revenue
-    monthly_revenue_raw = db.session.query(
-        func.strftime("%Y-%m", Order.created_at).label("month"),
-        func.sum(Order.total_amount).label("revenue")
-    ).group_by("month").order_by("month").all()
-
     monthly_revenue = [
-        {"month": row[0], "revenue": float(row[1])} for row in monthly_revenue_raw
+        {"month": month, "revenue": revenue} for month, revenue in revenue_by_month(include_archive)
     ]
 
     # Top products
-    top_products_raw = db.session.query(
-        Product.name_ar,
-        func.sum(OrderItem.quantity).label("total_sold"),
-        func.sum(OrderItem.quantity * OrderItem.price).label("total_revenue")
-    ).join(OrderItem.product).group_by(Product.id).order_by(func.sum(OrderItem.quantity).desc()).limit(10).all()
-
     top_products = [
-        {"name": row[0], "total_sold": int(row[1]), "total_revenue": float(row[2])}
-        for row in top_products_raw
+        {"name": product.name_ar, "total_sold": total_sold, "total_revenue": total_revenue}
+        for product, total_sold, total_revenue in top_selling_products(10, include_archive)
     ]
 
     return render_template(
         "admin/analytics.html",
         sales_by_province=sales_by_province,
         monthly_revenue=monthly_revenue,
-        top_products=top_products
+        top_products=top_products,
+        include_archive=include_archive
     )
 
     
@@ -311,3 +369,53 @@ def admin_analytics():
                          top_products=top_products,
                          sales_by_province=sales_by_province,
                          monthly_revenue=monthly_revenue)
+
+@app.route('/admin/analytics/reports')
+@admin_required
+@read_only
+def admin_analytics_reports():
+    # Live and archived orders alike, cohorts need the whole history
+    months = min(max(request.args.get('months', COHORT_MONTHS, type=int), 1), 36)
+    try:
+        reports = customer_reports(months)
+    except RuntimeError:
+        flash('تقارير العملاء تتطلب تثبيت مكتبة numpy على الخادم', 'error')
+        return redirect(url_for('admin_analytics'))
+    return render_template('admin/analytics_reports.html', reports=reports, months=months)
+
+@app.route('/admin/api_tokens', methods=['GET', 'POST'])
+@admin_required
+def admin_api_tokens():
+    new_token = None
+    
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        scopes = request.form.getlist('scopes')
+        days = request.form.get('days', DEFAULT_DAYS, type=int)
+        
+        if not name or not scopes or not days or days < 1:
+            flash('يرجى إدخال اسم الرمز واختيار صلاحية واحدة على الأقل', 'error')
+        else:
+            try:
+                admin = db.session.get(Admin, session['admin_id'])
+                record, new_token = issue_token(admin, name, scopes, days)
+                db.session.commit()
+                flash('تم إنشاء الرمز. انسخه الآن، لن يظهر مرة أخرى', 'success')
+            except ValueError:
+                flash('صلاحيات غير صالحة', 'error')
+    
+    tokens = ApiToken.query.order_by(ApiToken.created_at.desc()).all()
+    return render_template('admin/api_tokens.html', tokens=tokens, scopes=SCOPES,
+                         default_days=DEFAULT_DAYS, new_token=new_token, now=datetime.utcnow())
+
+@app.route('/admin/api_tokens/<int:id>/revoke', methods=['POST'])
+@admin_required
+def admin_revoke_api_token(id):
+    record = ApiToken.query.get_or_404(id)
+    
+    if not record.revoked_at:
+        revoke_token(record)
+        db.session.commit()
+        flash('تم إلغاء الرمز', 'success')
+    
+    return redirect(url_for('admin_api_tokens'))
@@ -0,0 +1,336 @@
+"""Customer reports computed in memory from a columnar snapshot of all orders.
+
+Cohort retention, repeat purchases, basket size by wilaya and the weekday x
+hour heatmap need per-customer and per-order passes that portable SQL does
+badly. The snapshot keeps one NumPy array per column for every order, live
+and archived (archiving keeps the id), and each report is a few vectorized
+passes over it.
+
+A refresh only reads ids past the last one loaded. That relies on nothing
+rewriting the columns kept here (customer_id, created_at, wilaya,
+total_amount, item quantities) on existing orders: checkout writes them
+once, status edits in orders.py leave them alone, and ``customers-dedupe``,
+which moves orders to another customer, rebuilds the snapshot itself. Any
+new edit of those columns must do the same, see the note in orders.py. The snapshot is saved to
+ANALYTICS_SNAPSHOT_PATH so a new worker starts from the file instead of
+reading every order, and ``flask analytics-snapshot`` rebuilds it from
+scratch (e.g. nightly).
+"""
+import os
+import time
+import logging
+import threading
+import click
+from sqlalchemy import func, select, union_all
+from app import app, db
+from models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+
+try:
+    import numpy as np
+except ImportError:  # the reports page says so, the rest of the admin works
+    np = None
+
+LOAD_BATCH_SIZE = 50000
+# ids handed out before the last loaded one can commit after it on PostgreSQL
+REFETCH_OVERLAP = 500
+REFRESH_INTERVAL = 5  # seconds between database checks for new orders
+COHORT_MONTHS = 12
+WEEKDAYS = ['الإثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة', 'السبت', 'الأحد']
+COLUMNS = {
+    'id': 'i4',
+    'customer_id': 'i4',
+    'created_at': 'datetime64[s]',  # UTC, as stored
+    'wilaya': 'i2',  # index into the wilayas list
+    'total_amount': 'f8',
+    'units': 'i4',
+}
+
+
+def _order_rows(after_id, limit):
+    # One statement over both tables: an order archived meanwhile is read exactly once
+    orders = union_all(
+        select(Order.id, Order.customer_id, Order.created_at, Order.wilaya, Order.total_amount)
+        .where(Order.id > after_id),
+        select(ArchivedOrder.id, ArchivedOrder.customer_id, ArchivedOrder.created_at,
+               ArchivedOrder.wilaya, ArchivedOrder.total_amount)
+        .where(ArchivedOrder.id > after_id)).subquery()
+    return db.session.execute(select(orders).order_by(orders.c.id).limit(limit)).all()
+
+
+def _units(first_id, last_id):
+    items = union_all(
+        select(OrderItem.order_id, OrderItem.quantity)
+        .where(OrderItem.order_id.between(first_id, last_id)),
+        select(ArchivedOrderItem.order_id, ArchivedOrderItem.quantity)
+        .where(ArchivedOrderItem.order_id.between(first_id, last_id))).subquery()
+    return db.session.execute(
+        select(items.c.order_id, func.sum(items.c.quantity)).group_by(items.c.order_id)).all()
+
+
+class OrderSnapshot:
+    """All orders as parallel NumPy arrays sorted by id, see the module docstring"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.columns = None
+        self.wilayas = []
+        self.built_at = 0.0
+        self.checked_at = 0.0
+        self.file_mtime = None
+
+    @property
+    def path(self):
+        return app.config.get('ANALYTICS_SNAPSHOT_PATH') or os.path.join(app.instance_path, 'analytics_snapshot.npz')
+
+    def __len__(self):
+        return len(self.columns['id']) if self.columns else 0
+
+    def _empty(self):
+        return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    def _load_since(self, after_id):
+        """Columns of the orders with an id past ``after_id``"""
+        codes = {name: code for code, name in enumerate(self.wilayas)}
+        chunks = []
+        while True:
+            rows = _order_rows(after_id, LOAD_BATCH_SIZE)
+            if not rows:
+                break
+            ids, customers, created, wilayas, totals = zip(*rows)
+            for name in wilayas:
+                if name not in codes:
+                    codes[name] = len(self.wilayas)
+                    self.wilayas.append(name)
+            chunk = {
+                'id': np.array(ids, dtype='i4'),
+                'customer_id': np.array(customers, dtype='i4'),
+                'created_at': np.array(created, dtype='datetime64[s]'),
+                'wilaya': np.array([codes[name] for name in wilayas], dtype='i2'),
+                'total_amount': np.array(totals, dtype='f8'),
+                'units': np.zeros(len(rows), dtype='i4'),
+            }
+            units = _units(ids[0], ids[-1])
+            if units:
+                order_ids, quantities = zip(*units)
+                # Items of orders not in this chunk (committed since) are dropped by the mask
+                positions = np.searchsorted(chunk['id'], np.array(order_ids, dtype='i4'))
+                positions = np.minimum(positions, len(rows) - 1)
+                found = chunk['id'][positions] == np.array(order_ids, dtype='i4')
+                chunk['units'][positions[found]] = np.array(quantities, dtype='i4')[found]
+            chunks.append(chunk)
+            after_id = ids[-1]
+            if len(rows) < LOAD_BATCH_SIZE:
+                break
+        if not chunks:
+            return self._empty()
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in COLUMNS}
+
+    def rebuild(self):
+        """Read every order again and save the snapshot, returns the order count"""
+        if np is None:
+            raise RuntimeError('The analytics reports need numpy installed')
+        with self.lock:
+            self.wilayas = []
+            self.columns = self._load_since(0)
+            self.built_at = time.time()
+            self.checked_at = time.monotonic()
+            self._save()
+            return len(self)
+
+    def _append(self, new):
+        known = np.isin(new['id'], self.columns['id'][-REFETCH_OVERLAP:])
+        if known.all():
+            return 0
+        new = {name: values[~known] for name, values in new.items()}
+        late = len(self) and new['id'][0] < self.columns['id'][-1]
+        self.columns = {name: np.concatenate([self.columns[name], new[name]]) for name in COLUMNS}
+        if late:
+            order = np.argsort(self.columns['id'], kind='stable')
+            self.columns = {name: values[order] for name, values in self.columns.items()}
+        return len(new['id'])
+
+    def refresh(self):
+        """Bring the snapshot up to date, from the file when another process rebuilt it"""
+        if np is None:
+            raise RuntimeError('The analytics reports need numpy installed')
+        with self.lock:
+            if self.columns is not None and time.monotonic() - self.checked_at < REFRESH_INTERVAL:
+                return self
+            self._reload_file()
+            if self.columns is None:
+                self.columns = self._empty()
+                self.built_at = time.time()
+            last_id = int(self.columns['id'][-1]) if len(self) else 0
+            added = self._append(self._load_since(max(last_id - REFETCH_OVERLAP, 0)))
+            self.checked_at = time.monotonic()
+            # Saved after a sizeable catch-up, so the next worker starts close to current
+            if added >= LOAD_BATCH_SIZE:
+                self._save()
+            return self
+
+    def _reload_file(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self.file_mtime:
+            return
+        self.file_mtime = mtime
+        with np.load(self.path, allow_pickle=False) as data:
+            built_at = float(data['built_at'])
+            if self.columns is not None and built_at <= self.built_at:
+                return
+            self.columns = {name: data[name] for name in COLUMNS}
+            self.wilayas = data['wilayas'].tolist()
+            self.built_at = built_at
+        logging.info("Analytics snapshot: loaded %d orders from %s", len(self), self.path)
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, built_at=np.float64(self.built_at),
+                 wilayas=np.array(self.wilayas, dtype=str), **self.columns)
+        os.replace(tmp_path, self.path)
+        self.file_mtime = os.stat(self.path).st_mtime
+
+    # Reports, each a dict ready for jsonify
+
+    def _local(self):
+        # created_at is UTC; Algeria is UTC+1 all year
+        offset = np.timedelta64(app.config.get('ANALYTICS_UTC_OFFSET_MINUTES', 60), 'm')
+        return self.columns['created_at'] + offset
+
+    def _first_orders(self, mask=None):
+        """Row of each customer's earliest order, among the rows in ``mask`` when given.
+
+        Customer ids are dense, so per-customer values live in arrays indexed
+        by customer id, filled with ufunc.at instead of sorting.
+        """
+        customers = self.columns['customer_id']
+        created = self.columns['created_at'].astype('i8')
+        if mask is None:
+            mask = np.ones(len(customers), dtype=bool)
+        earliest = np.full(int(customers.max()) + 1, np.iinfo('i8').max, dtype='i8')
+        np.minimum.at(earliest, customers[mask], created[mask])
+        # The lowest row among orders placed in the same second
+        mask = mask & (created == earliest[customers])
+        first = np.full(len(earliest), len(customers), dtype='i8')
+        np.minimum.at(first, customers[mask], np.flatnonzero(mask))
+        return first
+
+    def cohort_retention(self, months=COHORT_MONTHS):
+        """Share of each first-order month's customers ordering again N months later"""
+        if not len(self):
+            return {'cohorts': [], 'months': months}
+        customers = self.columns['customer_id']
+        month = self._local().astype('datetime64[M]').astype('i8')
+        first = np.full(int(customers.max()) + 1, np.iinfo('i8').max, dtype='i8')
+        np.minimum.at(first, customers, month)
+        start = int(month.max()) - months + 1
+        cohort = first[customers] - start
+        offset = month - first[customers]
+        keep = (cohort >= 0) & (offset < months)
+
+        # A customer counts once per month whatever the number of orders;
+        # sort + neighbour compare, np.unique is far slower on int64 keys
+        active = np.sort(customers[keep].astype('i8') * months + offset[keep])
+        active = active[np.concatenate(([True], active[1:] != active[:-1]))]
+        active_cohort = first[active // months] - start
+        grid = np.bincount(active_cohort * months + active % months, minlength=months * months) \
+            .reshape(months, months)
+        sizes = grid[:, 0]
+        rates = np.divide(grid, sizes[:, None], out=np.zeros(grid.shape), where=sizes[:, None] > 0)
+        return {
+            'months': months,
+            'cohorts': [{
+                'month': str(np.datetime64(start + row, 'M')),
+                'customers': int(sizes[row]),
+                # Only the months that have already happened for this cohort
+                'retention': [round(float(rate), 4) for rate in rates[row, :months - row]],
+            } for row in range(months) if sizes[row]]
+        }
+
+    def repeat_purchases(self):
+        """How many customers came back, and what they are worth"""
+        if not len(self):
+            return {'customers': 0, 'repeat_customers': 0, 'repeat_rate': 0, 'repeat_revenue_share': 0,
+                    'orders_per_customer': [], 'median_days_to_second_order': None}
+        customer_ids = self.columns['customer_id']
+        counts = np.bincount(customer_ids)
+        revenue = np.bincount(customer_ids, weights=self.columns['total_amount'])
+        buyers = counts > 0
+        repeat = counts > 1
+        total_revenue = revenue.sum()
+
+        first = self._first_orders()
+        rest = np.ones(len(customer_ids), dtype=bool)
+        rest[first[buyers]] = False
+        second = self._first_orders(rest)
+        created = self.columns['created_at']
+        gaps = (created[second[repeat]] - created[first[repeat]]).astype('f8')
+        median_days = float(np.median(gaps) / 86400) if len(gaps) else None
+
+        histogram = np.bincount(np.minimum(counts[buyers], 5), minlength=6)[1:]
+        return {
+            'customers': int(buyers.sum()),
+            'repeat_customers': int(repeat.sum()),
+            'repeat_rate': round(float(repeat.sum() / buyers.sum()), 4),
+            'repeat_revenue_share': round(float(revenue[repeat].sum() / total_revenue), 4) if total_revenue else 0,
+            'orders_per_customer': [{'orders': f"{n}+" if n == 5 else str(n), 'customers': int(c)}
+                                    for n, c in enumerate(histogram, start=1)],
+            'median_days_to_second_order': round(median_days, 1) if median_days is not None else None,
+        }
+
+    def basket_by_wilaya(self):
+        """Orders, revenue, average order value and units per order of each wilaya"""
+        size = len(self.wilayas)
+        codes = self.columns['wilaya']
+        orders = np.bincount(codes, minlength=size)
+        revenue = np.bincount(codes, weights=self.columns['total_amount'], minlength=size)
+        units = np.bincount(codes, weights=self.columns['units'], minlength=size)
+        rows = [{
+            'wilaya': self.wilayas[code],
+            'orders': int(orders[code]),
+            'revenue': float(revenue[code]),
+            'average_basket': round(float(revenue[code] / orders[code]), 2),
+            'average_units': round(float(units[code] / orders[code]), 2),
+        } for code in np.flatnonzero(orders)]
+        return sorted(rows, key=lambda row: row['orders'], reverse=True)
+
+    def weekday_heatmap(self):
+        """Orders and revenue per weekday (Monday first) and local hour"""
+        local = self._local()
+        days = local.astype('datetime64[D]').astype('i8')
+        hours = (local - local.astype('datetime64[D]')).astype('i8') // 3600
+        cell = ((days + 3) % 7) * 24 + hours  # 1970-01-01 was a Thursday
+        return {
+            'weekdays': WEEKDAYS,
+            'orders': np.bincount(cell, minlength=7 * 24).reshape(7, 24).tolist(),
+            'revenue': np.round(np.bincount(cell, weights=self.columns['total_amount'], minlength=7 * 24)
+                                .reshape(7, 24), 2).tolist(),
+        }
+
+
+snapshot = OrderSnapshot()
+
+
+def customer_reports(months=COHORT_MONTHS):
+    """Every report of the analytics page from an up to date snapshot"""
+    started = time.perf_counter()
+    current = snapshot.refresh()
+    reports = {
+        'orders': len(current),
+        'cohorts': current.cohort_retention(months),
+        'repeat': current.repeat_purchases(),
+        'wilayas': current.basket_by_wilaya(),
+        'heatmap': current.weekday_heatmap(),
+    }
+    reports['computed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return reports
+
+
+@app.cli.command('analytics-snapshot')
+def analytics_snapshot_command():
+    """Rebuild the order snapshot behind the analytics reports from the database."""
+    started = time.perf_counter()
+    count = snapshot.rebuild()
+    click.echo(f"Stored {count} orders in {snapshot.path} in {time.perf_counter() - started:.1f}s")
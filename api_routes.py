@@ -1,65 +1,155 @@
-from flask import jsonify, request, session
+import logging
+from flask import g, jsonify, request, session
 from app import app, db, csrf
-from models import Product, Category, Order, OrderItem, Customer, Admin
+from models import Product, Category, Order, OrderItem, Customer, Admin, ArchivedOrderItem
 from utils import generate_order_number
+from recommendations import get_related_products
+from popularity import SORT_OPTIONS, DEFAULT_SORT, apply_sort, record_sales
+from facets import PRICE_BANDS, parse_facet_filters, apply_facet_filters, facet_counts
+from ratelimit import rate_limit
+from db_routing import read_only
+from sqlite_mode import write_transaction
+from orders import ORDER_STATUSES, record_order_created, update_order_status, bulk_update_order_status
+from serializers import ProductSerializer
+from customers import find_or_create_customer, customer_search_filter
+from stock import reserve_stock, limit_cart, parse_stock
+from batch import BATCH_MAX_REQUESTS, parse_ids, run_subrequest
+from catalog_sync import CHANGES_PAGE_SIZE, CHANGES_MAX_PAGE_SIZE, get_changes
+from api_tokens import verify_token, required_scope
+from archive import find_order, sales_by_wilaya, top_selling_products, order_totals, include_archive_arg
+from analytics import customer_reports, COHORT_MONTHS
 from werkzeug.security import check_password_hash
 from datetime import datetime
 
+MAX_IDS_PER_REQUEST = 100
+
 # Customer API endpoints (no authentication required)
 
 @app.route('/api/products', methods=['GET'])
+@read_only
 def api_get_products():
     page = request.args.get('page', 1, type=int)
-    category_id = request.args.get('category', type=int)
     search = request.args.get('search', '')
     per_page = request.args.get('per_page', 12, type=int)
+    sort = request.args.get('sort', DEFAULT_SORT)
+    
+    if sort not in SORT_OPTIONS:
+        return jsonify({'error': f'sort must be one of: {", ".join(SORT_OPTIONS)}'}), 400
+    
+    try:
+        fields = ProductSerializer.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    query = Product.query.filter_by(in_stock=True)
+    if request.args.get('ids'):
+        return api_get_products_by_ids(fields)
     
-    if category_id:
-        query = query.filter_by(category_id=category_id)
+    filters = parse_facet_filters(request.args)
+    query = Product.query
     
     if search:
         query = query.filter(Product.name.contains(search) | 
                            Product.name_ar.contains(search))
     
-    products = query.paginate(page=page, per_page=per_page, error_out=False)
+    # Only the requested columns are selected, as plain rows
+    products = ProductSerializer.select(apply_sort(apply_facet_filters(query, filters), sort), fields).paginate(
+        page=page, per_page=per_page, error_out=False)
     
-    return jsonify({
-        'products': [{
-            'id': p.id,
-            'name': p.name,
-            'name_ar': p.name_ar,
-            'description': p.description,
-            'description_ar': p.description_ar,
-            'price': p.price,
-            'category_id': p.category_id,
-            'image_url': p.image_url,
-            'featured': p.featured
-        } for p in products.items],
+    response = {
+        'products': ProductSerializer.dump_rows(products.items, fields),
         'total': products.total,
         'pages': products.pages,
         'current_page': products.page,
         'has_next': products.has_next,
-        'has_prev': products.has_prev
+        'has_prev': products.has_prev,
+        'sort': sort
+    }
+    
+    if request.args.get('facets') == '1':
+        counts = facet_counts(query, filters)
+        response['facets'] = {
+            'categories': [{'id': category_id, 'count': count}
+                           for category_id, count in sorted(counts['category'].items())],
+            'price_ranges': [{'key': key, 'min': low, 'max': high, 'count': counts['price'][key]}
+                             for key, _, low, high in PRICE_BANDS],
+            'featured': counts['featured'],
+            'in_stock': counts['in_stock'],
+            'all_stock': counts['all_stock']
+        }
+    
+    return jsonify(response)
+
+def api_get_products_by_ids(fields):
+    """``/api/products?ids=3,1,2``: the listed products in one query, in the order asked"""
+    try:
+        ids = parse_ids(request.args['ids'], MAX_IDS_PER_REQUEST)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Carts and wishlists need out-of-stock products too, so no facet filters here
+    rows = ProductSerializer.select(Product.query.filter(Product.id.in_(ids)), fields).all()
+    found = dict(zip((row.id for row in rows), ProductSerializer.dump_rows(rows, fields)))
+    
+    return jsonify({
+        'products': [found[product_id] for product_id in ids if product_id in found],
+        'missing': [product_id for product_id in ids if product_id not in found]
+    })
+
+@app.route('/api/products/changes', methods=['GET'])
+@read_only
+def api_get_product_changes():
+    """Catalog changes since a sync token, for clients that keep a local copy.
+
+    Start with ``since=0`` (a full sync), then pass back ``next`` until
+    ``has_more`` is false and keep it for the next sync.
+    """
+    since = request.args.get('since', '0')
+    limit = min(request.args.get('limit', CHANGES_PAGE_SIZE, type=int), CHANGES_MAX_PAGE_SIZE)
+    
+    if not since.isdigit() or limit < 1:
+        return jsonify({'error': 'since must be a token returned by this endpoint'}), 400
+    
+    try:
+        fields = ProductSerializer.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    changes, next_token, has_more = get_changes(int(since), limit, ProductSerializer, fields)
+    
+    return jsonify({
+        'changes': changes,
+        'next': str(next_token),
+        'has_more': has_more
     })
 
 @app.route('/api/products/<int:id>', methods=['GET'])
+@read_only
 def api_get_product(id):
+    try:
+        fields = ProductSerializer.parse_fields(request.args.get('fields'), ProductSerializer.detail_fields)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    product = ProductSerializer.select(Product.query.filter(Product.id == id), fields).first()
+    if product is None:
+        return jsonify({'error': 'Product not found'}), 404
+    
+    return jsonify(ProductSerializer.dump_rows([product], fields)[0])
+
+@app.route('/api/products/<int:id>/related', methods=['GET'])
+@read_only
+def api_get_related_products(id):
     product = Product.query.get_or_404(id)
+    related = get_related_products(product)
+    
+    try:
+        fields = ProductSerializer.parse_fields(request.args.get('fields'), ProductSerializer.card_fields)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'id': product.id,
-        'name': product.name,
-        'name_ar': product.name_ar,
-        'description': product.description,
-        'description_ar': product.description_ar,
-        'price': product.price,
-        'category_id': product.category_id,
-        'image_url': product.image_url,
-        'additional_images': product.additional_images,
-        'in_stock': product.in_stock,
-        'featured': product.featured
+        'product_id': product.id,
+        'related': ProductSerializer.dump_objects(related, fields)
     })
 
 @app.route('/api/cart', methods=['GET'])
@@ -89,6 +179,7 @@ def api_get_cart():
 
 @app.route('/api/cart', methods=['POST'])
 @csrf.exempt
+@rate_limit('cart')
 def api_add_to_cart():
     data = request.get_json()
     product_id = data.get('product_id')
@@ -96,6 +187,10 @@ def api_add_to_cart():
     
     if not product_id:
         return jsonify({'error': 'Product ID required'}), 400
+    if isinstance(quantity, bool) or not isinstance(quantity, int):
+        return jsonify({'error': 'quantity must be an integer'}), 400
+    # Never below 1, a negative line would put units back into stock at checkout
+    quantity = max(quantity, 1)
     
     product = Product.query.get(product_id)
     if not product or not product.in_stock:
@@ -117,6 +212,8 @@ def api_add_to_cart():
     return jsonify({'message': 'Product added to cart', 'cart_count': sum(cart.values())})
 
 @app.route('/api/checkout', methods=['POST'])
+@rate_limit('checkout')
+@write_transaction
 def api_checkout():
     data = request.get_json()
     
@@ -134,7 +231,8 @@ def api_checkout():
     
     for product_id, quantity in session['cart'].items():
         product = Product.query.get(int(product_id))
-        if product and product.in_stock:
+        # Sold out tracked products stay in, reserve_stock reports them
+        if product and (product.in_stock or product.stock is not None):
             item_total = product.price * quantity
             cart_items.append({
                 'product': product,
@@ -148,15 +246,7 @@ def api_checkout():
     
     try:
         # Create or get customer
-        customer = Customer.query.filter_by(phone=data['phone']).first()
-        if not customer:
-            customer = Customer(
-                name=data['name'],
-                phone=data['phone'],
-                email=data.get('email')
-            )
-            db.session.add(customer)
-            db.session.flush()
+        customer = find_or_create_customer(data['name'], data['phone'], data.get('email'))
         
         # Create order
         order = Order(
@@ -180,6 +270,23 @@ def api_checkout():
             )
             db.session.add(order_item)
         
+        # Last before commit, so the product rows stay locked as briefly as possible
+        shortages = reserve_stock(cart_items)
+        if shortages:
+            db.session.rollback()
+            session['cart'] = limit_cart(session['cart'], shortages)
+            return jsonify({
+                'error': 'Insufficient stock',
+                'message': 'Nothing was ordered. The cart now holds the quantities still available.',
+                'unavailable': [{
+                    'product_id': s['product_id'],
+                    'requested': s['requested'],
+                    'available': s['available']
+                } for s in shortages]
+            }), 409
+        
+        record_sales(cart_items)
+        record_order_created(order, customer)
         db.session.commit()
         
         # Clear cart
@@ -193,11 +300,13 @@ def api_checkout():
         
     except Exception as e:
         db.session.rollback()
+        logging.exception("Checkout failed")
         return jsonify({'error': 'Failed to create order'}), 500
 
 @app.route('/api/orders/<order_id>', methods=['GET'])
+@rate_limit('order_lookup', methods=('GET',))
 def api_get_order(order_id):
-    order = Order.query.filter_by(order_number=order_id).first()
+    order = find_order(order_id)
     
     if not order:
         return jsonify({'error': 'Order not found'}), 404
@@ -209,6 +318,7 @@ def api_get_order(order_id):
         'address': order.address,
         'wilaya': order.wilaya,
         'created_at': order.created_at.isoformat(),
+        'archived': order.is_archived,
         'items': [{
             'product_name': item.product.name_ar,
             'quantity': item.quantity,
@@ -216,10 +326,47 @@ def api_get_order(order_id):
         } for item in order.items]
     })
 
+@app.route('/api/batch', methods=['POST'])
+@csrf.exempt
+def api_batch():
+    """Run several read-only API calls in one round trip.
+
+    Body: ``{"requests": ["/api/products?ids=1,2", "/api/cart", ...]}``. Each
+    entry is dispatched as a GET with this request's cookies and headers, and
+    the results come back in the same order.
+    """
+    data = request.get_json(silent=True) or {}
+    urls = data.get('requests')
+    
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) for url in urls):
+        return jsonify({'error': 'requests must be a non-empty list of API paths'}), 400
+    
+    limit = app.config.get('API_BATCH_MAX_REQUESTS', BATCH_MAX_REQUESTS)
+    if len(urls) > limit:
+        return jsonify({'error': f'At most {limit} requests per batch'}), 400
+    
+    responses = []
+    for url in urls:
+        status, body = run_subrequest(url)
+        responses.append({'path': url, 'status': status, 'body': body})
+    
+    return jsonify({'responses': responses})
+
 # Admin API endpoints (authentication required)
 
 def api_admin_required(f):
+    """Admin session cookie, or ``Authorization: Bearer <token>`` with the matching scope"""
     def decorated_function(*args, **kwargs):
+        authorization = request.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            claims = verify_token(authorization[7:].strip())
+            if claims is None:
+                return jsonify({'error': 'Invalid, expired or revoked token'}), 401
+            scope = required_scope(request.method, request.path)
+            if scope not in claims['s']:
+                return jsonify({'error': f'Token lacks the {scope} scope'}), 403
+            g.api_token = claims
+            return f(*args, **kwargs)
         if 'admin_id' not in session:
             return jsonify({'error': 'Authentication required'}), 401
         return f(*args, **kwargs)
@@ -227,6 +374,7 @@ def api_admin_required(f):
     return decorated_function
 
 @app.route('/api/admin/login', methods=['POST'])
+@rate_limit('login')
 def api_admin_login():
     data = request.get_json()
     username = data.get('username')
@@ -246,6 +394,7 @@ def api_admin_login():
 
 @app.route('/api/admin/products', methods=['POST'])
 @api_admin_required
+@write_transaction
 def api_admin_add_product():
     data = request.get_json()
     
@@ -253,6 +402,10 @@ def api_admin_add_product():
     for field in required_fields:
         if not data.get(field):
             return jsonify({'error': f'{field} is required'}), 400
+    try:
+        stock = parse_stock(data.get('stock'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
         product = Product(
@@ -264,6 +417,7 @@ def api_admin_add_product():
             category_id=int(data['category_id']),
             image_url=data.get('image_url'),
             in_stock=data.get('in_stock', True),
+            stock=stock,
             featured=data.get('featured', False)
         )
         
@@ -281,9 +435,19 @@ def api_admin_add_product():
 
 @app.route('/api/admin/products/<int:id>', methods=['PUT'])
 @api_admin_required
+@write_transaction
 def api_admin_update_product(id):
     product = Product.query.get_or_404(id)
     data = request.get_json()
+    stock = product.stock
+    if 'stock' in data:
+        try:
+            stock = parse_stock(data['stock'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    # Tracked stock decides availability, see Product._derive_in_stock
+    if 'in_stock' in data and stock is not None and bool(data['in_stock']) != (stock > 0):
+        return jsonify({'error': 'in_stock follows stock for tracked products, send stock instead'}), 400
     
     try:
         if 'name' in data:
@@ -300,7 +464,9 @@ def api_admin_update_product(id):
             product.category_id = int(data['category_id'])
         if 'image_url' in data:
             product.image_url = data['image_url']
-        if 'in_stock' in data:
+        if 'stock' in data:
+            product.stock = stock
+        if 'in_stock' in data and stock is None:
             product.in_stock = data['in_stock']
         if 'featured' in data:
             product.featured = data['featured']
@@ -316,11 +482,13 @@ def api_admin_update_product(id):
 
 @app.route('/api/admin/products/<int:id>', methods=['DELETE'])
 @api_admin_required
+@write_transaction
 def api_admin_delete_product(id):
     product = Product.query.get_or_404(id)
     
     # Check if product has orders
-    if OrderItem.query.filter_by(product_id=id).first():
+    if (OrderItem.query.filter_by(product_id=id).first()
+            or ArchivedOrderItem.query.filter_by(product_id=id).first()):
         return jsonify({'error': 'Cannot delete product with existing orders'}), 400
     
     try:
@@ -367,6 +535,7 @@ def api_admin_get_orders():
 
 @app.route('/api/admin/orders/<int:id>', methods=['PUT'])
 @api_admin_required
+@write_transaction
 def api_admin_update_order(id):
     order = Order.query.get_or_404(id)
     data = request.get_json()
@@ -374,13 +543,11 @@ def api_admin_update_order(id):
     if 'status' not in data:
         return jsonify({'error': 'Status is required'}), 400
     
-    valid_statuses = ['pending', 'in_delivery', 'delivered']
-    if data['status'] not in valid_statuses:
+    if data['status'] not in ORDER_STATUSES:
         return jsonify({'error': 'Invalid status'}), 400
     
     try:
-        order.status = data['status']
-        order.updated_at = datetime.utcnow()
+        update_order_status(order, data['status'])
         db.session.commit()
         
         return jsonify({'message': 'Order status updated successfully'})
@@ -389,6 +556,40 @@ def api_admin_update_order(id):
         db.session.rollback()
         return jsonify({'error': 'Failed to update order'}), 500
 
+@app.route('/api/admin/orders/bulk_status', methods=['POST'])
+@api_admin_required
+@write_transaction
+def api_admin_bulk_update_orders():
+    data = request.get_json()
+    
+    if not data or 'status' not in data:
+        return jsonify({'error': 'Status is required'}), 400
+    
+    if data['status'] not in ORDER_STATUSES:
+        return jsonify({'error': 'Invalid status'}), 400
+    
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids or not all(type(i) is int for i in ids):
+        return jsonify({'error': 'ids must be a non-empty list of order ids'}), 400
+    
+    if len(ids) > 1000:
+        return jsonify({'error': 'At most 1000 orders per request'}), 400
+    
+    try:
+        results = bulk_update_order_status(ids, data['status'])
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Order statuses updated',
+            'updated': sum(1 for result in results.values() if result == 'updated'),
+            'results': [{'id': order_id, 'result': result} for order_id, result in results.items()]
+        })
+        
+    except Exception:
+        db.session.rollback()
+        logging.exception("Bulk order status update failed")
+        return jsonify({'error': 'Failed to update orders'}), 500
+
 @app.route('/api/admin/customers', methods=['GET'])
 @api_admin_required
 def api_admin_get_customers():
@@ -399,8 +600,7 @@ def api_admin_get_customers():
     query = Customer.query
     
     if search:
-        query = query.filter(Customer.name.contains(search) | 
-                           Customer.phone.contains(search))
+        query = query.filter(customer_search_filter(search))
     
     customers = query.order_by(Customer.created_at.desc()).paginate(
         page=page, per_page=per_page, error_out=False)
@@ -422,47 +622,43 @@ def api_admin_get_customers():
 
 @app.route('/api/admin/analytics', methods=['GET'])
 @api_admin_required
+@read_only
 def api_admin_get_analytics():
-    from sqlalchemy import func
-    from datetime import datetime, timedelta
-    
     # Basic stats
     total_products = Product.query.count()
-    total_orders = Order.query.count()
     total_customers = Customer.query.count()
-    total_revenue = db.session.query(func.sum(Order.total_amount)).scalar() or 0
-    
-    # Top products
-    top_products = db.session.query(
-        Product.name_ar,
-        func.sum(OrderItem.quantity).label('total_sold')
-    ).join(OrderItem).group_by(Product.id).order_by(
-        func.sum(OrderItem.quantity).desc()
-    ).limit(10).all()
-    
-    # Sales by province
-    sales_by_province = db.session.query(
-        Order.wilaya,
-        func.count(Order.id).label('order_count'),
-        func.sum(Order.total_amount).label('total_revenue')
-    ).group_by(Order.wilaya).order_by(
-        func.sum(Order.total_amount).desc()
-    ).limit(10).all()
+    # Archived orders are counted through their daily rollups unless ?archive=0
+    include_archive = include_archive_arg(request.args)
+    total_orders, total_revenue = order_totals(include_archive)
     
     return jsonify({
         'total_products': total_products,
         'total_orders': total_orders,
         'total_customers': total_customers,
         'total_revenue': float(total_revenue),
+        'includes_archive': include_archive,
         'top_products': [
-            {'name': p.name_ar, 'sold': p.total_sold} 
-            for p in top_products
+            {'name': product.name_ar, 'sold': sold}
+            for product, sold, _ in top_selling_products(10, include_archive)
         ],
         'sales_by_province': [
             {
-                'province': s.wilaya,
-                'order_count': s.order_count,
-                'revenue': float(s.total_revenue)
-            } for s in sales_by_province
+                'province': wilaya,
+                'order_count': order_count,
+                'revenue': revenue
+            } for wilaya, order_count, revenue in sales_by_wilaya(include_archive)[:10]
         ]
     })
+
+@app.route('/api/admin/analytics/reports', methods=['GET'])
+@api_admin_required
+@read_only
+def api_admin_get_analytics_reports():
+    # Cohort retention, repeat purchases, basket by wilaya and the weekday x hour heatmap
+    months = request.args.get('months', COHORT_MONTHS, type=int)
+    if not months or not 1 <= months <= 36:
+        return jsonify({'error': 'months must be between 1 and 36'}), 400
+    try:
+        return jsonify(customer_reports(months))
+    except RuntimeError as e:
+        return jsonify({'error': 'Analytics unavailable', 'message': str(e)}), 503
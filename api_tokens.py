@@ -0,0 +1,157 @@
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import click
+from flask.cli import AppGroup
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import app, db
+from models import Admin, ApiToken
+
+# <resource>:read for GET, <resource>:write for everything else, under /api/admin/<resource>
+SCOPES = ['products:read', 'products:write', 'orders:read', 'orders:write',
+          'customers:read', 'analytics:read']
+TOKEN_PREFIX = 'dlx_'
+DEFAULT_DAYS = 90
+REVOCATION_REFRESH = 30  # seconds a worker may keep accepting a just-revoked token
+
+
+def _serializer():
+    return URLSafeSerializer(app.secret_key, salt='admin-api-token')
+
+
+def issue_token(admin, name, scopes, days=DEFAULT_DAYS):
+    """Create a token row and return (ApiToken, token string). The caller commits."""
+    unknown = set(scopes) - set(SCOPES)
+    if unknown or not scopes:
+        raise ValueError(f"Scopes must be among: {', '.join(SCOPES)}")
+    record = ApiToken(name=name, admin_id=admin.id, scopes=' '.join(sorted(set(scopes))),
+                      expires_at=datetime.utcnow() + timedelta(days=days))
+    db.session.add(record)
+    db.session.flush()
+    claims = {'t': record.id, 'a': admin.id, 's': record.scopes.split(),
+              'e': int(record.expires_at.replace(tzinfo=timezone.utc).timestamp())}
+    return record, TOKEN_PREFIX + _serializer().dumps(claims)
+
+
+@lru_cache(maxsize=1024)
+def _decode(token):
+    # The signature check only depends on the token, so each one is verified once per worker
+    if not token.startswith(TOKEN_PREFIX):
+        return None
+    try:
+        claims = _serializer().loads(token[len(TOKEN_PREFIX):])
+    except BadSignature:
+        return None
+    return claims if isinstance(claims, dict) else None
+
+
+class RevocationCache:
+    """Ids of revoked tokens, reloaded from the database at most every REVOCATION_REFRESH seconds"""
+
+    def __init__(self):
+        self._revoked = frozenset()
+        self._loaded_at = float('-inf')
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def is_revoked(self, token_id):
+        if time.monotonic() - self._loaded_at > REVOCATION_REFRESH:
+            self.reload()
+        return token_id in self._revoked
+
+    def reload(self):
+        with self._lock:
+            if time.monotonic() - self._loaded_at <= REVOCATION_REFRESH:
+                return
+            generation = self._generation
+            ids = db.session.query(ApiToken.id).filter(ApiToken.revoked_at.isnot(None)).all()
+            self._revoked = frozenset(token_id for (token_id,) in ids)
+            # A revocation committed while we read may be missing, so keep it stale then
+            if generation == self._generation:
+                self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        self._generation += 1
+        self._loaded_at = float('-inf')
+
+
+revocations = RevocationCache()
+
+
+def verify_token(token):
+    """Claims of a valid, unexpired and unrevoked token, or None"""
+    claims = _decode(token)
+    if claims is None or claims.get('e', 0) < time.time() or revocations.is_revoked(claims.get('t')):
+        return None
+    return claims
+
+
+def required_scope(method, path):
+    resource = path.split('/')[3] if path.count('/') >= 3 else ''
+    return f"{resource}:{'read' if method in ('GET', 'HEAD') else 'write'}"
+
+
+def revoke_token(record):
+    """Revoke a token. The caller commits.
+
+    This worker stops accepting it once the commit is done, the others
+    within REVOCATION_REFRESH.
+    """
+    record.revoked_at = datetime.utcnow()
+    db.session.info['tokens_revoked'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_revocations(session):
+    # Not before the commit, a reload in between would cache the old set again
+    if session.info.pop('tokens_revoked', False):
+        revocations.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_revocations(session):
+    session.info.pop('tokens_revoked', None)
+
+
+tokens_cli = AppGroup('api-tokens', help='Manage admin API bearer tokens.')
+app.cli.add_command(tokens_cli)
+
+
+@tokens_cli.command('create')
+@click.option('--admin', 'username', required=True, help='Admin the token acts as.')
+@click.option('--name', required=True, help='What the token is for, e.g. "stock sync".')
+@click.option('--scope', 'scopes', multiple=True, required=True, type=click.Choice(SCOPES))
+@click.option('--days', default=DEFAULT_DAYS, show_default=True)
+def create_token_command(username, name, scopes, days):
+    """Create a token. It is shown once and cannot be recovered."""
+    admin = Admin.query.filter_by(username=username).first()
+    if admin is None:
+        raise click.ClickException(f"No admin named {username}")
+    record, token = issue_token(admin, name, scopes, days)
+    db.session.commit()
+    click.echo(f"Token {record.id} ({record.scopes}), expires {record.expires_at:%Y-%m-%d}:")
+    click.echo(token)
+
+
+@tokens_cli.command('list')
+def list_tokens_command():
+    """List tokens and their state."""
+    now = datetime.utcnow()
+    for record in ApiToken.query.order_by(ApiToken.id):
+        state = 'revoked' if record.revoked_at else ('expired' if record.expires_at < now else 'active')
+        click.echo(f"{record.id:4}  {state:8}  {record.expires_at:%Y-%m-%d}  {record.name}  [{record.scopes}]")
+
+
+@tokens_cli.command('revoke')
+@click.argument('token_id', type=int)
+def revoke_token_command(token_id):
+    """Revoke a token by id."""
+    record = db.session.get(ApiToken, token_id)
+    if record is None:
+        raise click.ClickException(f"No token {token_id}")
+    revoke_token(record)
+    db.session.commit()
+    click.echo(f"Revoked token {token_id}")
@@ -11,12 +11,20 @@ logging.basicConfig(level=logging.DEBUG)
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+# Reads of @read_only views can be served by replicas, see db_routing.py
+from db_routing import RoutingSession, ReplicaRouter
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 
 # Create the app
 app = Flask(__name__)
+# orjson when installed, stdlib json otherwise
+from json_provider import FastJSONProvider
+app.json = FastJSONProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# Proxies in front of the app; X-Forwarded-For sets remote_addr (rate limits key on it),
+# so set TRUSTED_PROXIES=0 when clients reach gunicorn directly or they can pick their IP
+_trusted_proxies = int(os.environ.get("TRUSTED_PROXIES", "1"))
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=_trusted_proxies, x_proto=1, x_host=1)
 
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///decluxdz.db")
@@ -29,10 +37,43 @@ app.config["UPLOAD_FOLDER"] = os.path.join(app.root_path, "static", "uploads")
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size
 app.config['WTF_CSRF_ENABLED'] = False
+# Delivered orders older than this move to the archive tables (flask archive-orders)
+app.config["ORDER_ARCHIVE_AFTER_DAYS"] = int(os.environ.get("ORDER_ARCHIVE_AFTER_DAYS", "90"))
+app.config["ANALYTICS_INCLUDE_ARCHIVE"] = os.environ.get("ANALYTICS_INCLUDE_ARCHIVE", "1") == "1"
+# Customer reports (analytics.py): snapshot file, default instance/analytics_snapshot.npz, and local time
+app.config["ANALYTICS_SNAPSHOT_PATH"] = os.environ.get("ANALYTICS_SNAPSHOT_PATH")
+app.config["ANALYTICS_UTC_OFFSET_MINUTES"] = int(os.environ.get("ANALYTICS_UTC_OFFSET_MINUTES", "60"))
 
 # Initialize the app with the extension
 db.init_app(app)
 
+# Optional read replicas: DATABASE_REPLICA_URLS=url1,url2
+db_router = ReplicaRouter(app)
+
+# WAL and tuned pragmas on SQLite, BEGIN IMMEDIATE for @write_transaction views
+from sqlite_mode import init_sqlite_mode
+init_sqlite_mode(app)
+
+# Jinja {% cache %} blocks for the storefront layout and product cards
+from fragment_cache import init_fragment_cache
+init_fragment_cache(app)
+
+# Shared Jinja bytecode cache and `flask precompile-templates`
+from template_cache import init_template_cache
+init_template_cache(app)
+
+# Content-addressed upload storage, local directory or S3-compatible bucket
+from storage import init_storage
+init_storage(app)
+
+# Anonymous storefront pages served from pre-rendered HTML files
+from page_cache import page_cache
+page_cache.init_app(app)
+
+# Token-bucket rate limits for order lookup, login, cart and checkout
+from ratelimit import limiter
+limiter.init_app(app)
+
 # بعد db.init_app(app) في ملف الإعداد (مثال: app.py)
 from flask_wtf import CSRFProtect
 from flask_wtf.csrf import generate_csrf
@@ -64,9 +105,25 @@ with app.app_context():
     import routes
     import admin_routes
     import api_routes
+    import recommendations
+    import popularity
+    import archive
+    import catalog_sync
+    import uploads_gc
+    import api_tokens
+    import customers
+    import analytics
     
     db.create_all()
     
+    # Bring tables created by older versions up to date with the models
+    from schema import upgrade_schema
+    upgrade_schema()
+    catalog_sync.seed_change_log()
+    from gallery import migrate_additional_images
+    migrate_additional_images()
+    customers.backfill_phones()
+    
     # Create default admin user if none exists
     from models import Admin
     from werkzeug.security import generate_password_hash
@@ -0,0 +1,208 @@
+import click
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import g
+from sqlalchemy import delete, func, insert, literal, or_, select
+from app import app, db
+from models import (Order, OrderItem, ArchivedOrder, ArchivedOrderItem, Customer,
+                    Product, OrderRollup, ProductSalesRollup)
+from customers import customer_search_filter
+
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 500  # orders moved per transaction
+
+
+def find_order(order_number):
+    """Look an order up by number, in the live table first and then the archive"""
+    order = Order.query.filter_by(order_number=order_number).first()
+    if order is None:
+        order = ArchivedOrder.query.filter_by(order_number=order_number).first()
+    return order
+
+
+def search_orders(model, search):
+    """Orders of ``model`` matching an order number, customer name or phone"""
+    return model.query.join(Customer, model.customer_id == Customer.id).filter(or_(
+        model.order_number == search.upper(),
+        customer_search_filter(search),
+    ))
+
+
+def _add_rollups(order_rows, item_rows):
+    orders = defaultdict(lambda: [0, 0.0])
+    for created_at, wilaya, total_amount in order_rows:
+        key = (created_at.date(), wilaya)
+        orders[key][0] += 1
+        orders[key][1] += total_amount
+    products = defaultdict(lambda: [0, 0.0])
+    for created_at, product_id, quantity, price in item_rows:
+        key = (created_at.date(), product_id)
+        products[key][0] += quantity
+        products[key][1] += quantity * price
+
+    days = {day for day, _ in orders} | {day for day, _ in products}
+    existing = {(r.day, r.wilaya): r for r in OrderRollup.query.filter(OrderRollup.day.in_(days))}
+    for key, (count, revenue) in orders.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            rollup = OrderRollup(day=key[0], wilaya=key[1], order_count=0, revenue=0)
+            db.session.add(rollup)
+        rollup.order_count += count
+        rollup.revenue += revenue
+    existing = {(r.day, r.product_id): r
+                for r in ProductSalesRollup.query.filter(ProductSalesRollup.day.in_(days))}
+    for key, (quantity, revenue) in products.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            rollup = ProductSalesRollup(day=key[0], product_id=key[1], quantity=0, revenue=0)
+            db.session.add(rollup)
+        rollup.quantity += quantity
+        rollup.revenue += revenue
+
+
+def _archivable(cutoff):
+    return (Order.status == 'delivered') & (func.coalesce(Order.updated_at, Order.created_at) < cutoff)
+
+
+def _archive_batch(order_ids, cutoff, now):
+    """Archive the orders of ``order_ids`` that still qualify, returning how many"""
+    # An order may have changed since it was selected, so check again and
+    # lock the rows (FOR UPDATE, SQLite holds the write lock already)
+    order_ids = [order_id for (order_id,) in db.session.query(Order.id)
+                 .filter(Order.id.in_(order_ids), _archivable(cutoff)).with_for_update()]
+    if not order_ids:
+        return 0
+    order_columns = [c.name for c in Order.__table__.columns]
+    item_columns = [c.name for c in OrderItem.__table__.columns]
+    db.session.execute(insert(ArchivedOrder).from_select(
+        order_columns + ['archived_at'],
+        select(*Order.__table__.columns, literal(now)).where(Order.id.in_(order_ids), _archivable(cutoff))))
+    db.session.execute(insert(ArchivedOrderItem).from_select(
+        item_columns, select(*OrderItem.__table__.columns).where(OrderItem.order_id.in_(order_ids))))
+
+    order_rows = db.session.query(Order.created_at, Order.wilaya, Order.total_amount) \
+        .filter(Order.id.in_(order_ids)).all()
+    item_rows = db.session.query(Order.created_at, OrderItem.product_id, OrderItem.quantity, OrderItem.price) \
+        .join(Order, OrderItem.order_id == Order.id).filter(Order.id.in_(order_ids)).all()
+    _add_rollups(order_rows, item_rows)
+
+    db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(delete(Order).where(Order.id.in_(order_ids), _archivable(cutoff)),
+                       execution_options={'synchronize_session': False})
+    return len(order_ids)
+
+
+def archive_orders(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    """Move delivered orders untouched for ``older_than_days`` into the archive.
+
+    Each batch of orders, their items and the matching rollup increments are
+    moved in one transaction, so an interrupted run leaves nothing half done.
+    Returns the number of orders archived.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    # Order ids are plain INTEGER PRIMARY KEYs, which SQLite assigns as
+    # max(id) + 1. Archiving the newest order would let the next order take
+    # its id again, and ArchivedOrder keeps the original id, so the two would
+    # clash. The newest order therefore stays until a newer one exists, and a
+    # later run archives it.
+    newest_id = db.session.query(func.max(Order.id)).scalar()
+    candidates = db.session.query(Order.id).filter(_archivable(cutoff), Order.id != newest_id).order_by(Order.id)
+    if dry_run:
+        return candidates.count()
+
+    archived = 0
+    last_id = 0
+    while True:
+        order_ids = [order_id for (order_id,) in
+                     candidates.filter(Order.id > last_id).limit(batch_size)]
+        if not order_ids:
+            break
+        last_id = order_ids[-1]
+        # End the read so the batch's transaction starts with the SQLite
+        # write lock, see sqlite_mode.begin_sqlite_transaction
+        db.session.rollback()
+        g.db_write_transaction = True
+        try:
+            archived += _archive_batch(order_ids, cutoff, datetime.utcnow())
+            db.session.commit()
+        finally:
+            g.db_write_transaction = False
+    return archived
+
+
+# Analytics over live orders, plus the archive's rollups when include_archive
+
+def sales_by_wilaya(include_archive=True):
+    """[(wilaya, order_count, revenue)] sorted by revenue"""
+    totals = defaultdict(lambda: [0, 0.0])
+    rows = db.session.query(Order.wilaya, func.count(Order.id), func.sum(Order.total_amount)) \
+        .group_by(Order.wilaya).all()
+    if include_archive:
+        rows += db.session.query(OrderRollup.wilaya, func.sum(OrderRollup.order_count),
+                                 func.sum(OrderRollup.revenue)).group_by(OrderRollup.wilaya).all()
+    for wilaya, count, revenue in rows:
+        totals[wilaya][0] += int(count or 0)
+        totals[wilaya][1] += float(revenue or 0)
+    return sorted(((w, c, r) for w, (c, r) in totals.items()), key=lambda row: row[2], reverse=True)
+
+
+def revenue_by_month(include_archive=True):
+    """[(YYYY-MM, revenue)] in month order"""
+    totals = defaultdict(float)
+    month = func.strftime('%Y-%m', Order.created_at)
+    rows = db.session.query(month, func.sum(Order.total_amount)).group_by(month).all()
+    if include_archive:
+        month = func.strftime('%Y-%m', OrderRollup.day)
+        rows += db.session.query(month, func.sum(OrderRollup.revenue)).group_by(month).all()
+    for month, revenue in rows:
+        totals[month] += float(revenue or 0)
+    return sorted(totals.items())
+
+
+def top_selling_products(limit=10, include_archive=True):
+    """[(Product, units_sold, revenue)] of the best sellers"""
+    totals = defaultdict(lambda: [0, 0.0])
+    rows = db.session.query(OrderItem.product_id, func.sum(OrderItem.quantity),
+                            func.sum(OrderItem.quantity * OrderItem.price)) \
+        .group_by(OrderItem.product_id).all()
+    if include_archive:
+        rows += db.session.query(ProductSalesRollup.product_id, func.sum(ProductSalesRollup.quantity),
+                                 func.sum(ProductSalesRollup.revenue)) \
+            .group_by(ProductSalesRollup.product_id).all()
+    for product_id, quantity, revenue in rows:
+        totals[product_id][0] += int(quantity or 0)
+        totals[product_id][1] += float(revenue or 0)
+    best = sorted(totals.items(), key=lambda row: row[1][0], reverse=True)[:limit]
+    products = {p.id: p for p in Product.query.filter(Product.id.in_([pid for pid, _ in best]))}
+    return [(products[pid], quantity, revenue) for pid, (quantity, revenue) in best if pid in products]
+
+
+def order_totals(include_archive=True):
+    """(order_count, revenue) over all orders"""
+    count, revenue = db.session.query(func.count(Order.id), func.sum(Order.total_amount)).one()
+    count, revenue = int(count or 0), float(revenue or 0)
+    if include_archive:
+        archived_count, archived_revenue = db.session.query(
+            func.sum(OrderRollup.order_count), func.sum(OrderRollup.revenue)).one()
+        count += int(archived_count or 0)
+        revenue += float(archived_revenue or 0)
+    return count, revenue
+
+
+def include_archive_arg(args):
+    """Analytics include archived orders unless ``?archive=0`` or ANALYTICS_INCLUDE_ARCHIVE is off"""
+    return args.get('archive', '1' if app.config.get('ANALYTICS_INCLUDE_ARCHIVE', True) else '0') != '0'
+
+
+@app.cli.command('archive-orders')
+@click.option('--days', default=None, type=int,
+              help=f'Archive delivered orders older than this (default ORDER_ARCHIVE_AFTER_DAYS or {ARCHIVE_AFTER_DAYS}).')
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Only count the orders that would move.')
+def archive_orders_command(days, batch_size, dry_run):
+    """Move old delivered orders and their items into the archive tables."""
+    if days is None:
+        days = app.config.get('ORDER_ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS)
+    count = archive_orders(days, batch_size, dry_run=dry_run)
+    click.echo(f"{'Would archive' if dry_run else 'Archived'} {count} orders delivered more than {days} days ago")
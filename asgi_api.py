@@ -0,0 +1,270 @@
+"""Optional ASGI server for the read-only public catalog API.
+
+GET /api/products, /api/products/<id> and /api/orders/<order_number> are
+answered with async SQLAlchemy, so a slow client costs a coroutine instead
+of a whole sync worker. Every other request, and the variants not handled
+here (``/api/products?facets=1``), go to the Flask app mounted behind it,
+so this can replace the WSGI server or run next to it:
+
+    uvicorn asgi_api:application --workers 4 --proxy-headers
+
+Needs ``sqlalchemy[asyncio]`` with aiosqlite (SQLite) or asyncpg
+(PostgreSQL), and asgiref to mount the Flask app. ASYNC_DATABASE_URL
+points the reads somewhere else than DATABASE_URL, e.g. a replica.
+"""
+import os
+import re
+import math
+import asyncio
+import logging
+from urllib.parse import parse_qsl
+from sqlalchemy import func, make_url, select
+from werkzeug.datastructures import MultiDict
+from app import app as flask_app, db
+from models import Product, ProductImage, Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+from serializers import ProductSerializer
+from popularity import SORT_OPTIONS, DEFAULT_SORT, apply_sort
+from facets import parse_facet_filters, apply_facet_filters
+from batch import parse_ids
+from ratelimit import limiter
+
+try:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+except ImportError:  # greenlet missing
+    create_async_engine = None
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # only the async endpoints are served
+    WsgiToAsgi = None
+
+MAX_IDS_PER_REQUEST = 100  # same limit as api_routes
+DEFAULT_PER_PAGE = 12
+
+_PRODUCT = re.compile(r'^/api/products/(\d+)$')
+_ORDER = re.compile(r'^/api/orders/([^/]+)$')
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def async_database_url(url):
+    """The same database through its async driver"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+
+
+def _product_columns(fields):
+    return select(*(getattr(Product, name) for name in ProductSerializer.columns(fields)))
+
+
+async def _dump_products(session, rows, fields):
+    extras = {}
+    wanted = [name for name in fields if name in ProductSerializer.extra_fields]
+    if wanted and rows:
+        ids = [row[0] for row in rows]
+        galleries = {product_id: [] for product_id in ids}
+        result = await session.execute(
+            select(ProductImage.product_id, ProductImage.filename, ProductImage.width, ProductImage.height)
+            .where(ProductImage.product_id.in_(ids))
+            .order_by(ProductImage.product_id, ProductImage.position))
+        for image in result:
+            galleries[image.product_id].append(image)
+        extras = ProductSerializer.gallery_extras(wanted, galleries)
+    return ProductSerializer.dump_rows(rows, fields, extras)
+
+
+def _parse_fields(args, default=None):
+    try:
+        return ProductSerializer.parse_fields(args.get('fields'), default)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+
+
+async def list_products(session, args):
+    """GET /api/products, see api_routes.api_get_products"""
+    page = args.get('page', 1, type=int)
+    per_page = args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    search = args.get('search', '')
+    sort = args.get('sort', DEFAULT_SORT)
+    if sort not in SORT_OPTIONS:
+        raise HTTPError(400, f'sort must be one of: {", ".join(SORT_OPTIONS)}')
+    fields = _parse_fields(args)
+
+    if args.get('ids'):
+        try:
+            ids = parse_ids(args['ids'], MAX_IDS_PER_REQUEST)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        rows = (await session.execute(_product_columns(fields).where(Product.id.in_(ids)))).all()
+        found = dict(zip((row.id for row in rows), await _dump_products(session, rows, fields)))
+        return {
+            'products': [found[product_id] for product_id in ids if product_id in found],
+            'missing': [product_id for product_id in ids if product_id not in found]
+        }
+
+    # Same bounds as Flask-SQLAlchemy's paginate(error_out=False)
+    page = page if page and page > 0 else 1
+    per_page = per_page if per_page and per_page > 0 else 20
+    query = apply_facet_filters(_product_columns(fields), parse_facet_filters(args))
+    if search:
+        query = query.filter(Product.name.contains(search) | Product.name_ar.contains(search))
+    total = (await session.execute(select(func.count()).select_from(query.order_by(None).subquery()))).scalar()
+    rows = (await session.execute(
+        apply_sort(query, sort).limit(per_page).offset((page - 1) * per_page))).all()
+    pages = math.ceil(total / per_page) if total else 0
+    return {
+        'products': await _dump_products(session, rows, fields),
+        'total': total,
+        'pages': pages,
+        'current_page': page,
+        'has_next': page < pages,
+        'has_prev': page > 1,
+        'sort': sort
+    }
+
+
+async def get_product(session, args, product_id):
+    """GET /api/products/<id>"""
+    fields = _parse_fields(args, ProductSerializer.detail_fields)
+    row = (await session.execute(_product_columns(fields).where(Product.id == product_id))).first()
+    if row is None:
+        raise HTTPError(404, 'Product not found')
+    return (await _dump_products(session, [row], fields))[0]
+
+
+async def get_order(session, order_number):
+    """GET /api/orders/<order_number>, live orders first, then the archive"""
+    for order_model, item_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+        order = (await session.execute(
+            select(order_model).where(order_model.order_number == order_number))).scalar()
+        if order is not None:
+            break
+    else:
+        raise HTTPError(404, 'Order not found')
+    items = await session.execute(
+        select(Product.name_ar, item_model.quantity, item_model.price)
+        .join(Product, item_model.product_id == Product.id)
+        .where(item_model.order_id == order.id).order_by(item_model.id))
+    return {
+        'order_number': order.order_number,
+        'status': order.status,
+        'total_amount': order.total_amount,
+        'address': order.address,
+        'wilaya': order.wilaya,
+        'created_at': order.created_at.isoformat(),
+        'archived': order.is_archived,
+        'items': [{
+            'product_name': name_ar,
+            'quantity': quantity,
+            'price': price
+        } for name_ar, quantity, price in items]
+    }
+
+
+class CatalogAPI:
+    """ASGI app answering the catalog reads itself and passing the rest to ``fallback``"""
+
+    def __init__(self, database_url, fallback=None):
+        if create_async_engine is None:
+            raise RuntimeError('The async API needs sqlalchemy[asyncio] (greenlet) installed')
+        self.database_url = async_database_url(database_url)
+        self.fallback = fallback
+        self.engine = None
+        self.sessions = None
+
+    def _start(self):
+        # Created in the worker process, after the server has forked
+        if self.engine is None:
+            # No pre-ping on SQLite, a file connection does not go stale
+            self.engine = create_async_engine(self.database_url, pool_pre_ping=self.database_url.get_backend_name() != 'sqlite')
+            self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            handler = self._route(scope)
+            if handler is not None:
+                return await self._respond(scope, send, handler)
+        if self.fallback is None:
+            return await self._send_json(send, 404, {'error': 'Not found'})
+        return await self.fallback(scope, receive, send)
+
+    def _route(self, scope):
+        path = scope['path'].rstrip('/') or '/'
+        args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('utf-8', 'replace'), keep_blank_values=True))
+        if path == '/api/products' and args.get('facets') != '1':
+            return lambda session: list_products(session, args)
+        match = _PRODUCT.match(path)
+        if match:
+            return lambda session: get_product(session, args, int(match.group(1)))
+        match = _ORDER.match(path)
+        if match:
+            return self._order_handler(scope, match.group(1))
+        return None
+
+    def _order_handler(self, scope, order_number):
+        async def handler(session):
+            # The same order_lookup bucket as the Flask view, against enumeration
+            if flask_app.config['RATELIMIT_ENABLED']:
+                client = (scope.get('client') or ('unknown',))[0]
+                retry_after = await asyncio.to_thread(limiter.take, 'order_lookup', f"ip:{client}")
+                if retry_after:
+                    logging.warning("Rate limit order_lookup exceeded by %s", client)
+                    raise HTTPError(429, {'error': 'Too many requests', 'retry_after': retry_after})
+            return await get_order(session, order_number)
+        return handler
+
+    async def _respond(self, scope, send, handler):
+        self._start()
+        try:
+            async with self.sessions() as session:
+                body = await handler(session)
+            status = 200
+        except HTTPError as e:
+            status, body = e.status, e.message if isinstance(e.message, dict) else {'error': e.message}
+        except Exception:
+            logging.exception("Async API request to %s failed", scope['path'])
+            status, body = 500, {'error': 'Internal server error'}
+        headers = [(b'retry-after', str(body['retry_after']).encode())] if status == 429 else []
+        await self._send_json(send, status, body, headers, head=scope['method'] == 'HEAD')
+
+    async def _send_json(self, send, status, body, headers=(), head=False):
+        # Flask's JSON provider, so both servers encode dates and floats alike
+        payload = flask_app.json.dumps(body).encode()
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode()),
+            *headers]})
+        await send({'type': 'http.response.body', 'body': b'' if head else payload})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def _primary_url():
+    # Flask-SQLAlchemy resolves relative SQLite paths into the instance folder
+    with flask_app.app_context():
+        return db.engine.url
+
+
+application = CatalogAPI(
+    os.environ.get('ASYNC_DATABASE_URL') or _primary_url(),
+    fallback=WsgiToAsgi(flask_app) if WsgiToAsgi is not None else None)
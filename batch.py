@@ -0,0 +1,52 @@
+import io
+import logging
+from urllib.parse import urlsplit
+from flask import request
+from app import app
+
+BATCH_MAX_REQUESTS = 20
+
+
+def parse_ids(raw, limit):
+    """Distinct integer ids from ``1,2,3`` in the given order, or ValueError"""
+    message = 'ids must be a comma separated list of integers'
+    try:
+        ids = list(dict.fromkeys(int(part) for part in raw.split(',') if part.strip()))
+    except ValueError:
+        raise ValueError(message) from None
+    if not ids:
+        raise ValueError(message)
+    if len(ids) > limit:
+        raise ValueError(f'At most {limit} ids per request')
+    return ids
+
+
+def _subrequest_environ(path, query_string):
+    # Same client, cookies and headers as the batch request, as a bodiless GET
+    environ = dict(request.environ)
+    environ.update({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'CONTENT_LENGTH': '0',
+        'wsgi.input': io.BytesIO(b''),
+    })
+    environ.pop('CONTENT_TYPE', None)
+    environ.pop('werkzeug.request', None)
+    return environ
+
+
+def run_subrequest(url):
+    """Dispatch a GET for ``url`` inside this process and return (status, body)"""
+    parts = urlsplit(url)
+    if not parts.path.startswith('/api/') or parts.path.rstrip('/') == '/api/batch' or parts.netloc:
+        return 400, {'error': 'Only /api/ paths of this server can be batched'}
+    # A fresh app context gives each sub-request its own g and database session
+    with app.app_context(), app.request_context(_subrequest_environ(parts.path, parts.query)):
+        try:
+            response = app.full_dispatch_request()
+        except Exception:
+            logging.exception("Batched request to %s failed", url)
+            return 500, {'error': 'Internal server error'}
+        body = response.get_json(silent=True) if response.is_json else None
+        return response.status_code, body
@@ -0,0 +1,178 @@
+import re
+import click
+import logging
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import Customer, Order, ArchivedOrder
+
+COUNTRY_CODE = '213'  # Algeria
+# Digits after the trunk 0: 5/6/7 + 8 digits for mobiles, a 2x/3x/4x area code + 6 for landlines
+MOBILE_DIGITS = 9
+LANDLINE_DIGITS = 8
+LANDLINE_AREAS = '234'
+_SEPARATORS = re.compile(r'[\s\-.()/]')
+
+
+def normalize_phone(raw):
+    """E.164 form of a phone number, Algerian unless it carries another country code.
+
+    ``0555 12 34 56``, ``+213 555 12 34 56`` and ``00213555123456`` all give
+    ``+213555123456``, landlines such as ``021 23 45 67`` give
+    ``+21321234567``. Returns None when the input is not a plausible number.
+    """
+    if not raw:
+        return None
+    digits = _SEPARATORS.sub('', raw)
+    if digits.startswith('+'):
+        digits = digits[1:]
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith('0') and len(digits) in (MOBILE_DIGITS + 1, LANDLINE_DIGITS + 1):
+        digits = COUNTRY_CODE + digits[1:]
+    elif len(digits) == MOBILE_DIGITS:
+        digits = COUNTRY_CODE + digits
+    if not digits.isdigit():
+        return None
+    if digits.startswith(COUNTRY_CODE + '0'):  # +213 0555..., the trunk 0 written twice
+        digits = COUNTRY_CODE + digits[len(COUNTRY_CODE) + 1:]
+    if digits.startswith(COUNTRY_CODE):
+        national = digits[len(COUNTRY_CODE):]
+        if len(national) == MOBILE_DIGITS or (len(national) == LANDLINE_DIGITS and national[0] in LANDLINE_AREAS):
+            return '+' + digits
+        return None
+    return '+' + digits if 8 <= len(digits) <= 15 else None
+
+
+def phone_prefix(search):
+    """E.164 prefix for a search term that starts like a phone number, else None"""
+    term = _SEPARATORS.sub('', search)
+    if term.startswith('+') and term[1:].isdigit():
+        return term
+    if term.startswith('00') and term.isdigit():
+        return '+' + term[2:]
+    if term.startswith('0') and term.isdigit():
+        return '+' + COUNTRY_CODE + term[1:]
+    return None
+
+
+def customer_search_filter(search):
+    """Filter for the admin customer and order searches.
+
+    Phone-like terms become a range on the unique phone_e164 index, which
+    any database serves as an index seek. Rows left without phone_e164 (see
+    backfill_phones) are matched on the raw phone, through the same index.
+    Other terms match name or phone.
+    """
+    prefix = phone_prefix(search)
+    if prefix:
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return or_((Customer.phone_e164 >= prefix) & (Customer.phone_e164 < upper),
+                   Customer.phone_e164.is_(None) & Customer.phone.contains(search))
+    return or_(Customer.name.contains(search), Customer.phone.contains(search))
+
+
+def find_or_create_customer(name, phone, email=None):
+    """The customer owning ``phone`` in any spelling, created if new. The caller commits."""
+    normalized = normalize_phone(phone)
+    customer = None
+    if normalized:
+        customer = Customer.query.filter_by(phone_e164=normalized).first()
+    if customer is None:
+        # Rows from before normalization until `flask customers-dedupe` has run
+        customer = Customer.query.filter_by(phone=phone, phone_e164=None).first()
+        if customer is not None and normalized:
+            customer.phone_e164 = normalized
+    if customer is None:
+        customer = Customer(name=name, phone=phone, phone_e164=normalized, email=email)
+        try:
+            with db.session.begin_nested():
+                db.session.add(customer)
+        except IntegrityError:
+            if not normalized:
+                raise
+            # A concurrent first order for the same number created it first
+            customer = Customer.query.filter_by(phone_e164=normalized).one()
+    return customer
+
+
+def backfill_phones():
+    """Fill phone_e164 on customers created before phone normalization.
+
+    Runs at boot so phone searches find legacy customers straight away. Rows
+    whose number another customer already holds are left for
+    `flask customers-dedupe`, which merges them.
+    """
+    pending = {}
+    for customer_id, phone in db.session.query(Customer.id, Customer.phone) \
+            .filter(Customer.phone_e164.is_(None)).order_by(Customer.id):
+        normalized = normalize_phone(phone)
+        if normalized and normalized not in pending:
+            pending[normalized] = customer_id
+    if not pending:
+        return
+    numbers = list(pending)
+    for start in range(0, len(numbers), 500):
+        for (taken,) in db.session.query(Customer.phone_e164) \
+                .filter(Customer.phone_e164.in_(numbers[start:start + 500])):
+            del pending[taken]
+    db.session.rollback()
+    if not pending:
+        return
+    db.session.execute(update(Customer), [{'id': customer_id, 'phone_e164': normalized}
+                                          for normalized, customer_id in pending.items()])
+    db.session.commit()
+    logging.info("Normalized the phones of %d customers", len(pending))
+
+
+def dedupe_customers(dry_run=False):
+    """Backfill phone_e164 and merge customers whose phones normalize the same.
+
+    The oldest customer of each group keeps its row, the orders of the others
+    move to it. Returns (backfilled, merged).
+    """
+    keepers = {}
+    duplicates = {}
+    rows = db.session.query(Customer.id, Customer.phone, Customer.phone_e164).order_by(Customer.id)
+    for customer_id, phone, current in rows:
+        normalized = normalize_phone(phone)
+        if normalized is None:
+            continue
+        if normalized in keepers:
+            duplicates[customer_id] = keepers[normalized][0]
+        else:
+            keepers[normalized] = (customer_id, current)
+    to_backfill = {customer_id: normalized for normalized, (customer_id, current) in keepers.items()
+                   if current != normalized}
+    if dry_run:
+        return len(to_backfill), len(duplicates)
+
+    for duplicate_id, keeper_id in duplicates.items():
+        for model in (Order, ArchivedOrder):
+            db.session.execute(update(model).where(model.customer_id == duplicate_id)
+                               .values(customer_id=keeper_id), execution_options={'synchronize_session': False})
+    if duplicates:
+        Customer.query.filter(Customer.id.in_(list(duplicates))).delete(synchronize_session=False)
+    # Clear first so a value moving between rows never trips the unique index
+    if to_backfill:
+        db.session.execute(update(Customer).where(Customer.id.in_(list(to_backfill))).values(phone_e164=None))
+        db.session.execute(update(Customer), [{'id': customer_id, 'phone_e164': normalized}
+                                              for customer_id, normalized in to_backfill.items()])
+    db.session.commit()
+    return len(to_backfill), len(duplicates)
+
+
+@app.cli.command('customers-dedupe')
+@click.option('--dry-run', is_flag=True, help='Only report what would change.')
+def customers_dedupe_command(dry_run):
+    """Normalize customer phones to E.164 and merge duplicate customers."""
+    backfilled, merged = dedupe_customers(dry_run)
+    if dry_run:
+        click.echo(f"Would normalize {backfilled} phones and merge {merged} duplicate customers")
+    else:
+        click.echo(f"Normalized {backfilled} phones and merged {merged} duplicate customers")
+        if merged:
+            # Merged orders changed customer, which the analytics snapshot never re-reads
+            from analytics import snapshot, np
+            if np is not None:
+                snapshot.rebuild()
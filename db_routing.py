@@ -0,0 +1,133 @@
+import os
+import time
+import logging
+import itertools
+import threading
+from functools import wraps
+import click
+from flask import current_app, g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+
+HEALTH_CHECK_INTERVAL = 10   # seconds between pings of a healthy replica
+RETRY_DOWN_AFTER = 30        # seconds before a failed replica is tried again
+STICKY_SECONDS = 10          # reads stay on the primary this long after a client wrote
+
+
+class Replica:
+    def __init__(self, url, engine):
+        self.url = url
+        self.engine = engine
+        self.healthy = True
+        self.checked_at = 0.0
+        self._checking = threading.Lock()
+
+    def is_available(self, now):
+        interval = HEALTH_CHECK_INTERVAL if self.healthy else RETRY_DOWN_AFTER
+        # One thread runs a due check, the others go on with the last result
+        if now - self.checked_at >= interval and self._checking.acquire(blocking=False):
+            try:
+                self.check(now)
+            finally:
+                self._checking.release()
+        return self.healthy
+
+    def check(self, now=None):
+        self.checked_at = now or time.monotonic()
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            if not self.healthy:
+                logging.info("Replica %s is back", self.engine.url.render_as_string())
+            self.healthy = True
+        except Exception:
+            if self.healthy:
+                logging.exception("Replica %s failed its health check", self.engine.url.render_as_string())
+            self.healthy = False
+        return self.healthy
+
+
+class ReplicaRouter:
+    """Round-robin over healthy read replicas, falling back to the primary"""
+
+    def __init__(self, app=None):
+        self.replicas = []
+        self._cycle = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        urls = os.environ.get('DATABASE_REPLICA_URLS', '')
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [u.strip() for u in urls.split(',') if u.strip()])
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.replicas = [Replica(url, create_engine(url, **options))
+                         for url in app.config['SQLALCHEMY_REPLICA_URIS']]
+        self._cycle = itertools.cycle(self.replicas) if self.replicas else None
+        app.extensions['db_router'] = self
+
+        @app.cli.command('replicas')
+        def replicas_command():
+            """Health-check every configured read replica."""
+            if not self.replicas:
+                click.echo("No read replicas configured (SQLALCHEMY_REPLICA_URIS)")
+            for replica in self.replicas:
+                state = 'ok' if replica.check() else 'DOWN'
+                click.echo(f"{replica.engine.url.render_as_string()}  {state}")
+
+        @app.after_request
+        def remember_writes(response):
+            # Read-your-writes: a client that just wrote keeps reading from the primary
+            if g.get('db_wrote'):
+                session['_primary_until'] = time.time() + STICKY_SECONDS
+            return response
+
+    def pick(self):
+        if not self.replicas:
+            return None
+        now = time.monotonic()
+        # Only the rotation is under the lock, health checks do I/O
+        with self._lock:
+            candidates = [next(self._cycle) for _ in range(len(self.replicas))]
+        for replica in candidates:
+            if replica.is_available(now):
+                return replica.engine
+        return None
+
+
+class RoutingSession(Session):
+    """Sends reads of @read_only views to a replica, everything else to the primary"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_app_context()
+                and g.get('db_route') == 'replica'):
+            router = current_app.extensions.get('db_router')
+            engine = router.pick() if router else None
+            if engine is not None:
+                g.db_used_replica = True
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush(db_session, flush_context):
+    if has_app_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_bulk_write(orm_execute_state):
+    # Core-style UPDATE/DELETE/INSERT through the session skip the flush
+    if not orm_execute_state.is_select and has_app_context():
+        g.db_wrote = True
+
+
+def read_only(f):
+    """Route the view's queries to a read replica when one is configured"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        sticky = has_request_context() and session.get('_primary_until', 0) > time.time()
+        if not sticky:
+            g.db_route = 'replica'
+        return f(*args, **kwargs)
+    return decorated_function
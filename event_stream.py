@@ -0,0 +1,155 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from sqlalchemy import func
+from app import app, db
+from models import OrderEvent
+
+POLL_INTERVAL = 1.0     # seconds between change log reads while anyone listens
+HEARTBEAT = 15          # seconds of silence before a keep-alive comment
+STREAM_SECONDS = 300    # streams end after this, browsers reconnect with Last-Event-ID
+BUFFER_SIZE = 500       # recent events kept in memory for reconnecting clients
+GAP_TIMEOUT = 10        # seconds a missing id may still be an uncommitted transaction
+
+
+def format_event(event_id, kind, payload):
+    return f"id: {event_id}\nevent: {kind}\ndata: {payload}\n\n"
+
+
+class OrderEventBroadcaster:
+    """Fans the order change log out to every SSE subscriber of this worker.
+
+    A single background thread reads new OrderEvent rows, and only while at
+    least one client is connected. Subscribers wait on a condition variable
+    and never touch the database, so an idle stream costs no connection.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=BUFFER_SIZE)
+        self._last_id = None
+        self._gaps = {}  # first missing id -> when the poll loop first saw it missing
+        self._subscribers = 0
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._poll_loop, name='order-events', daemon=True)
+            self._thread.start()
+
+    def _read(self, after_id, upto=None, limit=BUFFER_SIZE):
+        with self.app.app_context():
+            try:
+                query = db.session.query(OrderEvent.id, OrderEvent.kind, OrderEvent.payload) \
+                    .filter(OrderEvent.id > after_id)
+                if upto is not None:
+                    query = query.filter(OrderEvent.id <= upto)
+                return [tuple(row) for row in query.order_by(OrderEvent.id).limit(limit)]
+            finally:
+                db.session.remove()
+
+    def _fetch(self, after_id):
+        """(new cursor, rows) for the poll loop.
+
+        On PostgreSQL ids are handed out before commit, so a missing id may
+        still show up. Reading stops at a gap until it fills or GAP_TIMEOUT
+        passes (a rolled back insert leaves a gap for good), so the cursor
+        never moves past an event that has not been seen yet.
+        """
+        if after_id is None:
+            with self.app.app_context():
+                try:
+                    return db.session.query(func.max(OrderEvent.id)).scalar() or 0, []
+                finally:
+                    db.session.remove()
+        rows = self._read(after_id)
+        now = time.monotonic()
+        ready = []
+        expected = after_id + 1
+        for row in rows:
+            if row[0] != expected and now - self._gaps.setdefault(expected, now) < GAP_TIMEOUT:
+                break
+            ready.append(row)
+            expected = row[0] + 1
+        cursor = ready[-1][0] if ready else after_id
+        self._gaps = {gap: seen for gap, seen in self._gaps.items() if gap > cursor}
+        return cursor, ready
+
+    def _poll_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._subscribers > 0)
+                last_id = self._last_id
+            try:
+                last_id, rows = self._fetch(last_id)
+            except Exception:
+                logging.exception("Failed to read the order change log")
+                rows = []
+            with self._cond:
+                self._last_id = last_id
+                self._events.extend(rows)
+                self._cond.notify_all()
+            time.sleep(POLL_INTERVAL)
+
+    def events_after(self, cursor):
+        """Events after ``cursor`` that the poll loop has passed, from memory when the buffer reaches back that far"""
+        with self._cond:
+            last_id = self._last_id
+            # Nothing new yet, the common case on every heartbeat
+            if last_id is not None and cursor >= last_id:
+                return []
+            if self._events and self._events[0][0] <= cursor + 1:
+                return [e for e in self._events if e[0] > cursor]
+        # Fell behind the buffer: page through the log, however long the backlog
+        events = []
+        while True:
+            rows = self._read(cursor, last_id)
+            events.extend(rows)
+            if len(rows) < BUFFER_SIZE:
+                return events
+            cursor = rows[-1][0]
+
+    def backlog(self, last_event_id):
+        """Events after ``last_event_id`` for a reconnecting client"""
+        return self.events_after(last_event_id)
+
+    def stream(self, last_event_id=None, backlog=()):
+        with self._cond:
+            self._subscribers += 1
+            self._ensure_thread()
+            self._cond.notify_all()
+        try:
+            yield "retry: 3000\n\n"
+            cursor = last_event_id
+            for event in backlog:
+                yield format_event(*event)
+                cursor = event[0]
+            deadline = time.monotonic() + STREAM_SECONDS
+            while time.monotonic() < deadline:
+                with self._cond:
+                    if cursor is None:
+                        # Fresh subscribers only get events from now on
+                        self._cond.wait_for(lambda: self._last_id is not None, timeout=HEARTBEAT)
+                        cursor = self._last_id
+                    if cursor is not None:
+                        self._cond.wait_for(lambda: self._last_id is not None and self._last_id > cursor,
+                                            timeout=HEARTBEAT)
+                pending = self.events_after(cursor) if cursor is not None else []
+                if pending:
+                    for event in pending:
+                        yield format_event(*event)
+                    cursor = pending[-1][0]
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+
+broadcaster = OrderEventBroadcaster(app)
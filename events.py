@@ -0,0 +1,54 @@
+from blinker import Namespace
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Signals fired after a transaction that touched the catalog has committed.
+# Receivers get the sets of product and category ids that were written.
+_signals = Namespace()
+catalog_changed = _signals.signal('catalog-changed')
+# Fired after a transaction that reordered product listings without editing
+# the catalog, e.g. sales moving popularity_score. No arguments.
+listings_changed = _signals.signal('listings-changed')
+
+CATALOG_MODELS = ('Product', 'Category')
+
+
+def mark_catalog_writes(session, products=(), categories=()):
+    """Record catalog writes the ORM cannot see, such as Core UPDATEs.
+
+    catalog_changed is sent for them when the transaction commits.
+    """
+    pending = session.info.setdefault('catalog_writes', {'products': set(), 'categories': set()})
+    pending['products'].update(products)
+    pending['categories'].update(categories)
+
+
+def mark_listing_writes(session):
+    """Have listings_changed sent when the transaction commits"""
+    session.info['listings_changed'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_catalog_writes(session, flush_context):
+    """Remember which catalog rows were written in this transaction"""
+    written = {'Product': set(), 'Category': set()}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        name = type(obj).__name__
+        if name in CATALOG_MODELS:
+            written[name].add(obj.id)
+    mark_catalog_writes(session, products=written['Product'], categories=written['Category'])
+
+
+@event.listens_for(Session, 'after_commit')
+def _send_catalog_changed(session):
+    pending = session.info.pop('catalog_writes', None)
+    if pending and (pending['products'] or pending['categories']):
+        catalog_changed.send(None, products=pending['products'], categories=pending['categories'])
+    if session.info.pop('listings_changed', False):
+        listings_changed.send(None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_catalog_writes(session):
+    session.info.pop('catalog_writes', None)
+    session.info.pop('listings_changed', None)
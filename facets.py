@@ -0,0 +1,97 @@
+from sqlalchemy import case, func
+from models import Product
+
+# Price bands shown in the shop sidebar, in DZD: (key, label, min, max)
+PRICE_BANDS = [
+    ('0-1000', 'أقل من 1,000 دج', 0, 1000),
+    ('1000-3000', '1,000 - 3,000 دج', 1000, 3000),
+    ('3000-5000', '3,000 - 5,000 دج', 3000, 5000),
+    ('5000-10000', '5,000 - 10,000 دج', 5000, 10000),
+    ('10000+', 'أكثر من 10,000 دج', 10000, None),
+]
+_BANDS_BY_KEY = {band[0]: band for band in PRICE_BANDS}
+
+
+def parse_facet_filters(args):
+    """Read the facet filters from request args.
+
+    Only in-stock products are listed unless ``in_stock=0`` is passed.
+    """
+    price = args.get('price')
+    return {
+        'category': args.get('category', type=int),
+        'price': price if price in _BANDS_BY_KEY else None,
+        'featured': args.get('featured') == '1',
+        'in_stock': args.get('in_stock', '1') != '0',
+    }
+
+
+def apply_facet_filters(query, filters):
+    if filters['category']:
+        query = query.filter(Product.category_id == filters['category'])
+    if filters['price']:
+        _, _, low, high = _BANDS_BY_KEY[filters['price']]
+        query = query.filter(Product.price >= low)
+        if high is not None:
+            query = query.filter(Product.price < high)
+    if filters['featured']:
+        query = query.filter(Product.featured == True)
+    if filters['in_stock']:
+        query = query.filter(Product.in_stock == True)
+    return query
+
+
+def _price_band():
+    return case(
+        *[(Product.price < high, key) for key, _, _, high in PRICE_BANDS if high is not None],
+        else_=PRICE_BANDS[-1][0]
+    )
+
+
+def _matches(row, filters, skip):
+    category_id, band, featured, in_stock = row
+    if skip != 'category' and filters['category'] and category_id != filters['category']:
+        return False
+    if skip != 'price' and filters['price'] and band != filters['price']:
+        return False
+    if skip != 'featured' and filters['featured'] and not featured:
+        return False
+    if skip != 'in_stock' and filters['in_stock'] and not in_stock:
+        return False
+    return True
+
+
+def facet_counts(query, filters):
+    """Per-value product counts for every facet, from one grouped query.
+
+    ``query`` is the product query before any facet filter (e.g. only the
+    text search). Each facet is counted with every other active filter
+    applied but not its own, so picking a value never hides its siblings.
+    """
+    band = _price_band()
+    rows = query.with_entities(
+        Product.category_id, band, Product.featured, Product.in_stock, func.count(Product.id)
+    ).group_by(Product.category_id, band, Product.featured, Product.in_stock).order_by(None).all()
+
+    counts = {
+        'category': {},
+        'price': {key: 0 for key, _, _, _ in PRICE_BANDS},
+        'featured': 0,
+        'in_stock': 0,
+        'all_stock': 0,
+    }
+    for *row, count in rows:
+        category_id, band_key, featured, in_stock = row
+        if _matches(row, filters, 'category'):
+            counts['category'][category_id] = counts['category'].get(category_id, 0) + count
+        if _matches(row, filters, 'price'):
+            counts['price'][band_key] += count
+        if featured and _matches(row, filters, 'featured'):
+            counts['featured'] += count
+        if _matches(row, filters, 'in_stock'):
+            counts['all_stock'] += count
+            if in_stock:
+                counts['in_stock'] += count
+    # Total for the "all categories" entry
+    counts['all_categories'] = sum(counts['category'].values())
+    return counts
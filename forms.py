@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed
+from flask_wtf.file import FileField, FileAllowed, MultipleFileField
 from wtforms import StringField, TextAreaField, FloatField, SelectField, IntegerField, BooleanField, PasswordField
-from wtforms.validators import DataRequired, Email, Length, NumberRange
+from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional
 from utils import ALGERIAN_PROVINCES
 
 class LoginForm(FlaskForm):
@@ -16,7 +16,9 @@ class ProductForm(FlaskForm):
     price = FloatField('Price (DZD)', validators=[DataRequired(), NumberRange(min=0)])
     category_id = SelectField('Category', coerce=int, validators=[DataRequired()])
     image = FileField('Main Image', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'])])
+    gallery = MultipleFileField('Gallery Images', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'])])
     in_stock = BooleanField('In Stock')
+    stock = IntegerField('Stock Quantity', validators=[Optional(), NumberRange(min=0)])
     featured = BooleanField('Featured Product')
 
 class CheckoutForm(FlaskForm):
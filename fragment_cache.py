@@ -0,0 +1,211 @@
+import os
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from events import catalog_changed
+
+CATALOG_VERSION_KEY = 'catalog-version'
+
+
+class LRUCache:
+    """In-memory cache local to one worker, evicting least recently used keys.
+
+    The data is per worker, but ``catalog_changed`` only fires in the worker
+    that committed. Versions are therefore stamp files in ``version_dir``
+    holding a nanosecond timestamp, so a bump reaches every worker on the host.
+    """
+
+    def __init__(self, maxsize=1024, version_dir=None):
+        self.maxsize = maxsize
+        self.version_dir = version_dir
+        self._data = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        if version_dir:
+            os.makedirs(version_dir, exist_ok=True)
+
+    def _version_path(self, key):
+        return os.path.join(self.version_dir, f"{key}.version")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires and expires < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else 0
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_version(self, key):
+        if self.version_dir:
+            try:
+                with open(self._version_path(key)) as f:
+                    return int(f.read() or 0)
+            except (OSError, ValueError):
+                return 0
+        return self._versions.get(key, 0)
+
+    def bump_version(self, key):
+        if self.version_dir:
+            # Not the mtime, two bumps within one filesystem tick would share it.
+            # Always above the previous value, even if the clock stepped back.
+            version = max(time.time_ns(), self.get_version(key) + 1)
+            path = self._version_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(str(version))
+            os.replace(tmp_path, path)
+            return version
+        # Kept apart from the LRU data so a version is never evicted
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            return self._versions[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FileSystemCache:
+    """Cache shared by every worker on the host, one file per key"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.PickleError):
+            return None
+        if expires and expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else 0
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def get_version(self, key):
+        return self.get(key) or 0
+
+    def bump_version(self, key):
+        # Good enough for a version counter: a lost increment still changes the value
+        value = self.get_version(key) + 1
+        self.set(key, value)
+        return value
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class NullCache:
+    """Disables fragment caching, every block is rendered on each request"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def get_version(self, key):
+        return 0
+
+    def bump_version(self, key):
+        return 0
+
+    def clear(self):
+        pass
+
+
+class FragmentCacheExtension(Extension):
+    """Adds ``{% cache key, ttl %}...{% endcache %}`` to the template language.
+
+    The rendered block is stored under ``key`` for ``ttl`` seconds (no expiry
+    when omitted). Keys should carry whatever the block depends on, e.g.
+    ``product.updated_at`` or ``catalog_version()``.
+    """
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args), [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key, ttl, caller):
+        backend = getattr(self.environment, 'fragment_cache', None)
+        if backend is None:
+            return caller()
+        key = f"fragment:{key}"
+        value = backend.get(key)
+        if value is None:
+            value = caller()
+            backend.set(key, str(value), ttl)
+        return Markup(value)
+
+
+def create_backend(config):
+    cache_type = config.get('FRAGMENT_CACHE_TYPE', 'lru')
+    if cache_type == 'filesystem':
+        return FileSystemCache(config['FRAGMENT_CACHE_DIR'])
+    if cache_type == 'null':
+        return NullCache()
+    return LRUCache(config.get('FRAGMENT_CACHE_SIZE', 1024), config['FRAGMENT_CACHE_DIR'])
+
+
+def init_fragment_cache(app):
+    app.config.setdefault('FRAGMENT_CACHE_TYPE', os.environ.get('FRAGMENT_CACHE_TYPE', 'lru'))
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', 1024)
+    app.config.setdefault('FRAGMENT_CACHE_DIR', os.path.join(app.instance_path, 'fragment_cache'))
+
+    backend = create_backend(app.config)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = backend
+    app.extensions['fragment_cache'] = backend
+
+    def catalog_version():
+        return backend.get_version(CATALOG_VERSION_KEY)
+
+    def bump_catalog_version(sender, **extra):
+        version = backend.bump_version(CATALOG_VERSION_KEY)
+        logging.debug("Catalog changed, fragment cache version is now %s", version)
+
+    app.jinja_env.globals['catalog_version'] = catalog_version
+    catalog_changed.connect(bump_catalog_version, weak=False)
+
+    return backend
@@ -0,0 +1,65 @@
+import json
+import logging
+from sqlalchemy import func, update
+from app import app, db
+from models import Product, ProductImage
+from utils import image_dimensions
+
+
+def migrate_additional_images():
+    """Move the legacy Product.additional_images JSON lists into ProductImage rows.
+
+    Runs at boot. Migrated products get the column cleared, so it is a no-op
+    once every gallery has moved.
+    """
+    legacy = Product.query.with_entities(Product.id, Product.additional_images) \
+        .filter(Product.additional_images.isnot(None)).all()
+    if not legacy:
+        return
+    storage = app.extensions['storage']
+    for product_id, raw in legacy:
+        try:
+            filenames = json.loads(raw) if raw.strip() else []
+        except ValueError:
+            logging.warning("Product %s has unreadable additional_images, dropping them", product_id)
+            filenames = []
+        start = next_position(product_id)
+        for offset, filename in enumerate(f for f in filenames if isinstance(f, str) and f):
+            try:
+                with storage.open(filename) as fp:
+                    width, height = image_dimensions(fp)
+            except FileNotFoundError:
+                width, height = None, None
+            db.session.add(ProductImage(product_id=product_id, position=start + offset,
+                                        filename=filename, width=width, height=height))
+    # Core update so the migration does not count as a catalog edit
+    db.session.execute(
+        update(Product).where(Product.id.in_([product_id for product_id, _ in legacy]))
+        .values(additional_images=None, updated_at=Product.updated_at),
+        execution_options={'synchronize_session': False})
+    db.session.commit()
+    logging.info("Moved the galleries of %d products to product_image", len(legacy))
+
+
+def next_position(product_id):
+    last = db.session.query(func.max(ProductImage.position)) \
+        .filter(ProductImage.product_id == product_id).scalar()
+    return 0 if last is None else last + 1
+
+
+def add_product_images(product, saved):
+    """Append uploads saved by utils.save_uploaded_files to a product's gallery"""
+    start = next_position(product.id) if product.id else len(product.images)
+    for offset, (filename, width, height) in enumerate(saved):
+        product.images.append(ProductImage(position=start + offset, filename=filename,
+                                           width=width, height=height))
+
+
+def load_galleries(product_ids):
+    """{product_id: [ProductImage, ...]} for many products in one query"""
+    galleries = {product_id: [] for product_id in product_ids}
+    if product_ids:
+        for image in ProductImage.query.filter(ProductImage.product_id.in_(product_ids)) \
+                .order_by(ProductImage.product_id, ProductImage.position):
+            galleries[image.product_id].append(image)
+    return galleries
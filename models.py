@@ -1,5 +1,6 @@
 from app import db
 from datetime import datetime
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 
 class Admin(db.Model):
@@ -33,18 +34,56 @@ class Product(db.Model):
     price = db.Column(db.Float, nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
     image_url = db.Column(db.String(200))
-    additional_images = db.Column(db.Text)  # JSON string of image URLs
+    additional_images = db.Column(db.Text)  # legacy JSON list, moved to ProductImage at boot
     in_stock = db.Column(db.Boolean, default=True)
+    stock = db.Column(db.Integer)  # units on hand, None when not tracked and in_stock is set by hand
     featured = db.Column(db.Boolean, default=False)
+    units_sold = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    popularity_score = db.Column(db.Float, nullable=False, default=0, server_default='0')  # decayed units sold
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     order_items = db.relationship('OrderItem', backref='product', lazy=True)
+    # Load with selectinload(Product.images) to fetch galleries for many products in one query
+    images = db.relationship('ProductImage', backref='product', lazy=True, order_by='ProductImage.position',
+                             cascade='all, delete-orphan')
+    
+    @validates('stock')
+    def _derive_in_stock(self, key, stock):
+        # Tracked stock decides availability; checkout keeps both in step, see stock.reserve_stock
+        if stock is not None:
+            self.in_stock = stock > 0
+        return stock
+    
+    # One index per shop sort order, with and without a category filter
+    __table_args__ = (
+        db.Index('ix_product_stock_popularity', 'in_stock', 'popularity_score', 'id'),
+        db.Index('ix_product_stock_created', 'in_stock', 'created_at', 'id'),
+        db.Index('ix_product_stock_price', 'in_stock', 'price', 'id'),
+        db.Index('ix_product_stock_category_popularity', 'in_stock', 'category_id', 'popularity_score', 'id'),
+        db.Index('ix_product_stock_category_created', 'in_stock', 'category_id', 'created_at', 'id'),
+        db.Index('ix_product_stock_category_price', 'in_stock', 'category_id', 'price', 'id'),
+    )
+
+class ProductImage(db.Model):
+    """Gallery images of a product, shown after the main image_url"""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    filename = db.Column(db.String(200), nullable=False)
+    width = db.Column(db.Integer)  # pixels, unknown when Pillow is not installed
+    height = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_product_image_product_position', 'product_id', 'position'),
+    )
 
 class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     phone = db.Column(db.String(20), nullable=False)
+    phone_e164 = db.Column(db.String(16), unique=True, index=True)  # +213XXXXXXXXX, see customers.normalize_phone
     email = db.Column(db.String(120))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -63,6 +102,13 @@ class Order(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
+    
+    is_archived = False
+    
+    # Status filters in the admin and the archival scan
+    __table_args__ = (
+        db.Index('ix_order_status_updated', 'status', 'updated_at'),
+    )
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -80,3 +126,83 @@ class Contact(db.Model):
     message = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
+
+class RelatedProduct(db.Model):
+    """Precomputed "frequently bought together" lookup, rebuilt by `flask build-related`"""
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    related_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False, default=0)  # co-purchase count, 0 for category fill
+
+class OrderEvent(db.Model):
+    """Append-only log of new orders and status changes, read by the admin event stream"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # order_created, status_changed
+    order_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON sent to subscribers as-is
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class ArchivedOrder(db.Model):
+    """Delivered orders moved out of `order` by `flask archive-orders`, keeping their ids"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_number = db.Column(db.String(20), unique=True, nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False, index=True)
+    total_amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50), default='delivered')
+    address = db.Column(db.Text, nullable=False)
+    wilaya = db.Column(db.String(100), nullable=False)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    customer = db.relationship('Customer')
+    items = db.relationship('ArchivedOrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
+    
+    is_archived = True
+
+class ArchivedOrderItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('archived_order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    
+    product = db.relationship('Product')
+
+class OrderRollup(db.Model):
+    """Daily order totals per wilaya for archived orders, so analytics can skip the archive"""
+    day = db.Column(db.Date, primary_key=True)
+    wilaya = db.Column(db.String(100), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class ProductSalesRollup(db.Model):
+    """Daily units and revenue per product for archived orders"""
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class ProductChange(db.Model):
+    """Change log behind /api/products/changes, the id is the sync sequence"""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)  # no FK, deletes are logged too
+    op = db.Column(db.String(10), nullable=False)  # upsert, delete
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_product_change_product', 'product_id', 'id'),
+    )
+
+class ApiToken(db.Model):
+    """Admin API bearer token. The token itself is signed and never stored."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    admin_id = db.Column(db.Integer, db.ForeignKey('admin.id'), nullable=False)
+    scopes = db.Column(db.String(200), nullable=False)  # space separated, see api_tokens.SCOPES
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    revoked_at = db.Column(db.DateTime)
+    
+    admin = db.relationship('Admin')
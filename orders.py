@@ -0,0 +1,103 @@
+import json
+import click
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, update
+from app import app, db
+from models import Order, OrderEvent
+
+ORDER_STATUSES = ['pending', 'in_delivery', 'delivered']
+BULK_CHUNK_SIZE = 500  # ids per IN (...) list, well under every driver's parameter limit
+
+# Edits here only touch status and updated_at. analytics.OrderSnapshot keeps
+# customer_id, created_at, wilaya, total_amount and the item quantities of
+# every order and never re-reads an order it has loaded, so code that changes
+# any of those on existing orders must call analytics.snapshot.rebuild() after
+# committing, as customers-dedupe does.
+
+
+def _event_row(kind, order_id, payload):
+    return {
+        'kind': kind,
+        'order_id': order_id,
+        'payload': json.dumps(payload, ensure_ascii=False),
+        'created_at': datetime.utcnow(),
+    }
+
+
+def record_order_created(order, customer):
+    """Log a new order for the admin event stream, in the checkout transaction"""
+    db.session.add(OrderEvent(**_event_row('order_created', order.id, {
+        'id': order.id,
+        'order_number': order.order_number,
+        'status': order.status or 'pending',
+        'total_amount': order.total_amount,
+        'wilaya': order.wilaya,
+        'customer_name': customer.name,
+        'customer_phone': customer.phone,
+        'created_at': (order.created_at or datetime.utcnow()).isoformat(),
+    })))
+
+
+def update_order_status(order, status):
+    """Change the status of one order and log it. The caller commits."""
+    previous = order.status
+    order.status = status
+    order.updated_at = datetime.utcnow()
+    if previous != status:
+        db.session.add(OrderEvent(**_event_row('status_changed', order.id, {
+            'id': order.id,
+            'order_number': order.order_number,
+            'status': status,
+            'previous_status': previous,
+        })))
+
+
+def bulk_update_order_status(order_ids, status):
+    """Set ``status`` on many orders in one transaction.
+
+    Returns a dict mapping each requested id to 'updated', 'unchanged' or
+    'not_found'. The caller commits.
+    """
+    if status not in ORDER_STATUSES:
+        raise ValueError(f"Invalid status: {status}")
+
+    order_ids = list(dict.fromkeys(order_ids))
+    results = {order_id: 'not_found' for order_id in order_ids}
+    to_update = []
+    events = []
+    for start in range(0, len(order_ids), BULK_CHUNK_SIZE):
+        chunk = order_ids[start:start + BULK_CHUNK_SIZE]
+        rows = db.session.query(Order.id, Order.order_number, Order.status).filter(Order.id.in_(chunk))
+        for order_id, order_number, current in rows:
+            if current == status:
+                results[order_id] = 'unchanged'
+                continue
+            results[order_id] = 'updated'
+            to_update.append(order_id)
+            events.append(_event_row('status_changed', order_id, {
+                'id': order_id,
+                'order_number': order_number,
+                'status': status,
+                'previous_status': current,
+            }))
+
+    now = datetime.utcnow()
+    for start in range(0, len(to_update), BULK_CHUNK_SIZE):
+        chunk = to_update[start:start + BULK_CHUNK_SIZE]
+        db.session.execute(
+            update(Order).where(Order.id.in_(chunk)).values(status=status, updated_at=now),
+            execution_options={'synchronize_session': False}
+        )
+    if events:
+        db.session.execute(insert(OrderEvent), events)
+    return results
+
+
+@app.cli.command('prune-order-events')
+@click.option('--days', default=7, show_default=True, help='Keep events newer than this.')
+def prune_order_events_command(days):
+    """Delete old entries of the order change log."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    result = db.session.execute(delete(OrderEvent).where(OrderEvent.created_at < cutoff))
+    db.session.commit()
+    click.echo(f"Deleted {result.rowcount} order events")
@@ -0,0 +1,222 @@
+"""Whole-page cache of the anonymous storefront, stored as plain HTML files.
+
+``/``, ``/shop``, ``/shop?category=<id>`` and ``/product/<id>`` render the
+same HTML for every visitor with nothing to flash: the cart badge is filled
+in by main.js from the ``cart_count`` cookie. The first such request renders
+the page and writes it under PAGE_CACHE_DIR, later ones are answered from
+the file before SQLAlchemy or Jinja run. A catalog change deletes the files
+it affects, they are rendered again on their next request or by
+``flask prerender-pages``.
+
+Files are laid out by URL (``ar/index.html``, ``ar/shop.html``,
+``ar/shop/category/3.html``, ``ar/product/7.html``) so nginx can serve them
+to visitors without a session cookie, e.g.::
+
+    location ~ ^/product/\\d+$ {
+        root /srv/decluxdz/instance/page_cache;
+        error_page 418 = @app;
+        if ($cookie_session) { return 418; }
+        try_files /ar$uri.html @app;
+    }
+
+Invalidation deletes files on the local disk, so every app server needs
+its own PAGE_CACHE_DIR or a shared one.
+"""
+import os
+import time
+import logging
+import click
+from flask import g, request, session, send_file
+from sqlalchemy import select
+from events import catalog_changed, listings_changed
+from db_routing import STICKY_SECONDS
+
+DEFAULT_LANGUAGE = 'ar'  # templates are Arabic only; a new language gets its own directory
+CART_COUNT_COOKIE = 'cart_count'
+STAMP_FILE = '.invalidated'
+
+
+def _page_path(endpoint, view_args, args):
+    """Cache file of a storefront page relative to the language directory, or None"""
+    if endpoint == 'index' and not args:
+        return 'index.html'
+    if endpoint == 'product_detail' and not args:
+        return f"product/{view_args['id']}.html"
+    if endpoint == 'shop':
+        if not args:
+            return 'shop.html'
+        if list(args) == ['category'] and args['category'].isdigit():
+            return f"shop/category/{int(args['category'])}.html"
+    return None
+
+
+class PageCache:
+    def __init__(self, app=None):
+        self.directory = None
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE_ENABLED', os.environ.get('PAGE_CACHE_ENABLED', '1') == '1')
+        app.config.setdefault('PAGE_CACHE_DIR', os.environ.get(
+            'PAGE_CACHE_DIR', os.path.join(app.instance_path, 'page_cache')))
+        self.enabled = app.config['PAGE_CACHE_ENABLED']
+        self.directory = app.config['PAGE_CACHE_DIR']
+        os.makedirs(self.directory, exist_ok=True)
+        self.app = app
+        app.extensions['page_cache'] = self
+
+        app.before_request(self._serve_cached)
+        app.after_request(self._store_page)
+        app.after_request(self._set_cart_cookie)
+        catalog_changed.connect(self._invalidate, weak=False)
+        listings_changed.connect(self._invalidate_listings, weak=False)
+
+        @app.cli.command('prerender-pages')
+        def prerender_pages_command():
+            """Render every cacheable storefront page to PAGE_CACHE_DIR."""
+            click.echo(f"Rendered {self.prerender()} pages")
+
+    def path(self, relative, language=DEFAULT_LANGUAGE):
+        return os.path.join(self.directory, language, *relative.split('/'))
+
+    def _cacheable_path(self):
+        """Cache file for the current request, None when it must be rendered for this visitor"""
+        if not self.enabled or request.method not in ('GET', 'HEAD'):
+            return None
+        relative = _page_path(request.endpoint, request.view_args or {}, request.args)
+        if relative is None:
+            return None
+        # Pending flash messages and admins get a rendered page; the cart does not matter
+        if '_flashes' in session or 'admin_id' in session:
+            return None
+        return self.path(relative)
+
+    def _serve_cached(self):
+        path = self._cacheable_path()
+        if path is None:
+            return None
+        g.page_cache_path = path
+        g.page_cache_started = time.time()
+        if os.path.isfile(path):
+            response = send_file(path, mimetype='text/html', max_age=0)
+            response.headers['X-Page-Cache'] = 'HIT'
+            return response
+        return None
+
+    def _store_page(self, response):
+        path = g.pop('page_cache_path', None)
+        if path is None or response.status_code != 200 or response.direct_passthrough:
+            return response
+        # A catalog change committed while this page rendered may not be in it,
+        # and a replica may not have one from shortly before (same lag window
+        # as read-your-writes); such pages are rendered again next time
+        invalidated_at = self._invalidated_at()
+        lag = STICKY_SECONDS if g.get('db_used_replica') else 0
+        if invalidated_at >= g.page_cache_started - lag:
+            return response
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(response.get_data())
+        os.replace(tmp_path, path)
+        response.headers['X-Page-Cache'] = 'MISS'
+        return response
+
+    def _set_cart_cookie(self, response):
+        # Read by main.js to show the cart badge on cached pages
+        if request.endpoint in (None, 'static', 'uploaded_file'):
+            return response
+        count = sum(session['cart'].values()) if session.get('cart') else 0
+        if count:
+            if request.cookies.get(CART_COUNT_COOKIE) != str(count):
+                response.set_cookie(CART_COUNT_COOKIE, str(count), samesite='Lax')
+        elif CART_COUNT_COOKIE in request.cookies:
+            response.delete_cookie(CART_COUNT_COOKIE)
+        return response
+
+    def _invalidated_at(self):
+        try:
+            return os.stat(os.path.join(self.directory, STAMP_FILE)).st_mtime
+        except FileNotFoundError:
+            return 0
+
+    def _remove(self, relative):
+        for language in os.listdir(self.directory):
+            try:
+                os.unlink(self.path(relative, language))
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+
+    def _touch_stamp(self):
+        stamp = os.path.join(self.directory, STAMP_FILE)
+        with open(stamp, 'a'):
+            os.utime(stamp)
+
+    def _remove_listings(self):
+        self._remove('shop.html')
+        for language in os.listdir(self.directory):
+            self._clear_dir(os.path.join(self.directory, language, 'shop'))
+
+    def _invalidate_listings(self, sender):
+        # /shop lists by popularity unless asked otherwise, product pages are unaffected
+        self._touch_stamp()
+        self._remove_listings()
+
+    def _invalidate(self, sender, products=(), categories=()):
+        self._touch_stamp()
+        if categories:
+            # The category menu is on every page
+            self.clear(keep_stamp=True)
+            return
+        from models import Product, RelatedProduct
+        # Sent after commit, when the ORM session cannot run queries
+        with self.app.extensions['sqlalchemy'].engine.connect() as conn:
+            listing = conn.execute(select(RelatedProduct.product_id).where(
+                RelatedProduct.related_id.in_(products))).scalars().all()
+            # Pages without related rows fall back to the same category
+            listing += conn.execute(select(Product.id).where(Product.category_id.in_(
+                select(Product.category_id).where(Product.id.in_(products))))).scalars().all()
+        for product_id in set(products) | set(listing):
+            self._remove(f"product/{product_id}.html")
+        # Featured products, listings and their counts may all have changed
+        self._remove('index.html')
+        self._remove_listings()
+        logging.debug("Page cache: invalidated pages of products %s", sorted(products))
+
+    def _clear_dir(self, directory):
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                os.unlink(os.path.join(dirpath, filename))
+
+    def clear(self, keep_stamp=False):
+        for name in os.listdir(self.directory):
+            if name == STAMP_FILE:
+                if not keep_stamp:
+                    os.unlink(os.path.join(self.directory, name))
+            else:
+                self._clear_dir(os.path.join(self.directory, name))
+
+    def prerender(self):
+        """Render the storefront into the cache as an anonymous visitor, returns the page count"""
+        from models import Product, Category
+        with self.app.app_context():
+            urls = ['/', '/shop']
+            urls += [f"/shop?category={category_id}" for (category_id,) in
+                     Category.query.with_entities(Category.id).order_by(Category.id)]
+            urls += [f"/product/{product_id}" for (product_id,) in
+                     Product.query.with_entities(Product.id).order_by(Product.id)]
+        self.clear()
+        client = self.app.test_client(use_cookies=False)
+        rendered = 0
+        for url in urls:
+            response = client.get(url)
+            if response.headers.get('X-Page-Cache') == 'MISS':
+                rendered += 1
+            else:
+                logging.warning("Page cache: %s was not cached (status %s)", url, response.status_code)
+        return rendered
+
+
+page_cache = PageCache()
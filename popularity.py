@@ -0,0 +1,70 @@
+import click
+from sqlalchemy import func, select, union_all, update
+from app import app, db
+from events import mark_listing_writes
+from models import Product, OrderItem, ArchivedOrderItem
+
+# Accepted values of the `sort` query parameter, in the order shown in the shop
+SORT_OPTIONS = {
+    'popular': (Product.popularity_score.desc(), Product.id.desc()),
+    'newest': (Product.created_at.desc(), Product.id.desc()),
+    'price_asc': (Product.price.asc(), Product.id.asc()),
+    'price_desc': (Product.price.desc(), Product.id.desc()),
+}
+DEFAULT_SORT = 'popular'
+
+
+def apply_sort(query, sort):
+    """Order a product query by one of SORT_OPTIONS, unknown values use the default"""
+    return query.order_by(*SORT_OPTIONS.get(sort, SORT_OPTIONS[DEFAULT_SORT]))
+
+
+def record_sales(cart_items):
+    """Bump the sales counters for the items of a new order.
+
+    Runs in the caller's transaction. updated_at is left alone so a sale does
+    not look like a catalog edit, but the popular sort changes, so cached
+    listings are dropped on commit.
+    """
+    mark_listing_writes(db.session())
+    for item in cart_items:
+        db.session.execute(
+            update(Product)
+            .where(Product.id == item['product'].id)
+            .values(units_sold=Product.units_sold + item['quantity'],
+                    popularity_score=Product.popularity_score + item['quantity'],
+                    updated_at=Product.updated_at)
+        )
+
+
+@app.cli.command('decay-popularity')
+@click.option('--factor', default=0.9, show_default=True, help='Multiplier applied to every score.')
+def decay_popularity_command(factor):
+    """Age popularity scores so recent sales weigh more, run daily from cron."""
+    result = db.session.execute(
+        update(Product).values(popularity_score=Product.popularity_score * factor,
+                               updated_at=Product.updated_at)
+    )
+    mark_listing_writes(db.session())
+    db.session.commit()
+    click.echo(f"Decayed popularity of {result.rowcount} products by {factor}")
+
+
+@app.cli.command('rebuild-popularity')
+def rebuild_popularity_command():
+    """Recompute sales counters from the full order history, archive included (one-off backfill)."""
+    items = union_all(
+        select(OrderItem.product_id, OrderItem.quantity),
+        select(ArchivedOrderItem.product_id, ArchivedOrderItem.quantity)).subquery()
+    sold = db.session.query(items.c.product_id, func.sum(items.c.quantity)) \
+        .group_by(items.c.product_id).all()
+    db.session.execute(
+        update(Product).values(units_sold=0, popularity_score=0, updated_at=Product.updated_at)
+    )
+    for product_id, quantity in sold:
+        db.session.execute(
+            update(Product).where(Product.id == product_id)
+            .values(units_sold=quantity, popularity_score=quantity, updated_at=Product.updated_at)
+        )
+    db.session.commit()
+    click.echo(f"Rebuilt sales counters for {len(sold)} products")
@@ -0,0 +1,174 @@
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+from functools import wraps
+from flask import after_this_request, current_app, jsonify, request, session
+from werkzeug.exceptions import TooManyRequests
+
+# name: (burst capacity, tokens refilled per second, client key)
+DEFAULT_POLICIES = {
+    'order_lookup': (10, 10 / 60, 'ip'),
+    'login': (5, 5 / 300, 'ip'),
+    'cart': (30, 1, 'session'),
+    'checkout': (5, 1 / 60, 'session'),
+}
+# Session policies also charge the client's IP, with this many times the
+# capacity and rate so a shared (NAT) address still fits several shoppers
+SESSION_IP_FACTOR = 10
+
+
+class MemoryStore:
+    """Buckets for a single process, used in development and tests"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            return allowed, tokens
+
+
+class SQLiteStore:
+    """Buckets in a small SQLite file shared by every gunicorn worker on the host"""
+
+    PURGE_EVERY = 1000  # takes per process between sweeps of idle buckets
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Not kept: connections must not be shared with workers forked later
+        conn = sqlite3.connect(path, timeout=1)
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket '
+                         '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+        conn.close()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate, now):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._takes += 1
+        if self._takes % self.PURGE_EVERY == 0:
+            self.purge(now - 86400)
+        return allowed, tokens
+
+    def purge(self, older_than):
+        """Drop buckets idle long enough to have refilled completely"""
+        conn = self._connect()
+        conn.execute('DELETE FROM bucket WHERE updated < ?', (older_than,))
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.store = None
+        self.policies = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', os.environ.get('RATELIMIT_ENABLED', '1') == '1')
+        app.config.setdefault('RATELIMIT_STORAGE', os.environ.get('RATELIMIT_STORAGE', 'sqlite'))
+        app.config.setdefault('RATELIMIT_SQLITE_PATH', os.path.join(app.instance_path, 'ratelimit.db'))
+        app.config.setdefault('RATE_LIMITS', {})
+
+        if app.config['RATELIMIT_STORAGE'] == 'memory':
+            self.store = MemoryStore()
+        else:
+            self.store = SQLiteStore(app.config['RATELIMIT_SQLITE_PATH'])
+        self.policies = dict(DEFAULT_POLICIES, **app.config['RATE_LIMITS'])
+        app.extensions['ratelimit'] = self
+
+    def _issue_session_id(self, response):
+        # Only a request that went through gets an id, never a 429
+        if response.status_code < 400:
+            session['_rl_id'] = os.urandom(8).hex()
+        return response
+
+    def _client_keys(self, kind):
+        """(client key, scale) pairs charged for the current request"""
+        ip_key = f"ip:{request.remote_addr}"
+        if kind != 'session':
+            return [(ip_key, 1)]
+        if session.get('_rl_id'):
+            # Minting fresh ids does not escape the limit: the IP pays as well
+            return [(f"s:{session['_rl_id']}", 1), (f"ips:{request.remote_addr}", SESSION_IP_FACTOR)]
+        # Clients without a session cookie yet (or bots dropping it) share
+        # their IP's bucket; the id set on success is used from the next request
+        after_this_request(self._issue_session_id)
+        return [(ip_key, 1)]
+
+    def hit(self, policy):
+        """Take one token for the current client, returns seconds to wait or 0"""
+        return max(self.take(policy, client_key, scale)
+                   for client_key, scale in self._client_keys(self.policies[policy][2]))
+
+    def take(self, policy, client_key, scale=1):
+        """hit() for a client key built by the caller, e.g. ``ip:1.2.3.4`` outside Flask"""
+        capacity, rate, _ = self.policies[policy]
+        capacity, rate = capacity * scale, rate * scale
+        key = f"{policy}:{client_key}"
+        try:
+            allowed, tokens = self.store.take(key, capacity, rate, time.time())
+        except sqlite3.Error:
+            # Fail open: a locked or broken limiter must not take the shop down
+            logging.exception("Rate limiter store unavailable")
+            return 0
+        if allowed:
+            return 0
+        return max(1, math.ceil((1 - tokens) / rate))
+
+    def limit(self, policy, methods=('POST',)):
+        """Decorator rejecting over-limit requests with 429 before the view runs"""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if current_app.config['RATELIMIT_ENABLED'] and request.method in methods:
+                    retry_after = self.hit(policy)
+                    if retry_after:
+                        logging.warning("Rate limit %s exceeded by %s", policy, request.remote_addr)
+                        if request.path.startswith('/api/'):
+                            response = jsonify({'error': 'Too many requests', 'retry_after': retry_after})
+                            response.status_code = 429
+                            response.headers['Retry-After'] = str(retry_after)
+                            return response
+                        raise TooManyRequests('طلبات كثيرة جداً، يرجى المحاولة لاحقاً', retry_after=retry_after)
+                return f(*args, **kwargs)
+            return decorated_function
+        return decorator
+
+
+limiter = RateLimiter()
+rate_limit = limiter.limit
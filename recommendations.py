@@ -0,0 +1,128 @@
+import logging
+import click
+from sqlalchemy import delete, insert, select, union_all
+from app import app, db
+from models import Product, OrderItem, ArchivedOrderItem, RelatedProduct
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # the pure Python build below is used instead
+    np = None
+    sparse = None
+
+RELATED_LIMIT = 4
+
+
+def _co_purchases_numpy(pairs, limit):
+    """Top co-purchased products per product from a sparse order x product matrix"""
+    order_ids = np.fromiter((p[0] for p in pairs), dtype=np.int64, count=len(pairs))
+    product_ids = np.fromiter((p[1] for p in pairs), dtype=np.int64, count=len(pairs))
+    orders, order_idx = np.unique(order_ids, return_inverse=True)
+    products, product_idx = np.unique(product_ids, return_inverse=True)
+
+    basket = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (order_idx, product_idx)),
+        shape=(len(orders), len(products)))
+    basket.data[:] = 1  # a product counts once per order whatever the quantity
+    co = (basket.T @ basket).tocsr()
+    co.setdiag(0)
+    co.eliminate_zeros()
+
+    result = {}
+    for row in range(co.shape[0]):
+        start, end = co.indptr[row], co.indptr[row + 1]
+        if start == end:
+            continue
+        cols, scores = co.indices[start:end], co.data[start:end]
+        # Highest count first, lower product id breaks ties
+        top = np.lexsort((products[cols], -scores))[:limit]
+        result[int(products[row])] = [(int(products[cols[i]]), float(scores[i])) for i in top]
+    return result
+
+
+def _co_purchases_python(pairs, limit):
+    from collections import defaultdict
+    baskets = defaultdict(set)
+    for order_id, product_id in pairs:
+        baskets[order_id].add(product_id)
+    counts = defaultdict(lambda: defaultdict(int))
+    for items in baskets.values():
+        for a in items:
+            for b in items:
+                if a != b:
+                    counts[a][b] += 1
+    return {
+        product_id: [(other, float(score)) for other, score in
+                     sorted(others.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]]
+        for product_id, others in counts.items()
+    }
+
+
+def build_related_products(limit=RELATED_LIMIT):
+    """Rebuild the RelatedProduct table from order history, archive included.
+
+    Products bought together come first; the remaining slots are filled with
+    other in-stock products of the same category. Returns the number of rows.
+    """
+    # Archived orders keep their ids, so the two tables never share an order
+    pairs = db.session.execute(union_all(
+        select(OrderItem.order_id, OrderItem.product_id),
+        select(ArchivedOrderItem.order_id, ArchivedOrderItem.product_id))).all()
+    if pairs:
+        build = _co_purchases_numpy if np is not None else _co_purchases_python
+        co_purchases = build(pairs, limit)
+    else:
+        co_purchases = {}
+
+    catalog = db.session.query(Product.id, Product.category_id, Product.in_stock) \
+        .order_by(Product.id).all()
+    by_category = {}
+    for product_id, category_id, in_stock in catalog:
+        if in_stock:
+            by_category.setdefault(category_id, []).append(product_id)
+
+    rows = []
+    for product_id, category_id, _ in catalog:
+        picks = list(co_purchases.get(product_id, []))
+        seen = {product_id} | {related_id for related_id, _ in picks}
+        for other in by_category.get(category_id, []):
+            if len(picks) >= limit:
+                break
+            if other not in seen:
+                picks.append((other, 0.0))
+                seen.add(other)
+        rows.extend({'product_id': product_id, 'rank': rank, 'related_id': related_id, 'score': score}
+                    for rank, (related_id, score) in enumerate(picks))
+
+    db.session.execute(delete(RelatedProduct))
+    if rows:
+        db.session.execute(insert(RelatedProduct), rows)
+    db.session.commit()
+    logging.info("Rebuilt related products: %d rows for %d products", len(rows), len(catalog))
+    return len(rows)
+
+
+def get_related_products(product, limit=RELATED_LIMIT):
+    """Related in-stock products for a product page, one indexed lookup"""
+    related = Product.query.join(RelatedProduct, RelatedProduct.related_id == Product.id).filter(
+        RelatedProduct.product_id == product.id,
+        Product.in_stock == True
+    ).order_by(RelatedProduct.rank).limit(limit).all()
+
+    if not related:
+        # Products added since the last rebuild have no rows yet
+        related = Product.query.filter(
+            Product.category_id == product.category_id,
+            Product.id != product.id,
+            Product.in_stock == True
+        ).limit(limit).all()
+    return related
+
+
+@app.cli.command('build-related')
+@click.option('--limit', default=RELATED_LIMIT, show_default=True, help='Related products kept per product.')
+def build_related_command(limit):
+    """Recompute "frequently bought together", run from cron (e.g. nightly)."""
+    count = build_related_products(limit)
+    click.echo(f"Stored {count} related product rows")
@@ -1,67 +1,114 @@
-from flask import render_template, request, redirect, url_for, session, flash, jsonify,send_from_directory
+from flask import render_template, request, redirect, url_for, session, flash, jsonify, abort, g, make_response
 from app import app, db
-from models import Product, Category, Order, OrderItem, Customer, Contact
+from models import Product, Category, Order, OrderItem, Contact
 from forms import CheckoutForm, ContactForm
 from utils import generate_order_number
-import json
+from recommendations import get_related_products
+from popularity import SORT_OPTIONS, DEFAULT_SORT, apply_sort, record_sales
+from facets import PRICE_BANDS, parse_facet_filters, apply_facet_filters, facet_counts
+from ratelimit import rate_limit
+from db_routing import read_only
+from sqlite_mode import write_transaction
+from orders import record_order_created
+from customers import find_or_create_customer
+from stock import reserve_stock, limit_cart
+from archive import find_order
+from urllib.parse import urlencode
+from collections import namedtuple
+from sqlalchemy.orm import selectinload
 
 @app.route('/')
+@read_only
 def index():
     featured_products = Product.query.filter_by(featured=True, in_stock=True).limit(8).all()
-    categories = Category.query.all()
+    # Left unevaluated: the category menu is a cached fragment and only
+    # runs this query when the fragment has to be re-rendered
+    categories = Category.query
     return render_template('index.html', 
                          featured_products=featured_products, 
                          categories=categories)
 
-@app.route('/shop')
-def shop():
-    page = request.args.get('page', 1, type=int)
-    category_id = request.args.get('category', type=int)
+SHOP_PAGE_SIZE = 12
+# What shop_cards.html reads from a Pagination, without its COUNT(*)
+CardsPage = namedtuple('CardsPage', 'page items')
+
+
+def _shop_listing():
+    """Filtered, sorted product query of the shop from the request args"""
     search = request.args.get('search', '')
+    sort = request.args.get('sort', DEFAULT_SORT)
+    if sort not in SORT_OPTIONS:
+        sort = DEFAULT_SORT
+    filters = parse_facet_filters(request.args)
     
-    query = Product.query.filter_by(in_stock=True)
-    
-    if category_id:
-        query = query.filter_by(category_id=category_id)
+    query = Product.query
     
     if search:
         query = query.filter(Product.name.contains(search) | 
                            Product.name_ar.contains(search))
     
-    products = query.paginate(page=page, per_page=12, error_out=False)
-    categories = Category.query.all()
+    # Query args of the current listing, reused by every filter, sort and page link
+    filter_args = {
+        'category': filters['category'],
+        'price': filters['price'],
+        'featured': '1' if filters['featured'] else None,
+        'in_stock': None if filters['in_stock'] else '0',
+        'search': search or None,
+        'sort': sort,
+    }
+    filter_args = {k: v for k, v in filter_args.items() if v is not None}
+    return query, apply_sort(apply_facet_filters(query, filters), sort), filters, search, sort, filter_args
+
+@app.route('/shop')
+@read_only
+def shop():
+    page = request.args.get('page', 1, type=int)
+    query, listing, filters, search, sort, filter_args = _shop_listing()
+    products = listing.paginate(page=page, per_page=SHOP_PAGE_SIZE, error_out=False)
+    categories = Category.query
     
     return render_template('shop.html', 
                          products=products, 
                          categories=categories,
-                         current_category=category_id,
-                         search_query=search)
+                         current_category=filters['category'],
+                         search_query=search,
+                         current_sort=sort,
+                         filters=filters,
+                         filter_args=filter_args,
+                         filter_key=urlencode(sorted(filter_args.items())),
+                         price_bands=PRICE_BANDS,
+                         # Only evaluated when the sidebar fragment is re-rendered
+                         facet_counts=lambda: facet_counts(query, filters))
+
+@app.route('/shop/cards')
+@read_only
+def shop_cards():
+    """The product cards of one shop page alone, appended by main.js as the visitor scrolls"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    _, listing, _, _, _, filter_args = _shop_listing()
+    # No COUNT(*): one extra row tells whether another page follows
+    rows = listing.offset((page - 1) * SHOP_PAGE_SIZE).limit(SHOP_PAGE_SIZE + 1).all()
+    products = CardsPage(page, rows[:SHOP_PAGE_SIZE])
+    response = make_response(render_template('shop_cards.html', products=products))
+    if len(rows) > SHOP_PAGE_SIZE:
+        response.headers['X-Next-Page'] = url_for('shop_cards', page=page + 1, **filter_args)
+    return response
 
 @app.route('/product/<int:id>')
+@read_only
 def product_detail(id):
-    product = Product.query.get_or_404(id)
-    related_products = Product.query.filter(
-        Product.category_id == product.category_id,
-        Product.id != product.id,
-        Product.in_stock == True
-    ).limit(4).all()
-    
-    additional_images = []
-    if product.additional_images:
-        try:
-            additional_images = json.loads(product.additional_images)
-        except:
-            additional_images = []
+    product = Product.query.options(selectinload(Product.images)).filter_by(id=id).first_or_404()
+    related_products = get_related_products(product)
     
     return render_template('product_detail.html', 
                          product=product, 
-                         related_products=related_products,
-                         additional_images=additional_images)
+                         related_products=related_products)
 
 @app.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
     product_id = request.form.get('product_id', type=int)
-    quantity = request.form.get('quantity', 1, type=int)
+    # Never below 1, a negative line would put units back into stock at checkout
+    quantity = max(request.form.get('quantity', 1, type=int) or 1, 1)
     
     product = Product.query.get_or_404(product_id)
     
@@ -126,6 +173,8 @@ def remove_from_cart(product_id):
     return redirect(url_for('cart'))
 
 @app.route('/checkout', methods=['GET', 'POST'])
+@rate_limit('checkout')
+@write_transaction
 def checkout():
     if 'cart' not in session or not session['cart']:
         flash('السلة فارغة', 'error')
@@ -140,7 +189,8 @@ def checkout():
         
         for product_id, quantity in session['cart'].items():
             product = Product.query.get(int(product_id))
-            if product and product.in_stock:
+            # Sold out tracked products stay in, reserve_stock reports them
+            if product and (product.in_stock or product.stock is not None):
                 item_total = product.price * quantity
                 cart_items.append({
                     'product': product,
@@ -154,15 +204,7 @@ def checkout():
             return redirect(url_for('cart'))
         
         # Create or get customer
-        customer = Customer.query.filter_by(phone=form.phone.data).first()
-        if not customer:
-            customer = Customer(
-                name=form.name.data,
-                phone=form.phone.data,
-                email=form.email.data
-            )
-            db.session.add(customer)
-            db.session.flush()
+        customer = find_or_create_customer(form.name.data, form.phone.data, form.email.data)
         
         # Create order
         order = Order(
@@ -186,6 +228,17 @@ def checkout():
             )
             db.session.add(order_item)
         
+        # Last before commit, so the product rows stay locked as briefly as possible
+        shortages = reserve_stock(cart_items)
+        if shortages:
+            db.session.rollback()
+            session['cart'] = limit_cart(session['cart'], shortages)
+            details = '، '.join(f"{s['name_ar']} (المتوفر: {s['available']})" for s in shortages)
+            flash(f'الكمية المطلوبة غير متوفرة لبعض المنتجات: {details}. تم تعديل السلة، يرجى مراجعتها', 'error')
+            return redirect(url_for('cart'))
+        
+        record_sales(cart_items)
+        record_order_created(order, customer)
         db.session.commit()
         
         # Clear cart
@@ -213,22 +266,26 @@ def checkout():
 
 @app.route('/order_success/<order_number>')
 def order_success(order_number):
-    order = Order.query.filter_by(order_number=order_number).first_or_404()
+    order = find_order(order_number)
+    if order is None:
+        abort(404)
     return render_template('order_success.html', order=order)
 
 @app.route('/track_order', methods=['GET', 'POST'])
+@rate_limit('order_lookup')
 def track_order():
     order = None
     if request.method == 'POST':
         order_number = request.form.get('order_number')
         if order_number:
-            order = Order.query.filter_by(order_number=order_number).first()
+            order = find_order(order_number.strip())
             if not order:
                 flash('لم يتم العثور على الطلب', 'error')
     
     return render_template('track_order.html', order=order)
 
 @app.route('/contact', methods=['GET', 'POST'])
+@write_transaction
 def contact():
     form = ContactForm()
     
@@ -248,14 +305,15 @@ def contact():
     
     return render_template('contact.html', form=form)
 
-@app.route('/uploads/<filename>')
+@app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    """Serve uploaded files (images) from the uploads directory"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve uploaded files (images) from the upload storage"""
+    return app.extensions['storage'].serve(filename)
 
 @app.context_processor
 def inject_cart_count():
     cart_count = 0
-    if 'cart' in session:
+    # Cached pages are shared, main.js fills their badge from the cart_count cookie
+    if 'cart' in session and not g.get('page_cache_path'):
         cart_count = sum(session['cart'].values())
     return {'cart_count': cart_count}
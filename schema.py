@@ -0,0 +1,27 @@
+import logging
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+from app import db
+
+
+def upgrade_schema():
+    """Add columns and indexes declared on the models but missing from existing tables.
+
+    db.create_all() only creates tables that do not exist yet, so new columns
+    must be nullable or carry a server_default to be added this way.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        preparer = conn.dialect.identifier_preparer
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}")
+                logging.info("Added column %s.%s", table.name, column.name)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
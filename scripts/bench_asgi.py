@@ -0,0 +1,149 @@
+"""Concurrent-connection throughput of the catalog API, Flask under gunicorn vs asgi_api under uvicorn.
+
+Both servers get the same number of worker processes and the same seeded
+SQLite database. The client connections run on one event loop and loop
+over /api/products pages and /api/products/<id>. With --slow-ms every
+request is sent in two halves that far apart, like a mobile client on a
+bad link, which ties up a sync worker but only parks a coroutine:
+
+    python scripts/bench_asgi.py --workers 2 --connections 16,64,256 --seconds 10 --slow-ms 50
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRODUCTS = 200
+
+SEED = r"""
+import logging
+from app import app, db
+from models import Category, Product
+logging.disable(logging.CRITICAL)
+with app.app_context():
+    category = Category(name='Bench', name_ar='اختبار')
+    db.session.add(category)
+    db.session.flush()
+    db.session.add_all([Product(name=f'P{i}', name_ar=f'منتج {i}', price=1000 + i,
+                                category_id=category.id) for i in range(%d)])
+    db.session.commit()
+""" % PRODUCTS
+
+SERVERS = {
+    'gunicorn+flask': lambda port, workers: [sys.executable, '-m', 'gunicorn', 'main:app', '--bind',
+                                             f'127.0.0.1:{port}', '--workers', str(workers),
+                                             '--log-level', 'warning'],
+    'uvicorn+asgi': lambda port, workers: [sys.executable, '-m', 'uvicorn', 'asgi_api:application', '--host',
+                                           '127.0.0.1', '--port', str(port), '--workers', str(workers),
+                                           '--log-level', 'warning', '--no-access-log'],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def fetch(port, path, slow):
+    """One GET on a fresh connection, returns the status code"""
+    request = f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n'.encode()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        if slow:
+            writer.write(request[:20])
+            await writer.drain()
+            await asyncio.sleep(slow)
+        writer.write(request[20:] if slow else request)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response[9:12])
+
+
+def wait_until_up(port, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit('The server exited during startup')
+        try:
+            asyncio.run(fetch(port, '/api/products/1', 0))
+            return
+        except (OSError, ValueError):
+            time.sleep(0.2)
+    raise SystemExit('The server did not start')
+
+
+async def load(port, connections, seconds, slow):
+    """``connections`` concurrent clients from one event loop, so the client side is not the bottleneck"""
+    deadline = time.monotonic() + seconds
+    latencies = []
+    errors = 0
+
+    async def client(index):
+        nonlocal errors
+        rng = random.Random(index)
+        while time.monotonic() < deadline:
+            path = rng.choice([f'/api/products?page={rng.randint(1, 16)}',
+                               f'/api/products/{rng.randint(1, PRODUCTS)}'])
+            started = time.perf_counter()
+            try:
+                ok = await asyncio.wait_for(fetch(port, path, slow), 60) == 200
+            except (OSError, ValueError, asyncio.TimeoutError):
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    await asyncio.gather(*(client(i) for i in range(connections)))
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000 if latencies else 0
+    return len(latencies) / seconds, pick(0.5), pick(0.99), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--connections', default='16,64,256', help='comma separated concurrency levels')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--slow-ms', type=float, default=0, help='pause inside each request, a slow client')
+    args = parser.parse_args()
+    levels = [int(level) for level in args.connections.split(',')]
+
+    workdir = tempfile.mkdtemp(prefix='decluxdz-asgi-')
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+               JINJA_BYTECODE_CACHE_DIR=os.path.join(workdir, 'jinja'),
+               PAGE_CACHE_DIR=os.path.join(workdir, 'pages'),
+               RATELIMIT_ENABLED='0')
+    try:
+        subprocess.run([sys.executable, '-c', SEED], cwd=ROOT, env=env, check=True, capture_output=True)
+        for name, command in SERVERS.items():
+            port = free_port()
+            server = subprocess.Popen(command(port, args.workers), cwd=ROOT, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_until_up(port, server)
+                for connections in levels:
+                    rate, p50, p99, errors = asyncio.run(
+                        load(port, connections, args.seconds, args.slow_ms / 1000))
+                    print(f"{name:<15} {connections:5d} conns: {rate:8.1f} req/s   p50 {p50:7.1f} ms   "
+                          f"p99 {p99:8.1f} ms   errors {errors}")
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Measure boot-to-first-byte of the app with and without the Jinja bytecode cache.
+
+Each sample is a fresh interpreter that imports the app and requests a page
+through the test client, which is what a new gunicorn worker goes through.
+
+    python scripts/bench_boot.py --runs 5 --path /shop
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import time, json, logging
+started = time.perf_counter()
+from app import app
+booted = time.perf_counter()
+logging.disable(logging.CRITICAL)
+response = app.test_client().get(PATH)
+first_byte = time.perf_counter()
+print(json.dumps({'status': response.status_code,
+                  'boot': booted - started,
+                  'ttfb': first_byte - started}))
+"""
+
+
+def run_once(path, env):
+    code = CHILD.replace('PATH', repr(path))
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(label, samples):
+    ttfb = [s['ttfb'] * 1000 for s in samples]
+    boot = [s['boot'] * 1000 for s in samples]
+    render = [t - b for t, b in zip(ttfb, boot)]
+    print(f"{label:<22} boot {statistics.median(boot):7.1f} ms   "
+          f"first request {statistics.median(render):7.1f} ms   "
+          f"first byte {statistics.median(ttfb):7.1f} ms   (median of {len(samples)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='decluxdz-boot-')
+    cache_dir = os.path.join(workdir, 'jinja_cache')
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    env['JINJA_BYTECODE_CACHE_DIR'] = cache_dir
+
+    try:
+        run_once(args.path, env)  # create the database outside of the samples
+
+        cold = []
+        for _ in range(args.runs):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            cold.append(run_once(args.path, env))
+
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'precompile-templates'],
+                       cwd=ROOT, env=env, check=True, capture_output=True)
+        warm = [run_once(args.path, env) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summarize('no bytecode cache', cold)
+    summarize('precompiled bytecode', warm)
+
+
+if __name__ == '__main__':
+    main()
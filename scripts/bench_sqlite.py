@@ -0,0 +1,101 @@
+"""Concurrent read throughput and write reliability of SQLite, default vs tuned mode.
+
+Several processes (standing in for gunicorn workers) share one database file.
+Readers list products through /api/products, writers place orders through
+/api/checkout. Run once with SQLITE_TUNING=0 (rollback journal, deferred
+transactions) and once tuned (WAL, pragmas, BEGIN IMMEDIATE):
+
+    python scripts/bench_sqlite.py --readers 4 --writers 4 --seconds 10
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED = r"""
+import logging
+from app import app, db
+from models import Category, Product
+logging.disable(logging.CRITICAL)
+with app.app_context():
+    category = Category(name='Bench', name_ar='اختبار')
+    db.session.add(category)
+    db.session.flush()
+    db.session.add_all([Product(name=f'P{i}', name_ar=f'منتج {i}', price=1000 + i,
+                                category_id=category.id) for i in range(200)])
+    db.session.commit()
+"""
+
+WORKER = r"""
+import sys, json, time, random, logging
+from app import app
+logging.disable(logging.CRITICAL)
+role, seconds = sys.argv[1], float(sys.argv[2])
+client = app.test_client()
+ok = errors = 0
+latencies = []
+deadline = time.monotonic() + seconds
+while time.monotonic() < deadline:
+    started = time.perf_counter()
+    if role == 'reader':
+        response = client.get(f'/api/products?page={random.randint(1, 16)}&sort=price_asc')
+    else:
+        client.post('/api/cart', json={'product_id': random.randint(1, 200), 'quantity': 1})
+        response = client.post('/api/checkout', json={
+            'name': 'Bench', 'phone': f'0555{random.randint(0, 999999):06d}',
+            'address': 'Constantine', 'wilaya': 'قسنطينة'})
+    latencies.append(time.perf_counter() - started)
+    if response.status_code == 200:
+        ok += 1
+    else:
+        errors += 1
+print(json.dumps({'role': role, 'ok': ok, 'errors': errors, 'latencies': latencies}))
+"""
+
+
+def run(mode_env, readers, writers, seconds):
+    workdir = tempfile.mkdtemp(prefix='decluxdz-sqlite-')
+    env = dict(os.environ, **mode_env,
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+               JINJA_BYTECODE_CACHE_DIR=os.path.join(workdir, 'jinja'),
+               RATELIMIT_ENABLED='0')
+    try:
+        subprocess.run([sys.executable, '-c', SEED], cwd=ROOT, env=env, check=True, capture_output=True)
+        procs = [subprocess.Popen([sys.executable, '-c', WORKER, role, str(seconds)], cwd=ROOT, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                 for role in ['reader'] * readers + ['writer'] * writers]
+        results = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in procs]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = {}
+    for role in ('reader', 'writer'):
+        rows = [r for r in results if r['role'] == role]
+        latencies = sorted(l for r in rows for l in r['latencies'])
+        ok = sum(r['ok'] for r in rows)
+        errors = sum(r['errors'] for r in rows)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0
+        summary[role] = (ok / seconds, errors, p95)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    for label, mode_env in (('default', {'SQLITE_TUNING': '0'}), ('tuned', {'SQLITE_TUNING': '1'})):
+        summary = run(mode_env, args.readers, args.writers, args.seconds)
+        for role, (rate, errors, p95) in summary.items():
+            print(f"{label:<8} {role}s: {rate:8.1f} req/s   errors {errors:5d}   p95 {p95:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+"""Load and soak test of browse, cart and checkout traffic against gunicorn.
+
+Seeds a throwaway database, starts the app under gunicorn with N workers and
+drives mixed traffic from client processes running many threads each, every
+thread being one shopper with its own session cookie. Reports throughput,
+p50/p95/p99 latency and errors per action, SQLite write lock waits, locked
+database errors, order number collisions and pool exhaustion from the server
+log, and checks afterwards that no order went missing and nothing was
+oversold. With --soak the resident memory of every worker is sampled during
+the run. Nothing leaves the machine:
+
+    python scripts/load_checkout.py --workers 4 --clients 32 --seconds 30
+    python scripts/load_checkout.py --workers 4 --clients 16 --seconds 1800 --soak
+    python scripts/load_checkout.py --stock 20 --mix 20,30,50
+
+LOAD_DATABASE_URL points the run at another empty database, e.g. a local
+PostgreSQL one; it is filled with seed data.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ACTIONS = ('browse', 'cart', 'checkout')
+WILAYAS = ('الجزائر', 'وهران', 'قسنطينة', 'عنابة', 'سطيف')
+
+SEED = r"""
+import sys, logging
+from app import app, db
+from models import Category, Product
+logging.disable(logging.CRITICAL)
+products, stock = int(sys.argv[1]), int(sys.argv[2])
+with app.app_context():
+    categories = [Category(name=f'Load {i}', name_ar=f'قسم {i}') for i in range(8)]
+    db.session.add_all(categories)
+    db.session.flush()
+    db.session.add_all([Product(name=f'P{i}', name_ar=f'منتج {i}', price=1000 + i,
+                                category_id=categories[i % len(categories)].id, featured=i < 8,
+                                stock=stock if stock >= 0 else None) for i in range(products)])
+    db.session.commit()
+"""
+
+# Server log lines worth counting, see sqlite_mode.py and api_checkout()
+LOG_PATTERNS = {
+    'lock_wait': re.compile(r'Waited ([\d.]+) ms for the SQLite write lock'),
+    'lock_retry': re.compile(r'Database locked in \w+, retrying'),
+    'locked_error': re.compile(r'OperationalError.*database is locked'),
+    'order_number_collision': re.compile(r'(UNIQUE constraint failed|duplicate key value).*order_number'),
+    'pool_exhausted': re.compile(r'QueuePool limit of size'),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Shopper:
+    """One browser: keeps its cookies and talks HTTP/1.1 to the server"""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookies = {}
+
+    def request(self, method, path, body=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = {'Connection': 'close'}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            conn.request(method, path, body=data, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            for header in response.headers.get_all('Set-Cookie') or []:
+                name, _, value = header.split(';', 1)[0].partition('=')
+                self.cookies[name.strip()] = value
+            return response.status
+        finally:
+            conn.close()
+
+
+def run_clients(port, clients, seconds, weights, products, seed):
+    """One client process: ``clients`` shopper threads until the deadline"""
+    deadline = time.monotonic() + seconds
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    outcomes = defaultdict(lambda: defaultdict(int))
+
+    def record(action, started, outcome):
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies[action].append(elapsed)
+            outcomes[action][outcome] += 1
+
+    def shopper(index):
+        rng = random.Random(seed * 10000 + index)
+        user = Shopper(port)
+        in_cart = 0
+        phone = f'0555{seed:02d}{index:04d}'
+        while time.monotonic() < deadline:
+            action = rng.choices(ACTIONS, weights)[0]
+            started = time.perf_counter()
+            try:
+                if action == 'browse':
+                    path = rng.choice(['/', f'/shop?page={rng.randint(1, 5)}',
+                                       f'/shop?category={rng.randint(1, 8)}',
+                                       f'/product/{rng.randint(1, products)}',
+                                       f'/api/products?page={rng.randint(1, 5)}'])
+                    status = user.request('GET', path)
+                elif action == 'cart' or not in_cart:
+                    action = 'cart'
+                    status = user.request('POST', '/api/cart', {'product_id': rng.randint(1, products),
+                                                                'quantity': rng.randint(1, 2)})
+                    in_cart += status == 200
+                else:
+                    status = user.request('POST', '/api/checkout', {
+                        'name': f'Load {index}', 'phone': phone, 'address': 'Load test',
+                        'wilaya': rng.choice(WILAYAS)})
+                    if status in (200, 409):  # ordered, or the cart was cut to what is left
+                        in_cart = 0
+            except OSError as e:
+                record(action, started, f'connection:{type(e).__name__}')
+                continue
+            if (action, status) in (('checkout', 409), ('cart', 404)):
+                outcome = 'out_of_stock'
+            elif status < 400:
+                outcome = 'ok'
+            else:
+                outcome = f'http_{status}'
+            record(action, started, outcome)
+
+    threads = [threading.Thread(target=shopper, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {action: {'latencies': latencies[action], 'outcomes': dict(outcomes[action])}
+            for action in latencies}
+
+
+def worker_pids(master_pid):
+    pids = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    # The command name may contain spaces, the parent pid follows its closing paren
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == master_pid:
+                        pids.append(int(name))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def rss_mib(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def sample_memory(master_pid, interval, stop, samples):
+    while not stop.wait(interval):
+        now = time.monotonic()
+        for pid in worker_pids(master_pid):
+            rss = rss_mib(pid)
+            if rss is not None:
+                samples[pid].append((now, rss))
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def wait_until_up(port, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit('gunicorn exited during startup, see the server log')
+        try:
+            Shopper(port).request('GET', '/api/products?page=1')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit('gunicorn did not answer within %d s' % timeout)
+
+
+def check_database(database_url, seeded_stock):
+    """Orders and stock after the run, read straight from the database"""
+    from sqlalchemy import create_engine, text
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        result = {
+            'orders': conn.execute(text('SELECT COUNT(*) FROM "order"')).scalar(),
+            'duplicate_order_numbers': conn.execute(text(
+                'SELECT COUNT(*) FROM (SELECT order_number FROM "order" GROUP BY order_number '
+                'HAVING COUNT(*) > 1) d')).scalar(),
+        }
+        if seeded_stock >= 0:
+            result['negative_stock'] = conn.execute(text('SELECT COUNT(*) FROM product WHERE stock < 0')).scalar()
+            result['oversold_products'] = conn.execute(text(
+                'SELECT COUNT(*) FROM (SELECT product_id FROM order_item GROUP BY product_id '
+                'HAVING SUM(quantity) > :stock) o'), {'stock': seeded_stock}).scalar()
+    engine.dispose()
+    return result
+
+
+def report(results, seconds, log_counts, lock_waits, database, memory):
+    print(f"\n{'action':<10}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}   outcomes")
+    for action in ACTIONS:
+        merged = [r[action] for r in results if action in r]
+        latencies = sorted(l for r in merged for l in r['latencies'])
+        outcomes = defaultdict(int)
+        for r in merged:
+            for outcome, count in r['outcomes'].items():
+                outcomes[outcome] += count
+        errors = sum(c for o, c in outcomes.items() if o not in ('ok', 'out_of_stock'))
+        print(f"{action:<10}{len(latencies) / seconds:9.1f}{percentile(latencies, .5):9.1f}"
+              f"{percentile(latencies, .95):9.1f}{percentile(latencies, .99):9.1f}{errors:8d}   "
+              + ', '.join(f'{o}={c}' for o, c in sorted(outcomes.items())))
+
+    print('\nserver log')
+    if lock_waits:
+        lock_waits.sort()
+        print(f"  SQLite write lock waits: {len(lock_waits)}, p50 {percentile(lock_waits, .5):.1f} ms, "
+              f"p99 {percentile(lock_waits, .99):.1f} ms, max {lock_waits[-1]:.1f} ms")
+    for name, count in log_counts.items():
+        if name != 'lock_wait':
+            print(f"  {name.replace('_', ' ')}: {count}")
+
+    print('\ndatabase')
+    answered = sum(r['checkout']['outcomes'].get('ok', 0) for r in results if 'checkout' in r)
+    print(f"  checkouts answered 200: {answered}")
+    for name, value in database.items():
+        print(f"  {name.replace('_', ' ')}: {value}")
+
+    if memory:
+        print('\nworker memory (RSS)')
+        for pid, samples in sorted(memory.items()):
+            (t0, first), (t1, last) = samples[0], samples[-1]
+            hours = max(t1 - t0, 1e-9) / 3600
+            print(f"  pid {pid}: {first:.1f} -> {last:.1f} MiB (max {max(s[1] for s in samples):.1f}), "
+                  f"{last - first:+.1f} MiB, {(last - first) / hours:+.1f} MiB/h over {len(samples)} samples")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker (gthread above 1)')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent shoppers in total')
+    parser.add_argument('--processes', type=int, default=4, help='client processes the shoppers are spread over')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--mix', default='70,20,10', help='browse,cart,checkout weights')
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--stock', type=int, default=-1, help='units per product, -1 leaves stock untracked')
+    parser.add_argument('--soak', action='store_true', help='sample worker memory during the run')
+    parser.add_argument('--sample-interval', type=float, default=5, help='seconds between memory samples')
+    parser.add_argument('--keep', action='store_true', help='keep the database and server log')
+    args = parser.parse_args()
+    weights = [float(w) for w in args.mix.split(',')]
+    if len(weights) != len(ACTIONS):
+        parser.error('--mix takes three weights: browse,cart,checkout')
+
+    workdir = tempfile.mkdtemp(prefix='decluxdz-load-')
+    database_url = os.environ.get('LOAD_DATABASE_URL') or f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    env = dict(os.environ,
+               DATABASE_URL=database_url,
+               RATELIMIT_ENABLED='0',
+               SQLITE_LOCK_WAIT_LOG_MS='1',
+               PAGE_CACHE_DIR=os.path.join(workdir, 'pages'),
+               JINJA_BYTECODE_CACHE_DIR=os.path.join(workdir, 'jinja'))
+    log_path = os.path.join(workdir, 'server.log')
+    port = free_port()
+    server = None
+    try:
+        subprocess.run([sys.executable, '-c', SEED, str(args.products), str(args.stock)],
+                       cwd=ROOT, env=env, check=True, capture_output=True)
+        with open(log_path, 'w') as log:
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', 'main:app', '--bind', f'127.0.0.1:{port}',
+                 '--workers', str(args.workers), '--threads', str(args.threads),
+                 '--timeout', '120', '--log-level', 'warning'],
+                cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        wait_until_up(port, server)
+        print(f"gunicorn: {args.workers} workers x {args.threads} threads on port {port}, "
+              f"database {database_url.split('://')[0]}, {args.clients} shoppers for {args.seconds:.0f} s")
+
+        memory = defaultdict(list)
+        stop = threading.Event()
+        sampler = None
+        if args.soak:
+            if not os.path.isdir('/proc'):
+                print('--soak needs /proc (Linux), memory is not sampled')
+            else:
+                sampler = threading.Thread(target=sample_memory, daemon=True,
+                                           args=(server.pid, args.sample_interval, stop, memory))
+                for pid in worker_pids(server.pid):
+                    memory[pid].append((time.monotonic(), rss_mib(pid)))
+                sampler.start()
+
+        per_process = [args.clients // args.processes + (i < args.clients % args.processes)
+                       for i in range(args.processes)]
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            futures = [pool.submit(run_clients, port, clients, args.seconds, weights, args.products, i)
+                       for i, clients in enumerate(per_process) if clients]
+            results = [future.result() for future in futures]
+        if sampler is not None:
+            stop.set()
+            sampler.join()
+            for pid in worker_pids(server.pid):
+                memory[pid].append((time.monotonic(), rss_mib(pid)))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    log_counts = {name: 0 for name in LOG_PATTERNS}
+    lock_waits = []
+    with open(log_path, encoding='utf-8', errors='replace') as log:
+        for line in log:
+            for name, pattern in LOG_PATTERNS.items():
+                match = pattern.search(line)
+                if match:
+                    log_counts[name] += 1
+                    if name == 'lock_wait':
+                        lock_waits.append(float(match.group(1)))
+    database = check_database(database_url, args.stock)
+    report(results, args.seconds, log_counts, lock_waits, database,
+           {pid: [s for s in samples if s[1] is not None] for pid, samples in memory.items() if len(samples) > 1})
+    if args.keep:
+        print(f"\ndatabase and server log kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import json
+
+from models import Product
+from gallery import load_galleries
+
+
+class ProductSerializer:
+    """Declares which product columns the API exposes.
+
+    ``?fields=id,name,price`` picks a subset, and the query then selects only
+    those columns and returns plain rows instead of full ORM objects. The
+    gallery fields come from product_image and are loaded with one query per
+    page, however many of them were asked for.
+    """
+    model = Product
+    # every public field, in output order
+    fields = ('id', 'name', 'name_ar', 'description', 'description_ar', 'price', 'category_id',
+              'image_url', 'images', 'additional_images', 'in_stock', 'featured', 'created_at', 'updated_at')
+    # fields that are not columns, see gallery_extras()
+    extra_fields = ('images', 'additional_images')
+    # What /api/products returned before fieldsets existed
+    default_fields = ('id', 'name', 'name_ar', 'description', 'description_ar', 'price',
+                      'category_id', 'image_url', 'featured')
+    detail_fields = ('id', 'name', 'name_ar', 'description', 'description_ar', 'price',
+                     'category_id', 'image_url', 'images', 'additional_images', 'in_stock', 'featured')
+    card_fields = ('id', 'name', 'name_ar', 'price', 'image_url')
+
+    @classmethod
+    def parse_fields(cls, raw, default=None):
+        """Field names from a ``fields`` argument, raising ValueError on unknown or no names"""
+        if not raw:
+            return tuple(default or cls.default_fields)
+        requested = [name.strip() for name in raw.split(',') if name.strip()]
+        if not requested:
+            raise ValueError(f"fields must name at least one of: {', '.join(cls.fields)}")
+        unknown = [name for name in requested if name not in cls.fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}. "
+                             f"Available: {', '.join(cls.fields)}")
+        # Keep the declared order so responses are stable whatever the client sent
+        return tuple(name for name in cls.fields if name in requested)
+
+    @classmethod
+    def columns(cls, fields):
+        # id always comes first, extra fields and callers need it
+        return ('id',) + tuple(name for name in fields if name != 'id' and name not in cls.extra_fields)
+
+    @classmethod
+    def select(cls, query, fields, also=()):
+        """Narrow an ORM query of Product to the columns behind ``fields``.
+
+        Columns in ``also`` are selected after them for the caller's own use.
+        """
+        return query.with_entities(*(getattr(cls.model, name) for name in cls.columns(fields) + tuple(also)))
+
+    @classmethod
+    def gallery_extras(cls, fields, galleries):
+        """{field: {id: value}} of the gallery fields in ``fields``.
+
+        ``galleries`` is {id: [ProductImage or row with its columns]}.
+        """
+        extras = {}
+        if 'images' in fields:
+            extras['images'] = {id_: [{'filename': image.filename, 'width': image.width, 'height': image.height}
+                                      for image in images] for id_, images in galleries.items()}
+        if 'additional_images' in fields:
+            # JSON-encoded filenames, as the legacy column returned them
+            extras['additional_images'] = {
+                id_: json.dumps([image.filename for image in images]) if images else None
+                for id_, images in galleries.items()}
+        return extras
+
+    @classmethod
+    def _dump(cls, ids, values, fields, extras=None):
+        if extras is None:
+            wanted = [name for name in fields if name in cls.extra_fields]
+            extras = cls.gallery_extras(wanted, load_galleries(ids)) if wanted else {}
+        return [{name: extras[name][id_] if name in extras else value[name] for name in fields}
+                for id_, value in zip(ids, values)]
+
+    @classmethod
+    def dump_rows(cls, rows, fields, extras=None):
+        """Serialize rows returned by a select() query, in order.
+
+        ``extras`` ({field: {id: value}}) is used instead of loading the
+        galleries, for callers that loaded them themselves.
+        """
+        columns = cls.columns(fields)
+        return cls._dump([row[0] for row in rows], [dict(zip(columns, row)) for row in rows], fields, extras)
+
+    @classmethod
+    def dump_objects(cls, objects, fields=None):
+        """Serialize loaded products, in order"""
+        fields = fields or cls.default_fields
+        columns = cls.columns(fields)
+        return cls._dump([obj.id for obj in objects],
+                         [{name: getattr(obj, name) for name in columns} for obj in objects], fields)
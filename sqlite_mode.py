@@ -0,0 +1,108 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+from functools import wraps
+import click
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from app import db
+
+# Applied to every new SQLite connection (primary and replicas)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',          # readers no longer block behind a writer
+    'busy_timeout': 5000,           # ms to wait for a lock instead of failing at once
+    'synchronous': 'NORMAL',        # fsync at checkpoints only, safe with WAL
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,       # negative means KiB, so 64 MiB per connection
+    'temp_store': 'MEMORY',
+}
+WRITE_RETRIES = 3
+
+
+def _is_sqlite(dialect):
+    return dialect.name == 'sqlite'
+
+
+def _is_locked(error):
+    return 'database is locked' in str(getattr(error, 'orig', error))
+
+
+def init_sqlite_mode(app):
+    app.config.setdefault('SQLITE_TUNING', os.environ.get('SQLITE_TUNING', '1') == '1')
+    app.config.setdefault('SQLITE_PRAGMAS', dict(SQLITE_PRAGMAS))
+    # Waits for the write lock at least this long are logged, scripts/load_checkout.py counts them
+    app.config.setdefault('SQLITE_LOCK_WAIT_LOG_MS', float(os.environ.get('SQLITE_LOCK_WAIT_LOG_MS', '100')))
+    if not app.config['SQLITE_TUNING']:
+        return
+    pragmas = app.config['SQLITE_PRAGMAS']
+    lock_wait_log_ms = app.config['SQLITE_LOCK_WAIT_LOG_MS']
+
+    @event.listens_for(Engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        # Let SQLAlchemy emit BEGIN itself (see begin_sqlite_transaction)
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    @event.listens_for(Engine, 'begin')
+    def begin_sqlite_transaction(conn):
+        if not _is_sqlite(conn.dialect):
+            return
+        # Writers take the write lock up front so two deferred transactions
+        # never deadlock upgrading their read locks, which busy_timeout cannot fix
+        immediate = has_app_context() and g.get('db_write_transaction')
+        if not immediate:
+            conn.exec_driver_sql('BEGIN')
+            return
+        started = time.perf_counter()
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+        waited = (time.perf_counter() - started) * 1000
+        if waited >= lock_wait_log_ms:
+            logging.warning("Waited %.1f ms for the SQLite write lock", waited)
+
+    @app.cli.command('sqlite-checkpoint')
+    @click.option('--mode', default='TRUNCATE', show_default=True,
+                  type=click.Choice(['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'], case_sensitive=False))
+    def sqlite_checkpoint_command(mode):
+        """Copy the WAL back into the database file and shrink it."""
+        if not _is_sqlite(db.engine.dialect):
+            raise click.ClickException('The database is not SQLite')
+        with db.engine.connect() as conn:
+            busy, wal_pages, moved = conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode.upper()})").one()
+        click.echo(f"checkpoint {mode.upper()}: busy={busy} wal_pages={wal_pages} checkpointed={moved}")
+        if busy:
+            raise click.ClickException('A reader or writer blocked the checkpoint, try again')
+
+
+def write_transaction(f):
+    """Run a writing view inside BEGIN IMMEDIATE, retrying if SQLite stays locked.
+
+    GET requests are untouched. The view is re-run after a rollback, so it
+    must not have side effects outside the database before it commits.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method == 'GET':
+            return f(*args, **kwargs)
+        g.db_write_transaction = True
+        try:
+            for attempt in range(WRITE_RETRIES):
+                try:
+                    return f(*args, **kwargs)
+                except OperationalError as e:
+                    db.session.rollback()
+                    if not _is_locked(e) or attempt == WRITE_RETRIES - 1:
+                        raise
+                    logging.warning("Database locked in %s, retrying (%d)", f.__name__, attempt + 1)
+                    time.sleep(0.05 * (2 ** attempt) + random.random() * 0.05)
+        finally:
+            g.db_write_transaction = False
+    return decorated_function
@@ -8,6 +8,7 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     // Cart functionality
+    updateCartBadge();
     initializeCart();
     
     // Product quantity controls
@@ -16,6 +17,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Image gallery
     initializeImageGallery();
     
+    // Shop infinite scroll
+    initializeInfiniteScroll();
+    
     // Form validation
     initializeFormValidation();
     
@@ -25,37 +29,54 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
+// Cart badge, also on pages served from the page cache
+function updateCartBadge() {
+    const badge = document.getElementById('cart-count');
+    const match = document.cookie.match(/(?:^|;\s*)cart_count=(\d+)/);
+    if (!badge) {
+        return;
+    }
+    const count = match ? parseInt(match[1], 10) : 0;
+    badge.textContent = count;
+    badge.style.display = count > 0 ? '' : 'none';
+}
+
 // Cart functionality
 function initializeCart() {
-    // Add to cart buttons
-    
-            
-            // Show loading state
-            const originalText = this.innerHTML;
-            this.innerHTML = '<i class="fas fa-spinner fa-spin"></i> جارِ الإضافة...';
-            this.disabled = true;
-            
-            // Add to cart via form submission
-            const form = document.createElement('form');
-            form.method = 'POST';
-            form.action = '/add_to_cart';
-            
-            const productIdInput = document.createElement('input');
-            productIdInput.type = 'hidden';
-            productIdInput.name = 'product_id';
-            productIdInput.value = productId;
-            
-            const quantityInput = document.createElement('input');
-            quantityInput.type = 'hidden';
-            quantityInput.name = 'quantity';
-            quantityInput.value = quantity;
-            
-            form.appendChild(productIdInput);
-            form.appendChild(quantityInput);
-            document.body.appendChild(form);
-            form.submit();
-        };
-    
+    // Add to cart buttons, delegated so cards appended by the infinite scroll work too
+    document.addEventListener('click', function(e) {
+        const button = e.target.closest('.add-to-cart-btn');
+        if (!button || button.disabled) {
+            return;
+        }
+        e.preventDefault();
+        const productId = button.dataset.productId;
+        const quantity = button.dataset.quantity || 1;
+
+        // Show loading state
+        button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> جارِ الإضافة...';
+        button.disabled = true;
+
+        // Add to cart via form submission
+        const form = document.createElement('form');
+        form.method = 'POST';
+        form.action = '/add_to_cart';
+
+        const productIdInput = document.createElement('input');
+        productIdInput.type = 'hidden';
+        productIdInput.name = 'product_id';
+        productIdInput.value = productId;
+
+        const quantityInput = document.createElement('input');
+        quantityInput.type = 'hidden';
+        quantityInput.name = 'quantity';
+        quantityInput.value = quantity;
+
+        form.appendChild(productIdInput);
+        form.appendChild(quantityInput);
+        document.body.appendChild(form);
+        form.submit();
+    });
 
     // Update cart quantities
     document.querySelectorAll('.cart-quantity-input').forEach(input => {
@@ -75,7 +96,54 @@ function initializeCart() {
             }
         });
     });
+}
+
+// Shop infinite scroll: the next page of cards is fetched from /shop/cards
+// when the pagination comes into view. Without JavaScript the pagination links still work.
+function initializeInfiniteScroll() {
+    const grid = document.getElementById('product-grid');
+    const pagination = document.getElementById('shop-pagination');
+    if (!grid || !pagination || !grid.dataset.nextUrl || !('IntersectionObserver' in window)) {
+        return;
+    }
 
+    let loading = false;
+    const sentinel = document.createElement('div');
+    sentinel.className = 'text-center text-muted py-4';
+    pagination.replaceWith(sentinel);
+
+    const observer = new IntersectionObserver(function(entries) {
+        if (!entries[0].isIntersecting || loading || !grid.dataset.nextUrl) {
+            return;
+        }
+        loading = true;
+        sentinel.innerHTML = '<i class="fas fa-spinner fa-spin"></i>';
+        fetch(grid.dataset.nextUrl, {headers: {'X-Requested-With': 'fetch'}})
+            .then(function(response) {
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                grid.dataset.nextUrl = response.headers.get('X-Next-Page') || '';
+                return response.text();
+            })
+            .then(function(html) {
+                grid.insertAdjacentHTML('beforeend', html);
+                sentinel.innerHTML = '';
+                if (!grid.dataset.nextUrl) {
+                    observer.disconnect();
+                }
+            })
+            .catch(function() {
+                // Fall back to the plain pagination links
+                sentinel.replaceWith(pagination);
+                observer.disconnect();
+            })
+            .finally(function() {
+                loading = false;
+            });
+    }, {rootMargin: '600px 0px'});
+    observer.observe(sentinel);
+}
 
 // Quantity controls for product detail page
 function initializeQuantityControls() {
@@ -190,9 +258,9 @@ function initializeAdminFunctionality() {
         });
     });
 
-    // Auto-refresh for dashboard stats
-    if (window.location.pathname === '/admin') {
-        setInterval(refreshDashboardStats, 30000); // Refresh every 30 seconds
+    // Live order updates pushed by the server (dashboard and orders list)
+    if (document.querySelector('[data-live-orders]')) {
+        initializeLiveOrders();
     }
 
     // Product form image preview
@@ -238,19 +306,90 @@ function previewImage(input) {
     }
 }
 
-// Refresh dashboard stats
-function refreshDashboardStats() {
-    // This would typically fetch updated stats from the server
-    // For now, we'll just add a visual indicator that stats are being refreshed
-    const statsCards = document.querySelectorAll('.stats-card');
-    statsCards.forEach(card => {
-        card.style.opacity = '0.8';
-        setTimeout(() => {
-            card.style.opacity = '1';
-        }, 500);
+// Order statuses as shown in the admin tables
+const ORDER_STATUS_INFO = {
+    'pending': {text: 'قيد الانتظار', class: 'warning'},
+    'in_delivery': {text: 'في التوصيل', class: 'info'},
+    'delivered': {text: 'تم التسليم', class: 'success'}
+};
+
+// Subscribe to /admin/events; EventSource reconnects with Last-Event-ID by itself
+function initializeLiveOrders() {
+    if (!window.EventSource) return;
+
+    const tbody = document.querySelector('[data-live-orders]');
+    const source = new EventSource('/admin/events');
+
+    source.addEventListener('order_created', function(e) {
+        const order = JSON.parse(e.data);
+        adjustStat('total_orders', 1);
+        if (order.status === 'pending') adjustStat('pending_orders', 1);
+
+        if (tbody.dataset.liveOrders === 'dashboard') {
+            tbody.prepend(buildRecentOrderRow(order));
+            // Keep as many rows as the dashboard rendered
+            const limit = parseInt(tbody.dataset.liveLimit, 10);
+            while (limit && tbody.rows.length > limit) {
+                tbody.lastElementChild.remove();
+            }
+        } else {
+            const alert = document.getElementById('newOrdersAlert');
+            const count = document.getElementById('newOrdersCount');
+            if (alert && count) {
+                count.textContent = parseInt(count.textContent, 10) + 1;
+                alert.classList.remove('d-none');
+            }
+        }
+    });
+
+    source.addEventListener('status_changed', function(e) {
+        const order = JSON.parse(e.data);
+        if (order.previous_status === 'pending') adjustStat('pending_orders', -1);
+        if (order.status === 'pending') adjustStat('pending_orders', 1);
+
+        const row = tbody.querySelector(`tr[data-order-id="${order.id}"]`);
+        if (row) {
+            const badge = row.querySelector('.order-status-badge');
+            const info = ORDER_STATUS_INFO[order.status];
+            if (badge && info) {
+                badge.className = `badge bg-${info.class} order-status-badge`;
+                badge.textContent = info.text;
+            }
+            const select = row.querySelector('.status-select');
+            if (select) select.value = order.status;
+        }
+    });
+}
+
+function adjustStat(name, delta) {
+    document.querySelectorAll(`[data-stat="${name}"]`).forEach(el => {
+        el.textContent = parseInt(el.textContent, 10) + delta;
     });
 }
 
+function buildRecentOrderRow(order) {
+    const info = ORDER_STATUS_INFO[order.status] || ORDER_STATUS_INFO['pending'];
+    const created = new Date(order.created_at + 'Z');
+    const row = document.createElement('tr');
+    row.dataset.orderId = order.id;
+    row.innerHTML = `
+        <td class="fw-bold text-primary"></td>
+        <td><div></div><small class="text-muted"></small></td>
+        <td class="fw-bold"></td>
+        <td><span class="badge bg-${info.class} order-status-badge"></span></td>
+        <td><div></div><small class="text-muted"></small></td>
+        <td><a href="/admin/orders" class="btn btn-outline-primary btn-sm">عرض</a></td>`;
+    const cells = row.querySelectorAll('td');
+    cells[0].textContent = order.order_number;
+    cells[1].querySelector('div').textContent = order.customer_name;
+    cells[1].querySelector('small').textContent = order.customer_phone;
+    cells[2].textContent = `${Math.round(order.total_amount).toLocaleString('en-US')} دج`;
+    cells[3].querySelector('span').textContent = info.text;
+    cells[4].querySelector('div').textContent = created.toLocaleDateString('en-CA').replace(/-/g, '/');
+    cells[4].querySelector('small').textContent = created.toTimeString().slice(0, 5);
+    return row;
+}
+
 // Search functionality
 function initializeSearch() {
     const searchInput = document.querySelector('.search-input');
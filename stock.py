@@ -0,0 +1,84 @@
+from datetime import datetime
+from sqlalchemy import insert, select, update
+from app import db
+from events import mark_catalog_writes
+from models import Product, ProductChange
+
+
+def reserve_stock(cart_items):
+    """Take the ordered quantities out of stock, in the caller's transaction.
+
+    Each tracked product gets one conditional ``UPDATE ... WHERE stock >= q``,
+    so two checkouts can never both take the last units: the second one
+    re-checks the row after the first commits and matches nothing. Rows are
+    updated in id order so concurrent checkouts lock them in the same order.
+
+    Returns the lines that could not be served as dicts with ``product_id``,
+    ``name_ar``, ``requested`` and ``available``. When the list is not empty
+    the caller must roll back, other lines may already have been taken.
+    Raises ValueError for a quantity below 1, which would add stock.
+    """
+    shortages = []
+    reserved = []
+    for item in sorted(cart_items, key=lambda item: item['product'].id):
+        product, quantity = item['product'], item['quantity']
+        if not isinstance(quantity, int) or quantity < 1:
+            raise ValueError(f"Invalid quantity {quantity!r} for product {product.id}")
+        if product.stock is None:
+            continue
+        result = db.session.execute(
+            update(Product)
+            .where(Product.id == product.id, Product.stock >= quantity)
+            .values(stock=Product.stock - quantity,
+                    in_stock=Product.stock > quantity,
+                    updated_at=Product.updated_at),
+            execution_options={'synchronize_session': False})
+        if result.rowcount:
+            reserved.append(product.id)
+        else:
+            available = db.session.query(Product.stock).filter(Product.id == product.id).scalar()
+            shortages.append({'product_id': product.id, 'name_ar': product.name_ar,
+                              'requested': quantity, 'available': max(available or 0, 0)})
+    if reserved and not shortages:
+        _log_sold_out(reserved)
+    return shortages
+
+
+def _log_sold_out(product_ids):
+    # The Core UPDATE above bypasses the ORM flush hooks, so products that just
+    # ran out go to the change feed and the caches here
+    sold_out = db.session.execute(select(Product.id).where(
+        Product.id.in_(product_ids), Product.stock == 0)).scalars().all()
+    if sold_out:
+        now = datetime.utcnow()
+        db.session.execute(insert(ProductChange), [
+            {'product_id': product_id, 'op': 'upsert', 'created_at': now} for product_id in sold_out])
+        mark_catalog_writes(db.session(), products=sold_out)
+
+
+def parse_stock(value):
+    """``stock`` from an API body: None (not tracked) or a non-negative integer, ValueError otherwise"""
+    if value is None:
+        return None
+    error = ValueError('stock must be a non-negative integer or null')
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise error
+    try:
+        stock = int(value)
+    except (TypeError, ValueError):
+        raise error
+    if stock < 0:
+        raise error
+    return stock
+
+
+def limit_cart(cart, shortages):
+    """The session cart cut down to what is left in stock after a failed checkout"""
+    cart = dict(cart)
+    for shortage in shortages:
+        key = str(shortage['product_id'])
+        if shortage['available']:
+            cart[key] = shortage['available']
+        else:
+            cart.pop(key, None)
+    return cart
@@ -0,0 +1,226 @@
+import os
+import hashlib
+import logging
+import mimetypes
+import tempfile
+from flask import abort, redirect, send_from_directory
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # only needed for UPLOAD_STORAGE=s3
+    boto3 = None
+
+CHUNK_SIZE = 64 * 1024
+CACHE_MAX_AGE = 365 * 24 * 3600  # keys name their content, so a URL never changes meaning
+
+
+def content_key(digest, ext):
+    """``ab/cd/abcd...ef.jpg``: two levels of hash-prefix directories keep each one small"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}"
+
+
+def _hash_to(stream, out):
+    digest = hashlib.sha256()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        out.write(chunk)
+    return digest.hexdigest()
+
+
+class Storage:
+    """Where uploaded files live. Keys are relative paths such as ``ab/cd/<sha256>.jpg``.
+
+    Files saved before content addressing keep their flat ``name_uuid.ext`` keys.
+    """
+
+    def save(self, stream, ext):
+        """Store the content of ``stream`` and return its key. Identical content is stored once."""
+        raise NotImplementedError
+
+    def open(self, key):
+        """Binary file object for ``key``, FileNotFoundError if missing"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def files(self):
+        """Iterate over (key, size in bytes, modified timestamp) of every stored file"""
+        raise NotImplementedError
+
+    def temp_files(self):
+        """(path, size, modified timestamp) of leftover partial uploads"""
+        return []
+
+    def quarantine(self, key):
+        """Move ``key`` out of the served namespace without destroying it"""
+        raise NotImplementedError
+
+    def serve(self, key):
+        """Response for ``GET /uploads/<key>``"""
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, '.tmp')
+        self.quarantine_dir = os.path.join(root, '.quarantine')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def save(self, stream, ext):
+        # Hash while streaming into a temp file on the same filesystem, then
+        # rename it into place, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                digest = _hash_to(stream, out)
+                out.flush()
+                os.fsync(out.fileno())
+            key = content_key(digest, ext)
+            path = self.path(key)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+                # A fresh mtime keeps uploads-gc off a file about to be referenced again
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            return key
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def files(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [d for d in dirnames if d not in ('.tmp', '.quarantine')]
+            relative = os.path.relpath(dirpath, self.root)
+            for filename in filenames:
+                if filename.startswith('.'):  # .gitkeep and the like are not uploads
+                    continue
+                stat = os.stat(os.path.join(dirpath, filename))
+                key = filename if relative == '.' else f"{relative.replace(os.sep, '/')}/{filename}"
+                yield key, stat.st_size, stat.st_mtime
+
+    def temp_files(self):
+        for entry in os.scandir(self.tmp_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def quarantine(self, key):
+        target = os.path.join(self.quarantine_dir, *key.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(self.path(key), target)
+
+    def serve(self, key):
+        # .quarantine/ and .tmp/ live under root but are not part of the served namespace
+        if any(part.startswith('.') for part in key.split('/')):
+            abort(404)
+        return send_from_directory(self.root, key, max_age=CACHE_MAX_AGE)
+
+
+class S3Storage(Storage):
+    """Any S3-compatible object store (AWS, MinIO, R2...), served from ``public_url``"""
+
+    def __init__(self, bucket, endpoint_url=None, public_url=None, prefix='uploads/'):
+        if boto3 is None:
+            raise RuntimeError('UPLOAD_STORAGE=s3 needs boto3 installed')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_url = (public_url or f"{endpoint_url or 'https://s3.amazonaws.com'}/{bucket}").rstrip('/')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def save(self, stream, ext):
+        # The key depends on the hash, so spool the upload locally first
+        with tempfile.TemporaryFile() as spool:
+            key = content_key(_hash_to(stream, spool), ext)
+            # S3 serves objects with the type they were stored with, binary/octet-stream by default
+            content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+            if self.exists(key):
+                # Copying onto itself refreshes LastModified, see LocalStorage.save.
+                # REPLACE drops every header not passed again.
+                self.client.copy_object(Bucket=self.bucket, Key=self.prefix + key, MetadataDirective='REPLACE',
+                                        CopySource={'Bucket': self.bucket, 'Key': self.prefix + key},
+                                        CacheControl=f'public, max-age={CACHE_MAX_AGE}, immutable',
+                                        ContentType=content_type)
+            else:
+                spool.seek(0)
+                # A single PUT is atomic: the object appears whole or not at all
+                self.client.upload_fileobj(spool, self.bucket, self.prefix + key, ExtraArgs={
+                    'CacheControl': f'public, max-age={CACHE_MAX_AGE}, immutable',
+                    'ContentType': content_type})
+        return key
+
+    def open(self, key):
+        spool = tempfile.TemporaryFile()
+        try:
+            self.client.download_fileobj(self.bucket, self.prefix + key, spool)
+        except ClientError as e:
+            spool.close()
+            raise FileNotFoundError(key) from e
+        spool.seek(0)
+        return spool
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError:
+            return False
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def files(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):], item['Size'], item['LastModified'].timestamp()
+
+    def quarantine(self, key):
+        self.client.copy_object(Bucket=self.bucket, Key=f"quarantine/{self.prefix}{key}",
+                                CopySource={'Bucket': self.bucket, 'Key': self.prefix + key})
+        self.delete(key)
+
+    def serve(self, key):
+        return redirect(f"{self.public_url}/{self.prefix}{key}", code=301)
+
+
+def init_storage(app):
+    app.config.setdefault('UPLOAD_STORAGE', os.environ.get('UPLOAD_STORAGE', 'local'))
+    if app.config['UPLOAD_STORAGE'] == 's3':
+        storage = S3Storage(
+            bucket=app.config.get('S3_BUCKET', os.environ.get('S3_BUCKET')),
+            endpoint_url=app.config.get('S3_ENDPOINT_URL', os.environ.get('S3_ENDPOINT_URL')),
+            public_url=app.config.get('S3_PUBLIC_URL', os.environ.get('S3_PUBLIC_URL')),
+        )
+    else:
+        storage = LocalStorage(app.config['UPLOAD_FOLDER'])
+    app.extensions['storage'] = storage
+    logging.info("Upload storage: %s", type(storage).__name__)
+    return storage
@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+import pytest
+
+# app.py configures itself from the environment at import time, so point it
+# at throwaway storage before anything imports it
+_tmp = tempfile.mkdtemp(prefix='decluxdz-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ['PAGE_CACHE_DIR'] = os.path.join(_tmp, 'page_cache')
+os.environ['ANALYTICS_SNAPSHOT_PATH'] = os.path.join(_tmp, 'analytics_snapshot.npz')
+os.environ['FRAGMENT_CACHE_TYPE'] = 'null'
+os.environ['RATELIMIT_ENABLED'] = '0'
+
+from app import app as flask_app, db  # noqa: E402
+from models import Category, Customer, Product  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+
+@pytest.fixture
+def category(app):
+    category = Category(name='Bags', name_ar='حقائب')
+    db.session.add(category)
+    db.session.commit()
+    return category
+
+
+@pytest.fixture
+def make_product(category):
+    def make_product(**columns):
+        columns = {'name': 'Bag', 'name_ar': 'حقيبة', 'price': 1000, 'category_id': category.id, **columns}
+        product = Product(**columns)
+        db.session.add(product)
+        db.session.commit()
+        return product
+    return make_product
+
+
+@pytest.fixture
+def customer(app):
+    customer = Customer(name='Amina', phone='0555123456', phone_e164='+213555123456')
+    db.session.add(customer)
+    db.session.commit()
+    return customer
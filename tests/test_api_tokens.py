@@ -0,0 +1,67 @@
+import pytest
+
+from api_tokens import issue_token, revocations, revoke_token, verify_token
+from app import db
+from models import Admin
+
+
+@pytest.fixture
+def token(app):
+    admin = Admin(username='ops', email='ops@example.com', password_hash='x')
+    db.session.add(admin)
+    db.session.commit()
+    record, token = issue_token(admin, 'stock sync', ['products:read'])
+    db.session.commit()
+    revocations.invalidate()
+    return record, token
+
+
+def test_valid_token_carries_its_scopes(token):
+    claims = verify_token(token[1])
+    assert claims['s'] == ['products:read']
+
+
+def test_tampered_or_unknown_tokens_are_rejected(token):
+    assert verify_token(token[1][:-2] + 'xx') is None
+    assert verify_token('not-a-token') is None
+
+
+def test_revocation_takes_effect_on_commit(token):
+    record, value = token
+    assert verify_token(value) is not None  # loads the revocation set
+
+    revoke_token(record)
+    # A reload before the commit would cache the old set again
+    assert revocations._loaded_at != float('-inf')
+    db.session.commit()
+
+    assert verify_token(value) is None
+
+
+def test_rolled_back_revocation_leaves_the_cache_alone(token, monkeypatch):
+    record, value = token
+    verify_token(value)
+    invalidations = []
+    monkeypatch.setattr(revocations, 'invalidate', lambda: invalidations.append(True))
+
+    revoke_token(record)
+    db.session.rollback()
+    db.session.commit()
+
+    assert invalidations == []
+    assert verify_token(value) is not None
+
+
+def test_reload_racing_a_revocation_stays_stale(token, monkeypatch):
+    real_query = db.session.query
+
+    def query_during_a_revocation(*entities):
+        # Another request commits a revocation while the reload is reading
+        revocations.invalidate()
+        return real_query(*entities)
+    monkeypatch.setattr(db.session, 'query', query_during_a_revocation)
+
+    revocations.reload()
+
+    # The set may predate the revocation, so the next check reads it again
+    assert revocations._loaded_at == float('-inf')
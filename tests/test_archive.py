@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import archive
+from app import db
+from archive import archive_orders, find_order, order_totals, revenue_by_month, sales_by_wilaya, top_selling_products
+from models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem, OrderRollup, ProductSalesRollup
+
+OLD = datetime(2025, 1, 10, 12, 0)
+
+
+@pytest.fixture
+def orders(customer, make_product):
+    """Ids of five old orders over two days and two wilayas, the last three delivered, plus a recent one"""
+    bag, belt = make_product(), make_product(name_ar='حزام')
+    rows = [
+        # (status, days after OLD, wilaya, [(product, quantity, price)])
+        ('pending', 0, 'الجزائر', [(bag, 1, 1000)]),
+        ('in_delivery', 0, 'وهران', [(belt, 2, 500)]),
+        ('delivered', 0, 'الجزائر', [(bag, 2, 1000), (belt, 1, 500)]),
+        ('delivered', 0, 'وهران', [(bag, 1, 900)]),
+        ('delivered', 1, 'الجزائر', [(belt, 3, 450)]),
+        ('delivered', 400, 'وهران', [(bag, 1, 1000)]),
+    ]
+    created = []
+    for number, (status, days, wilaya, items) in enumerate(rows, 1):
+        when = OLD + timedelta(days=days)
+        order = Order(order_number=f'DLX{number:04d}', customer_id=customer.id, status=status, address='حي',
+                      wilaya=wilaya, total_amount=sum(q * p for _, q, p in items), created_at=when, updated_at=when)
+        order.items = [OrderItem(product_id=product.id, quantity=q, price=p) for product, q, p in items]
+        db.session.add(order)
+        created.append(order)
+    db.session.commit()
+    return [order.id for order in created]
+
+
+def _analytics():
+    return (sales_by_wilaya(), revenue_by_month(), order_totals(),
+            [(product.id, quantity, revenue) for product, quantity, revenue in top_selling_products()])
+
+
+def test_archives_only_old_delivered_orders(orders):
+    archived = archive_orders(older_than_days=90, batch_size=2)
+
+    assert archived == 3
+    assert sorted(o.order_number for o in ArchivedOrder.query) == ['DLX0003', 'DLX0004', 'DLX0005']
+    assert sorted(o.order_number for o in Order.query) == ['DLX0001', 'DLX0002', 'DLX0006']
+    assert ArchivedOrderItem.query.count() == 4
+    assert OrderItem.query.filter(OrderItem.order_id.in_(orders[2:5])).count() == 0
+    # Archived orders keep their ids and are still found by number
+    assert find_order('DLX0004').id == orders[3]
+
+
+def test_rollups_keep_analytics_totals(orders):
+    before = _analytics()
+
+    archive_orders(older_than_days=90, batch_size=2)
+
+    assert _analytics() == before
+    day = OLD.date()
+    rollups = {(r.day, r.wilaya): (r.order_count, r.revenue) for r in OrderRollup.query}
+    assert rollups == {(day, 'الجزائر'): (1, 2500), (day, 'وهران'): (1, 900),
+                       (day + timedelta(days=1), 'الجزائر'): (1, 1350)}
+    assert sum(r.quantity for r in ProductSalesRollup.query) == 7
+    assert order_totals(include_archive=False) == (3, 3000)
+
+
+def test_newest_order_is_never_archived(customer):
+    old = OLD - timedelta(days=400)
+    db.session.add(Order(order_number='DLX0001', customer_id=customer.id, status='delivered', address='حي',
+                         wilaya='الجزائر', total_amount=1, created_at=old, updated_at=old))
+    db.session.commit()
+
+    assert archive_orders(older_than_days=90) == 0
+    assert Order.query.count() == 1
+
+
+def test_status_change_after_selection_keeps_the_order_live(orders, monkeypatch):
+    real_batch = archive._archive_batch
+
+    def batch_after_a_return(order_ids, cutoff, now):
+        db.session.execute(db.update(Order).where(Order.id == orders[3]).values(status='returned'))
+        return real_batch(order_ids, cutoff, now)
+    monkeypatch.setattr(archive, '_archive_batch', batch_after_a_return)
+
+    assert archive_orders(older_than_days=90) == 2
+    assert db.session.get(Order, orders[3]).status == 'returned'
+    assert OrderItem.query.filter_by(order_id=orders[3]).count() == 1
+    assert db.session.get(ArchivedOrder, orders[3]) is None
+
+
+def test_dry_run_changes_nothing(orders):
+    assert archive_orders(older_than_days=90, dry_run=True) == 3
+    assert ArchivedOrder.query.count() == 0
+    assert OrderRollup.query.count() == 0
@@ -0,0 +1,95 @@
+import pytest
+
+from app import db
+from customers import (backfill_phones, customer_search_filter, find_or_create_customer,
+                       normalize_phone, phone_prefix)
+from models import Customer
+
+
+@pytest.mark.parametrize('raw', ['0555123456', '0555 12 34 56', '0555-12-34-56', '(0555) 12.34.56',
+                                 '555123456', '+213555123456', '+213 555 12 34 56', '00213555123456',
+                                 '+2130555123456'])
+def test_normalize_mobile_spellings(raw):
+    assert normalize_phone(raw) == '+213555123456'
+
+
+@pytest.mark.parametrize('raw', ['021 23 45 67', '021234567', '+21321234567', '0021321234567',
+                                 '+213 021 23 45 67'])
+def test_normalize_landline_spellings(raw):
+    assert normalize_phone(raw) == '+21321234567'
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('+33 6 12 34 56 78', '+33612345678'),
+    ('0033612345678', '+33612345678'),
+])
+def test_normalize_keeps_foreign_numbers(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+@pytest.mark.parametrize('raw', [None, '', 'abc', '0555', '+21355512345678', '+21391234567', '+1234'])
+def test_normalize_rejects_implausible_numbers(raw):
+    assert normalize_phone(raw) is None
+
+
+@pytest.mark.parametrize('search, expected', [
+    ('0555', '+213555'), ('0555 12', '+21355512'), ('+21355', '+21355'), ('00213', '+213'),
+    ('Amina', None), ('555', None),
+])
+def test_phone_prefix(search, expected):
+    assert phone_prefix(search) == expected
+
+
+def test_find_or_create_matches_any_spelling(customer):
+    assert find_or_create_customer('Amina B.', '+213 555 12 34 56').id == customer.id
+    assert find_or_create_customer('Amina', '00213555123456').id == customer.id
+
+
+def test_find_or_create_adopts_legacy_row(app):
+    legacy = Customer(name='Old', phone='0661 00 00 00')
+    db.session.add(legacy)
+    db.session.commit()
+
+    assert find_or_create_customer('Old', '0661 00 00 00').id == legacy.id
+    db.session.commit()
+    assert db.session.get(Customer, legacy.id).phone_e164 == '+213661000000'
+
+
+def test_find_or_create_recovers_from_a_racing_insert(app, monkeypatch):
+    db.session.add(Customer(name='First', phone='0771000000', phone_e164='+213771000000'))
+    db.session.commit()
+    # Both lookups miss, as if the other checkout committed right after them
+    query_class = type(Customer.query)
+    real_filter_by = query_class.filter_by
+    lookups = []
+
+    def filter_by(self, **criteria):
+        if 'phone_e164' in criteria:
+            lookups.append(criteria)
+            if len(lookups) <= 2:
+                return real_filter_by(self, id=-1)
+        return real_filter_by(self, **criteria)
+    monkeypatch.setattr(query_class, 'filter_by', filter_by)
+
+    customer = find_or_create_customer('Second', '+213 771 00 00 00')
+    db.session.commit()
+
+    assert len(lookups) == 3  # the insert failed and the row was looked up again
+    assert customer.name == 'First'
+    assert Customer.query.count() == 1
+
+
+def test_backfill_and_search_find_legacy_customers(app):
+    db.session.add_all([Customer(name='A', phone='0555123456'),
+                        Customer(name='B', phone='0555 12 34 56'),
+                        Customer(name='C', phone='021 23 45 67')])
+    db.session.commit()
+
+    backfill_phones()
+
+    rows = {c.name: c.phone_e164 for c in Customer.query}
+    # B spells A's number, it stays for customers-dedupe to merge
+    assert rows == {'A': '+213555123456', 'B': None, 'C': '+21321234567'}
+    found = {c.name for c in Customer.query.filter(customer_search_filter('0555'))}
+    assert found == {'A', 'B'}
+    assert {c.name for c in Customer.query.filter(customer_search_filter('021'))} == {'C'}
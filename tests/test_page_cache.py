@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+from app import db
+from models import Category
+from page_cache import STAMP_FILE, page_cache
+
+
+@pytest.fixture
+def visitor(app):
+    page_cache.clear()
+    yield app.test_client(use_cookies=False)
+    page_cache.clear()
+
+
+@pytest.fixture
+def cached(visitor, make_product):
+    """A product whose page, /shop and its category listing are cached"""
+    product = make_product()
+    for url in ('/shop', f'/shop?category={product.category_id}', f'/product/{product.id}'):
+        assert visitor.get(url).headers['X-Page-Cache'] == 'MISS'
+    return product
+
+
+def _cached(relative):
+    return os.path.isfile(page_cache.path(relative))
+
+
+def test_second_request_is_served_from_the_file(visitor, cached):
+    response = visitor.get(f'/product/{cached.id}')
+
+    assert response.headers['X-Page-Cache'] == 'HIT'
+    assert 'حقيبة' in response.get_data(as_text=True)
+
+
+def test_visitors_with_a_session_get_a_rendered_page(app, cached):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['admin_id'] = 1
+
+    assert 'X-Page-Cache' not in client.get('/shop').headers
+
+
+def test_product_edit_drops_its_page_and_the_listings(cached):
+    cached.price = 900
+    db.session.commit()
+
+    assert not _cached(f'product/{cached.id}.html')
+    assert not _cached('shop.html')
+    assert not _cached(f'shop/category/{cached.category_id}.html')
+
+
+def test_sale_drops_only_the_popularity_sorted_listings(app, cached):
+    client = app.test_client()
+    client.post('/api/cart', json={'product_id': cached.id, 'quantity': 1})
+    response = client.post('/api/checkout', json={'name': 'Amina', 'phone': '0555123456',
+                                                  'address': 'حي', 'wilaya': 'الجزائر'})
+
+    assert response.status_code == 200
+    assert not _cached('shop.html')
+    assert not _cached(f'shop/category/{cached.category_id}.html')
+    assert _cached(f'product/{cached.id}.html')
+
+
+def test_category_change_clears_every_page(cached):
+    db.session.add(Category(name='Belts', name_ar='أحزمة'))
+    db.session.commit()
+
+    assert not _cached(f'product/{cached.id}.html')
+
+
+def test_page_rendered_across_an_invalidation_is_not_stored(visitor, make_product):
+    product = make_product()
+    stamp = os.path.join(page_cache.directory, STAMP_FILE)
+    # As if a catalog change committed while the page was rendering
+    later = time.time() + 60
+    os.utime(stamp, (later, later))
+
+    response = visitor.get(f'/product/{product.id}')
+
+    assert response.status_code == 200
+    assert 'X-Page-Cache' not in response.headers
+    assert not _cached(f'product/{product.id}.html')
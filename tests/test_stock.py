@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+from flask import g
+
+from app import db
+from models import Product
+from stock import limit_cart, parse_stock, reserve_stock
+
+
+def _stock(product_id):
+    db.session.expire_all()
+    return db.session.get(Product, product_id)
+
+
+def test_reserve_takes_units_and_marks_sold_out(make_product):
+    product = make_product(stock=3)
+
+    assert reserve_stock([{'product': product, 'quantity': 2}]) == []
+    assert reserve_stock([{'product': product, 'quantity': 1}]) == []
+    db.session.commit()
+
+    product = _stock(product.id)
+    assert product.stock == 0
+    assert product.in_stock is False
+
+
+def test_reserve_reports_shortage_without_overselling(make_product):
+    product = make_product(stock=2)
+
+    shortages = reserve_stock([{'product': product, 'quantity': 3}])
+
+    assert shortages == [{'product_id': product.id, 'name_ar': product.name_ar,
+                          'requested': 3, 'available': 2}]
+    db.session.rollback()
+    assert _stock(product.id).stock == 2
+
+
+def test_reserve_ignores_untracked_products(make_product):
+    product = make_product(stock=None, in_stock=True)
+
+    assert reserve_stock([{'product': product, 'quantity': 50}]) == []
+    db.session.commit()
+    assert _stock(product.id).stock is None
+
+
+@pytest.mark.parametrize('quantity', [0, -5, 1.5, '2'])
+def test_reserve_rejects_quantities_that_would_add_stock(make_product, quantity):
+    product = make_product(stock=4)
+
+    with pytest.raises(ValueError):
+        reserve_stock([{'product': product, 'quantity': quantity}])
+    db.session.rollback()
+    assert _stock(product.id).stock == 4
+
+
+def test_concurrent_checkouts_cannot_both_take_the_last_unit(app, make_product):
+    product_id = make_product(stock=1).id
+    db.session.remove()
+    barrier = threading.Barrier(2)
+    results = []
+
+    def checkout():
+        with app.test_request_context(method='POST'):
+            g.db_write_transaction = True  # BEGIN IMMEDIATE, as write_transaction does
+            barrier.wait()
+            product = db.session.get(Product, product_id)
+            shortages = reserve_stock([{'product': product, 'quantity': 1}])
+            if shortages:
+                db.session.rollback()
+            else:
+                db.session.commit()
+            results.append(shortages)
+            db.session.remove()
+
+    threads = [threading.Thread(target=checkout) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(len(shortages) for shortages in results) == [0, 1]
+    assert _stock(product_id).stock == 0
+
+
+@pytest.mark.parametrize('value, expected', [(None, None), (0, 0), (7, 7), ('12', 12), (3.0, 3)])
+def test_parse_stock_accepts(value, expected):
+    assert parse_stock(value) == expected
+
+
+@pytest.mark.parametrize('value', [-1, '-1', 1.5, True, 'x', [], {}])
+def test_parse_stock_rejects(value):
+    with pytest.raises(ValueError):
+        parse_stock(value)
+
+
+def test_limit_cart_cuts_to_what_is_left():
+    cart = {'1': 5, '2': 3, '3': 1}
+    shortages = [{'product_id': 1, 'available': 2}, {'product_id': 2, 'available': 0}]
+
+    assert limit_cart(cart, shortages) == {'1': 2, '3': 1}
+
+
+def test_add_to_cart_never_stores_less_than_one_unit(app, make_product):
+    product = make_product(stock=10)
+    client = app.test_client()
+
+    client.post('/add_to_cart', data={'product_id': product.id, 'quantity': -5})
+    client.post('/api/cart', json={'product_id': product.id, 'quantity': -5})
+
+    with client.session_transaction() as session:
+        assert session['cart'] == {str(product.id): 2}
@@ -0,0 +1,80 @@
+import os
+import json
+import time
+import logging
+import click
+from app import app, db
+from models import Product, ProductImage
+
+GRACE_HOURS = 24  # files younger than this are never collected, see collect_orphans()
+STREAM_BATCH = 1000
+
+
+def referenced_keys():
+    """Every upload key the database points at, read in streamed batches"""
+    referenced = set()
+    rows = db.session.query(Product.image_url, Product.additional_images) \
+        .execution_options(yield_per=STREAM_BATCH)
+    for image_url, additional_images in rows:
+        if image_url:
+            referenced.add(image_url)
+        if additional_images:
+            # Galleries not yet moved to product_image
+            try:
+                referenced.update(f for f in json.loads(additional_images) if isinstance(f, str))
+            except ValueError:
+                pass
+    for (filename,) in db.session.query(ProductImage.filename).execution_options(yield_per=STREAM_BATCH):
+        referenced.add(filename)
+    return referenced
+
+
+def collect_orphans(storage, grace_hours=GRACE_HOURS, action='quarantine', dry_run=False):
+    """Delete or quarantine stored files no product references.
+
+    The referenced set is read before the files are listed, and only files
+    older than the grace period are touched. An upload still in flight is
+    either new or, when deduplicated, has just had its mtime refreshed, so
+    it is skipped even though its row is not committed yet.
+    Returns (files, bytes) reclaimed, or that would be with ``dry_run``.
+    """
+    referenced = referenced_keys()
+    cutoff = time.time() - grace_hours * 3600
+    count = reclaimed = 0
+    for key, size, modified in storage.files():
+        if key in referenced or modified >= cutoff:
+            continue
+        count += 1
+        reclaimed += size
+        if dry_run:
+            click.echo(f"  {key}  {size} bytes")
+            continue
+        if action == 'delete':
+            storage.delete(key)
+        else:
+            storage.quarantine(key)
+        logging.info("uploads-gc: %s %s (%d bytes)", action, key, size)
+
+    # Partial uploads left behind by a crashed worker
+    for path, size, modified in storage.temp_files():
+        if modified < cutoff:
+            count += 1
+            reclaimed += size
+            if dry_run:
+                click.echo(f"  {os.path.basename(path)} (partial upload)  {size} bytes")
+            else:
+                os.unlink(path)
+    return count, reclaimed
+
+
+@app.cli.command('uploads-gc')
+@click.option('--grace-hours', default=GRACE_HOURS, show_default=True,
+              help='Leave files modified more recently than this alone.')
+@click.option('--action', type=click.Choice(['quarantine', 'delete']), default='quarantine', show_default=True,
+              help='quarantine moves files to .quarantine/ so they can be restored.')
+@click.option('--dry-run', is_flag=True, help='List what would be reclaimed without touching anything.')
+def uploads_gc_command(grace_hours, action, dry_run):
+    """Remove uploaded files that no product or gallery references."""
+    count, reclaimed = collect_orphans(app.extensions['storage'], grace_hours, action, dry_run)
+    verb = 'Would reclaim' if dry_run else ('Deleted' if action == 'delete' else 'Quarantined')
+    click.echo(f"{verb} {count} files, {reclaimed / 1024:.1f} KiB")
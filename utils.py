@@ -1,8 +1,16 @@
 import os
-import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
 from werkzeug.utils import secure_filename
 
+try:
+    from PIL import Image
+except ImportError:  # image dimensions are left unknown
+    Image = None
+
+UPLOAD_WORKERS = 4
+
 # All 58 Algerian provinces
 ALGERIAN_PROVINCES = [
     "أدرار", "الشلف", "الأغواط", "أم البواقي", "باتنة", "بجاية", "بسكرة", "بشار",
@@ -23,25 +31,46 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_uploaded_file(file, folder=None):
+def save_uploaded_file(file, storage=None):
     if file and allowed_file(file.filename):
-        # نحدد المجلد: إذا ما عطيناش واحد، نستخدم UPLOAD_FOLDER من إعدادات Flask
-        upload_folder = folder or current_app.config['UPLOAD_FOLDER']
+        # نحدد التخزين: إذا ما عطيناش واحد، نستخدم تخزين التطبيق (انظر storage.py)
+        storage = storage or current_app.extensions['storage']
 
-        # نولّي نتأكد أن المجلد موجود
-        os.makedirs(upload_folder, exist_ok=True)
+        # الامتداد فقط، الاسم هو بصمة المحتوى فالصور المكررة تُخزن مرة واحدة
+        ext = os.path.splitext(secure_filename(file.filename))[1]
 
-        # نولّد اسم ملف فريد
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{name}_{uuid.uuid4().hex[:8]}{ext}"
+        return storage.save(file.stream, ext)  # نخزن المفتاح فقط في قاعدة البيانات
+    return None
 
-        # المسار النهائي
-        file_path = os.path.join(upload_folder, unique_filename)
-        file.save(file_path)
+def image_dimensions(fp):
+    """(width, height) of an image path or binary file, or (None, None) if it cannot be read"""
+    if Image is None:
+        return None, None
+    try:
+        with Image.open(fp) as image:
+            return image.size
+    except (OSError, ValueError):
+        logging.warning("Could not read image size of %s", getattr(fp, 'name', fp))
+        return None, None
 
-        return unique_filename  # نخزن الاسم فقط في قاعدة البيانات
-    return None
+def save_uploaded_files(files, storage=None):
+    """Save several uploads in parallel.
+
+    Returns (key, width, height) for each accepted file, in upload order.
+    """
+    storage = storage or current_app.extensions['storage']
+    files = [f for f in files if f and f.filename and allowed_file(f.filename)]
+
+    def save(file):
+        # Measure from the upload itself, the stored copy may be remote
+        width, height = image_dimensions(file.stream)
+        file.stream.seek(0)
+        return save_uploaded_file(file, storage), width, height
+
+    if len(files) < 2:
+        return [save(f) for f in files]
+    with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(files))) as executor:
+        return list(executor.map(save, files))
 def generate_order_number():
     """Generate a unique order number"""
     import random